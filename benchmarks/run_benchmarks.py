@@ -0,0 +1,221 @@
+"""
+Benchmark suite for the leftstim package. Times geometry primitives, figure construction
+and placement for every original target, random line generation at increasing line counts,
+replacing the figure with lines, encoding frames with each ImageEncoder mode, computing complexity
+metrics for single images and batches and (unless
+--skip-render is passed) end-to-end saving of image sets. Every benchmark uses a fixed seed, so that runs are comparable.
+
+Results are stored as JSON files in 'benchmarks/results' (named after the current git commit),
+and can be compared to a previous run using --compare:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<earlier file>.json
+
+On a machine without a display, pass --headless (requires pyglet's EGL-based headless mode)
+or --skip-render.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+
+from leftstim.analysis.ComplexityMetrics import ComplexityMetrics
+from leftstim.basic_components.Line import Line
+from leftstim.basic_components.Point import Point
+from leftstim.basic_components.RandomFunctions import RandomFunctions
+from leftstim.complex_components.Figure import Figure
+from leftstim.complex_components.Frame import Frame
+from leftstim.instrumentation.Profiler import Profiler
+from leftstim.original_targets.FigureLineCollections import FigureLineCollections
+from leftstim.original_targets.TargetTemplate import TargetTemplate
+from leftstim.storage.ImageEncoder import ImageEncoder
+
+SEED = 20220502
+LINE_COUNTS = (5, 10, 15)
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+def time_calls(fn, number, repeat):
+    """call fn() number times, repeat times over, and return timing statistics per call"""
+    RandomFunctions.default_rng = np.random.default_rng(SEED)
+    round_times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            fn()
+        round_times.append((time.perf_counter() - start_time) / number)
+    return {"number": number, "repeat": repeat,
+            "min_seconds": min(round_times), "median_seconds": statistics.median(round_times)}
+
+
+def new_image():
+    from leftstim.build import LeftImage
+    return LeftImage(500, 500, 300, 300, background_color=(1, 1, 1), line_color=(-1, -1, -1),
+                     line_width=1.8, units="pix", seed=SEED)
+
+
+def build_image(figure_name, num_lines):
+    """build an image the way the example scripts do, with the passed number of random lines"""
+    img = new_image()
+    img.add_figure_by_name(figure_name)
+    img.randomly_position_figure()
+    img.extend_two_thirds_figure_lines()
+    orientations = ["horizontal", "vertical", "diagonal"]
+    for _ in range(num_lines):
+        img.add_random_line(RandomFunctions.choice(img.rng, orientations))
+    return img
+
+
+def get_primitive_benchmarks():
+    point_a, point_b = Point(-20.5, 13.0), Point(117.25, -80.0)
+    line_a = Line(Point(-150, -100), Point(150, 120))
+    line_b = Line(Point(-150, 130), Point(140, -150))
+    return {
+        "point.dist": (lambda: point_a.dist(point_b), 20000),
+        "line.get_intersection": (lambda: line_a.get_intersection(line_b), 2000),
+        "line.get_random_point": (lambda: line_a.get_random_point(), 20000),
+    }
+
+
+def get_figure_benchmarks():
+    frame = Frame(Line(Point(-150, 150), Point(150, 150)), Line(Point(150, 150), Point(150, -150)))
+    benchmarks = {}
+    for name in FigureLineCollections.all_line_collections:
+        template = TargetTemplate.get_by_name(name)
+        benchmarks["figure.construct[{}]".format(name)] = \
+            (lambda template=template: Figure.from_template(template, frame), 200)
+
+        def place(template=template):
+            figure = Figure.from_template(template, frame)
+            figure.randomly_position()
+            figure.extend_line()
+        benchmarks["figure.place[{}]".format(name)] = (place, 200)
+    return benchmarks
+
+
+def get_image_benchmarks(skip_render):
+    benchmarks = {}
+    for num_lines in LINE_COUNTS:
+        benchmarks["image.add_random_line[{}]".format(num_lines)] = \
+            (lambda num_lines=num_lines: build_image("C3", num_lines), 5)
+
+    def replace():
+        img = build_image("C3", 10)
+        img.jiggle_non_fig_lines()
+        img.replace_figure_with_lines()
+    benchmarks["image.replace_figure_with_lines"] = (replace, 5)
+    if not skip_render:
+        out_dir = tempfile.mkdtemp(prefix="leftstim_benchmark_")
+        benchmarks["image.save_image_and_context"] = \
+            (lambda: build_image("C3", 10).save_image_and_context(out_dir), 3)
+    return benchmarks
+
+
+def get_encoder_benchmarks():
+    """times encoding a frame with each encoder mode, using a frame drawn with PIL (so that no
+    window is needed)"""
+    from PIL import Image, ImageDraw
+
+    frame_image = Image.new("RGB", (500, 500), (255, 255, 255))
+    draw = ImageDraw.Draw(frame_image)
+    for line in build_image("C3", 10).get_drawn_lines():
+        draw.line([(line.start_point.x + 250, 250 - line.start_point.y),
+                   (line.end_point.x + 250, 250 - line.end_point.y)], fill=(0, 0, 0), width=2)
+    out_dir = tempfile.mkdtemp(prefix="leftstim_benchmark_")
+    benchmarks = {}
+    for mode in ImageEncoder.modes:
+        for preset in ("fast", "archival"):
+            encoder = getattr(ImageEncoder, preset)(mode)
+            benchmarks["encoder.save[{},{}]".format(mode, preset)] = \
+                (lambda encoder=encoder: encoder.save(frame_image, os.path.join(out_dir, "frame.png"),
+                                                      (1, 1, 1), (-1, -1, -1)), 5)
+    return benchmarks
+
+
+def get_metrics_benchmarks():
+    """times computing complexity metrics for an image, and for a batch of 1000 random stimuli"""
+    metrics = ComplexityMetrics()
+    benchmarks = {}
+    for num_lines in LINE_COUNTS:
+        img = build_image("C3", num_lines)
+        benchmarks["metrics.compute[{} lines]".format(num_lines)] = (lambda img=img: metrics.compute(img), 50)
+    rng = np.random.default_rng(SEED)
+    batch = [(rng.uniform(-150, 150, (20, 4)), np.zeros(20, dtype=bool), rng.uniform(-50, 50, (6, 4)), (300, 300))
+             for _ in range(1000)]
+    benchmarks["metrics.compute_batch[1000x20 lines]"] = (lambda: metrics.compute_batch(batch), 2)
+    return benchmarks
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print("\ncompared to {} (commit {}):".format(baseline_path, baseline["commit"]))
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        ratio = result["min_seconds"] / baseline["benchmarks"][name]["min_seconds"]
+        print("{:<40} {:>7.2f}x {}".format(name, ratio, "(slower)" if ratio > 1.1 else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timing rounds per benchmark")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the number of calls per round by this")
+    parser.add_argument("--skip-render", action="store_true", help="skip benchmarks that render images")
+    parser.add_argument("--headless", action="store_true", help="render without a display (pyglet headless mode)")
+    parser.add_argument("--output-dir", default=RESULTS_DIR, help="directory to store results in")
+    parser.add_argument("--compare", help="path of an earlier results file to compare to")
+    args = parser.parse_args()
+
+    if args.headless:
+        import pyglet
+        pyglet.options["headless"] = True
+
+    benchmarks = {}
+    benchmarks.update(get_primitive_benchmarks())
+    benchmarks.update(get_figure_benchmarks())
+    benchmarks.update(get_image_benchmarks(args.skip_render))
+    benchmarks.update(get_encoder_benchmarks())
+    benchmarks.update(get_metrics_benchmarks())
+
+    results = {"commit": get_commit(), "python": platform.python_version(), "platform": platform.platform(),
+               "date": datetime.datetime.now().isoformat(timespec="seconds"), "seed": SEED, "benchmarks": {}}
+    for name, (fn, number) in benchmarks.items():
+        if args.filter not in name:
+            continue
+        with Profiler() as profiler:
+            result = time_calls(fn, max(1, int(number * args.scale)), args.repeat)
+        result["profile"] = profiler.summary()
+        results["benchmarks"][name] = result
+        print("{:<40} {:>12.1f} us".format(name, result["min_seconds"] * 1e6))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    file_name = "{}_{}.json".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f"), results["commit"])
+    with open(os.path.join(args.output_dir, file_name), "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
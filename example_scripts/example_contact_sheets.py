@@ -0,0 +1,28 @@
+"""
+NOTE that for this script to work, you must first move it to the project's root directory ('one level up').
+
+Example of how to review a generated corpus using contact sheets. The stimuli of a run are stored as
+geometry, and the sheets are drawn directly from the stored lines. Running the script again only builds
+the sheets of stimuli that have been added since.
+"""
+import os
+
+from leftstim.analysis.ContactSheet import ContactSheet
+from leftstim.analysis.StimulusValidator import StimulusValidator
+from leftstim.build.GenerationRun import GenerationRun
+from leftstim.build.Recipe import Recipe
+from leftstim.storage.GeometryStore import GeometryStore, GeometryStoreWriter
+
+RUN_DIR_NAME = "contact_sheet_run"
+NUM_SETS = 3000
+
+recipe = Recipe(min_extra_lines=6, max_extra_lines=10)
+run = GenerationRun(RUN_DIR_NAME, recipe=recipe, seeds=range(NUM_SETS))
+with GeometryStoreWriter(os.path.join(RUN_DIR_NAME, "geometry")) as writer:
+    run.run(writer, validator=StimulusValidator())
+
+# 60 stimuli per sheet, each shown as its image, the figure on its own and the context image
+contact_sheet = ContactSheet(columns=6, rows=10, thumbnail_size=96)
+store = GeometryStore(os.path.join(RUN_DIR_NAME, "geometry"))
+sheet_paths = contact_sheet.build_from_geometry(store, os.path.join(RUN_DIR_NAME, "contact_sheets"))
+print("{} sheets saved to {}".format(len(sheet_paths), os.path.join(RUN_DIR_NAME, "contact_sheets")))
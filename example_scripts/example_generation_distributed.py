@@ -0,0 +1,67 @@
+"""
+NOTE that for this script to work, you must first move it to the project's root directory ('one level up').
+
+Example of how to split one generation run across several machines (or processes). Every machine
+runs this script with the same number of shards and its own shard index, e.g. on the second of
+three machines:
+
+    python example_generation_distributed.py --shard 1 --num-shards 3
+
+Afterwards, copy the run directories to one place and combine them:
+
+    python example_generation_distributed.py --merge
+
+To try it out locally, '--local 3' runs three shards in separate processes and then merges them.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+
+from leftstim.analysis.StimulusValidator import StimulusValidator
+from leftstim.build.GenerationRun import GenerationRun
+from leftstim.build.Recipe import Recipe
+from leftstim.build.RunMerger import RunMerger
+from leftstim.storage.ManifestWriter import ManifestWriter
+from leftstim.storage.ShardWriter import ShardWriter
+
+RUNS_DIR_NAME = "distributed_runs"
+NUM_SETS = 300
+
+
+def run_shard(shard_index, num_shards):
+    run_dir = os.path.join(RUNS_DIR_NAME, "shard{}of{}".format(shard_index, num_shards))
+    # all shards must use the same recipe and seeds
+    recipe = Recipe(align_probability=0.25, min_extra_lines=5, max_extra_lines=8)
+    run = GenerationRun(run_dir, recipe=recipe, seeds=range(NUM_SETS), shard_index=shard_index, num_shards=num_shards)
+    with ShardWriter(os.path.join(run_dir, "shards")) as writer, \
+            ManifestWriter(os.path.join(run_dir, "manifest.csv")) as manifest:
+        run.run(writer, validator=StimulusValidator(), manifest=manifest)
+
+
+def merge():
+    merger = RunMerger(sorted(glob.glob(os.path.join(RUNS_DIR_NAME, "shard*"))))
+    problems = merger.merge(os.path.join(RUNS_DIR_NAME, "merged"), check=False)
+    # the merged directory can be read using ShardReader and ManifestWriter.read()
+    print("\n".join(problems) if problems else "merged without problems")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shard", type=int, default=0)
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--merge", action="store_true")
+    parser.add_argument("--local", type=int, default=0, help="run this many shards locally, then merge")
+    args = parser.parse_args()
+    if args.local:
+        processes = [multiprocessing.Process(target=run_shard, args=(shard_index, args.local))
+                     for shard_index in range(args.local)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        merge()
+    elif args.merge:
+        merge()
+    else:
+        run_shard(args.shard, args.num_shards)
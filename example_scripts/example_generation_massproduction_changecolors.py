@@ -1,12 +1,14 @@
 """
 NOTE that for this script to work, you must first move it to the project's root directory ('one level up').
 
-Example of how to generate large number of image sets.
+Example of how to generate large number of image sets, each saved in several colour schemes.
 """
 import os
-import random
 
+from leftstim.basic_components.RandomFunctions import RandomFunctions
 from leftstim.build import LeftImage
+from leftstim.storage.Colorways import Colorways
+from leftstim.storage.DirectorySink import DirectorySink
 
 SAVE_DIR_NAME = "generated_images"
 NUM_SETS = 30
@@ -14,14 +16,23 @@ NUM_SETS = 30
 if not os.path.isdir(SAVE_DIR_NAME):
     os.mkdir(SAVE_DIR_NAME)
 
+# each image is rendered once and then recoloured into these schemes (background color, line color),
+# rather than being built and rendered again for every scheme
+colorways = Colorways({"orange": ((0, 0, 0), (1, 0.3, -0.5)),
+                       "black_on_white": ((1, 1, 1), (-1, -1, -1)),
+                       "white_on_black": ((-1, -1, -1), (1, 1, 1))})
+sink = DirectorySink(os.path.join(os.getcwd(), SAVE_DIR_NAME))
+
 # use a for loop to generate as many image sets as desired
 for i in range(NUM_SETS):
     print(i)
-    # set background color to grey, and line color to orange
-    my_img = LeftImage(500, 500, 300, 300, background_color=(0, 0, 0), line_color=(1, 0.3, -0.5), line_width=1.8, units="pix")
+    # render with black lines on a white background, from which the colour schemes are produced. passing
+    # a seed makes the image's random elements (figure position, random lines etc.) reproducible, as
+    # long as all other random choices are made with the image's random number generator (my_img.rng)
+    my_img = LeftImage(500, 500, 300, 300, background_color=(1, 1, 1), line_color=(-1, -1, -1), line_width=1.8, units="pix", seed=i)
     # randomly select which figure to embed
-    figure_type = random.choice(['A', 'B', 'C', 'D'])
-    figure_number = random.choice(['1', '2', '3', '4'])
+    figure_type = RandomFunctions.choice(my_img.rng, ['A', 'B', 'C', 'D'])
+    figure_number = RandomFunctions.choice(my_img.rng, ['1', '2', '3', '4'])
     figure_id = figure_type + figure_number
     my_img.add_figure_by_name(figure_id)
     my_img.randomly_position_figure()
@@ -29,11 +40,11 @@ for i in range(NUM_SETS):
     extra_lines_no = 5
     for i in range(extra_lines_no):
         has_been_grown = False
-        grow_line = True if random.random() < 0.2 else False
+        grow_line = True if my_img.rng.random() < 0.2 else False
         if grow_line:
             has_been_grown = my_img.grow_figure_line()
         if not has_been_grown:
-            orientation = random.choice(['horizontal', 'vertical', 'diagonal'])
+            orientation = RandomFunctions.choice(my_img.rng, ['horizontal', 'vertical', 'diagonal'])
             my_img.add_random_line(orientation)
-    my_img.save_image_and_context(os.path.join(os.getcwd(), SAVE_DIR_NAME))
+    my_img.save_colorways_to_sink(sink, colorways)
     print('DONE\n\n\n')
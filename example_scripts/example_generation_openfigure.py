@@ -2,11 +2,12 @@
 NOTE that for this script to work, you must first move it to the project's root directory ('one level up').
 
 Example of how to use the package for generating a single L-EFT stimulus image,
-where target 'C3' has been embedded in a context image. The `random` calls
-ensure that certain aspects of the generation are pseudo-randomized.
+where target 'C3' has been embedded in a context image. The random choices
+below are made with the image's random number generator (`my_img.rng`), so
+passing a seed when creating the image makes the whole image reproducible.
 """
+from leftstim.basic_components.RandomFunctions import RandomFunctions
 from leftstim.build import LeftImage
-import random
 import os
 
 SAVE_DIR_NAME = "generated_images"
@@ -14,12 +15,12 @@ SAVE_DIR_NAME = "generated_images"
 my_img = LeftImage(500, 500, 300, 300, background_color=(1, 1, 1), line_color=(-1, -1, -1), line_width=1.8, units="pix")
 my_img.add_figure_by_name('C3')
 my_img.randomly_position_figure()
-should_attach = random.random() < 0.4
+should_attach = my_img.rng.random() < 0.4
 if should_attach:
     # attempt to move the figure so that one of its lines overlaps with
     # a 'frame' border
     my_img.align_figure_with_frame()
-should_shift = random.random() < 0.4
+should_shift = my_img.rng.random() < 0.4
 if should_shift:
     # attempt to move the figure so that one of its points lies on a
     # frame border
@@ -33,7 +34,7 @@ extra_lines_no = 5
 # use a for loop to add 5 extra lines
 for i in range(extra_lines_no):
     has_been_grown = False
-    grow_line = True if random.random() < 0.2 else False
+    grow_line = True if my_img.rng.random() < 0.2 else False
     if grow_line:
         # attempt to make one of the figure's lines 'grow', i.e. be
         # extended
@@ -41,7 +42,7 @@ for i in range(extra_lines_no):
     if not has_been_grown:
         # if it's not the case that one of the figure's lines was extended,
         # add a random line with a random orientation
-        orientation = random.choice(['horizontal', 'vertical', 'diagonal'])
+        orientation = RandomFunctions.choice(my_img.rng, ['horizontal', 'vertical', 'diagonal'])
         my_img.add_random_line(orientation)
 
 if not os.path.isdir(SAVE_DIR_NAME):
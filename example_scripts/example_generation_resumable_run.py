@@ -0,0 +1,28 @@
+"""
+NOTE that for this script to work, you must first move it to the project's root directory ('one level up').
+
+Example of how to generate a large number of image sets in a run that can be resumed if it is
+interrupted. Simply run the script again to continue where it stopped.
+"""
+import os
+
+from leftstim.analysis.StimulusValidator import StimulusValidator
+from leftstim.build.GenerationRun import GenerationRun
+from leftstim.build.Recipe import Recipe
+from leftstim.storage.ManifestWriter import ManifestWriter
+from leftstim.storage.ShardWriter import ShardWriter
+
+RUN_DIR_NAME = "generation_run"
+NUM_SETS = 1000
+
+# describe what the images should look like. every image is built from this recipe and its own seed
+recipe = Recipe(background_color=(0, 0, 0), line_color=(1, 0.3, -0.5), align_probability=0.25,
+                min_extra_lines=5, max_extra_lines=8)
+# if the run directory already holds a run, it is continued (with the recipe and seeds it was started with)
+run = GenerationRun(RUN_DIR_NAME, recipe=recipe, seeds=range(NUM_SETS))
+print("{} image sets left to generate".format(len(run.get_remaining_seeds())))
+
+with ShardWriter(os.path.join(RUN_DIR_NAME, "shards")) as writer, \
+        ManifestWriter(os.path.join(RUN_DIR_NAME, "manifest.csv")) as manifest:
+    run.run(writer, validator=StimulusValidator(), manifest=manifest)
+print('DONE')
@@ -0,0 +1,26 @@
+"""
+NOTE that for this script to work, you must first move it to the project's root directory ('one level up').
+
+Example of how to run a local stimulus service, e. g. for a web-based experiment running on the same
+machine. Once it is running, stimuli can be requested from e. g. a browser:
+
+    http://127.0.0.1:8000/stimulus?recipe=aligned&seed=12&variant=embeddedfigure
+    http://127.0.0.1:8000/metadata?recipe=aligned&seed=12
+    http://127.0.0.1:8000/stats
+"""
+import argparse
+
+from leftstim.analysis.StimulusValidator import StimulusValidator
+from leftstim.build.Recipe import Recipe
+from leftstim.service.StimulusService import StimulusService
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--backend", default="psychopy", choices=StimulusService.backends)
+    args = parser.parse_args()
+    recipes = {"default": Recipe(min_extra_lines=5, max_extra_lines=8),
+               "aligned": Recipe(align_probability=1, min_extra_lines=5, max_extra_lines=8)}
+    service = StimulusService(recipes, port=args.port, backend=args.backend, validator=StimulusValidator())
+    print("serving stimuli at " + service.url)
+    service.serve_forever()
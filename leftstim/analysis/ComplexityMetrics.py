@@ -0,0 +1,255 @@
+import numpy as np
+
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class ComplexityMetrics:
+    """
+    Computes metrics describing how hard it is to find the figure in a stimulus: the number of
+    points where two drawn lines cross ('num_intersections') or where one ends on another
+    ('num_junctions'), the number of non-figure lines crossing the figure's bounding box, the
+    fraction of the figure's length that is covered by collinear non-figure lines ('figure_coverage'),
+    and the total length of the drawn lines per frame area ('line_density'). The frame's lines are
+    left out. Intersections are found using a vectorized sweep over the lines' x ranges, so that only
+    lines whose bounding boxes overlap are tested, which also works on whole batches of stimuli at once.
+    """
+    metric_names = ("num_lines", "num_intersections", "num_junctions", "num_lines_crossing_figure_bbox",
+                    "figure_coverage", "total_line_length", "line_density")
+
+    def __init__(self, touch_tolerance=1e-3, collinear_tolerance=1, parallel_tolerance=0.035):
+        """generate a ComplexityMetrics instance
+        :param touch_tolerance: distance within which a line's end point counts as lying on another line
+        :type touch_tolerance: float
+        :param collinear_tolerance: maximum distance of a non-figure line from a figure line for it to count
+        as covering the figure line
+        :type collinear_tolerance: float
+        :param parallel_tolerance: maximum sine of the angle between two lines for them to be considered
+        parallel (see StimulusValidator)
+        :type parallel_tolerance: float"""
+        self.touch_tolerance = touch_tolerance
+        self.collinear_tolerance = collinear_tolerance
+        self.parallel_tolerance = parallel_tolerance
+
+    @staticmethod
+    def get_segments(tagged_lines):
+        """returns the passed (kind, Line) tuples (see LeftImage.get_tagged_drawn_lines()) as an array of
+        segments, (start x, start y, end x, end y), and an array of whether each line is a figure line
+        :return: (float array of shape (number of lines, 4), bool array)"""
+        segments = np.array([(line.start_point.x, line.start_point.y, line.end_point.x, line.end_point.y)
+                             for _, line in tagged_lines], dtype=np.float64).reshape(-1, 4)
+        is_figure = np.array([kind == "figure" for kind, _ in tagged_lines], dtype=bool)
+        return segments, is_figure
+
+    def compute(self, left_image):
+        """compute the metrics of the passed image's current geometry (of the image with the figure
+        embedded, so this should be done before the figure is replaced)
+        :type left_image: LeftImage
+        :return: dict"""
+        segments, is_figure = ComplexityMetrics.get_segments(left_image.get_tagged_drawn_lines(include_frame=False))
+        figure_segments, _ = ComplexityMetrics.get_segments(
+            left_image.get_tagged_drawn_just_figure_lines(include_frame=False))
+        return self.compute_batch([(segments, is_figure, figure_segments, left_image.frame_size)])[0]
+
+    def compute_store(self, store, items=None, batch_size=10000):
+        """compute the metrics of the stimuli in a GeometryStore, in batches
+        :type store: GeometryStore
+        :param items: stimulus ids or indices of the stimuli (all if None)
+        :type items: list
+        :param batch_size: number of stimuli per batch
+        :type batch_size: int
+        :return: iterator of dicts, in the order of items"""
+        figure_kind = store.line_kinds.index("figure")
+        frame_kind = store.line_kinds.index("frame")
+        items = range(len(store)) if items is None else items
+        for batch_start in range(0, len(items), batch_size):
+            stimuli = []
+            for item in items[batch_start:batch_start + batch_size]:
+                segments, kinds = store.get_segments(item, "embeddedfigure")
+                figure_segments, figure_kinds = store.get_segments(item, "onlyfigure")
+                metadata = store.metadata[store.get_index(item)]
+                stimuli.append((segments[kinds != frame_kind], kinds[kinds != frame_kind] == figure_kind,
+                                figure_segments[figure_kinds == figure_kind],
+                                (metadata["frame_width"], metadata["frame_height"])))
+            yield from self.compute_batch(stimuli)
+
+    def compute_batch(self, stimuli):
+        """compute the metrics of a batch of stimuli
+        :param stimuli: for each stimulus, a tuple of its drawn lines as segments (see get_segments()),
+        whether each of them is a figure line, the segments of the non-extended figure, and the size of
+        the frame as (width, height)
+        :type stimuli: list of tuples
+        :return: list of dicts"""
+        with Profiler.stage("metrics"):
+            segment_arrays = [np.asarray(segments, dtype=np.float64).reshape(-1, 4) for segments, _, _, _ in stimuli]
+            num_crossings, num_junctions = self.count_intersections(segment_arrays)
+            other_arrays = [segments[~np.asarray(is_figure, dtype=bool)]
+                            for segments, (_, is_figure, _, _) in zip(segment_arrays, stimuli)]
+            figure_arrays = [np.asarray(figure_segments, dtype=np.float64).reshape(-1, 4)
+                             for _, _, figure_segments, _ in stimuli]
+            num_bbox_crossings = ComplexityMetrics.count_bbox_crossings(other_arrays, figure_arrays)
+            figure_coverages = self.get_figure_coverages(figure_arrays, other_arrays)
+            results = []
+            for stimulus_no, (_, _, _, frame_size) in enumerate(stimuli):
+                total_length = float(ComplexityMetrics.get_lengths(segment_arrays[stimulus_no]).sum())
+                results.append({
+                    "num_lines": len(segment_arrays[stimulus_no]),
+                    "num_intersections": int(num_crossings[stimulus_no]),
+                    "num_junctions": int(num_junctions[stimulus_no]),
+                    "num_lines_crossing_figure_bbox": int(num_bbox_crossings[stimulus_no]),
+                    "figure_coverage": float(figure_coverages[stimulus_no]),
+                    "total_line_length": total_length,
+                    "line_density": total_length / (frame_size[0] * frame_size[1])
+                })
+            return results
+
+    @staticmethod
+    def concatenate(segment_arrays):
+        """returns the segments of all stimuli as one array, and the stimulus number of each segment
+        :return: (float array of shape (number of segments, 4), int array)"""
+        segments = np.concatenate(segment_arrays) if segment_arrays else np.zeros((0, 4))
+        stimulus_nos = np.repeat(np.arange(len(segment_arrays)), [len(array) for array in segment_arrays])
+        return segments, stimulus_nos
+
+    @staticmethod
+    def get_pairs(first_counts, second_counts):
+        """returns all pairs of an item of the first kind and an item of the second kind that belong to
+        the same stimulus, as indices into the concatenated items
+        :param first_counts: number of items of the first kind of each stimulus
+        :param second_counts: number of items of the second kind of each stimulus
+        :return: (first items' indices, second items' indices)"""
+        first_counts = np.asarray(first_counts, dtype=np.int64)
+        second_counts = np.asarray(second_counts, dtype=np.int64)
+        second_starts = np.cumsum(second_counts) - second_counts
+        first_stimulus_nos = np.repeat(np.arange(len(first_counts)), first_counts)
+        pair_counts = second_counts[first_stimulus_nos]
+        first = np.repeat(np.arange(first_counts.sum()), pair_counts)
+        pair_starts = np.cumsum(pair_counts) - pair_counts
+        second = second_starts[first_stimulus_nos[first]] + np.arange(pair_counts.sum()) - np.repeat(pair_starts,
+                                                                                                    pair_counts)
+        return first, second
+
+    @staticmethod
+    def get_lengths(segments):
+        return np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+
+    @staticmethod
+    def get_candidate_pairs(segment_arrays):
+        """returns all pairs of lines, within the same stimulus, whose bounding boxes overlap. the lines'
+        x ranges are shifted so that those of different stimuli can't overlap, then sorted, so that
+        the lines whose x ranges overlap that of a line follow it directly
+        :param segment_arrays: segments of each stimulus
+        :type segment_arrays: list of numpy arrays
+        :return: (segments of all stimuli, stimulus number of each line, first lines' indices, second
+        lines' indices)"""
+        segments, stimulus_nos = ComplexityMetrics.concatenate(segment_arrays)
+        if len(segments) == 0:
+            return segments, stimulus_nos, np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        min_x, max_x = np.minimum(segments[:, 0], segments[:, 2]), np.maximum(segments[:, 0], segments[:, 2])
+        min_y, max_y = np.minimum(segments[:, 1], segments[:, 3]), np.maximum(segments[:, 1], segments[:, 3])
+        stimulus_shift = stimulus_nos * (max_x.max() - min_x.min() + 1)
+        order = np.argsort(min_x + stimulus_shift, kind="stable")
+        sorted_min_x = (min_x + stimulus_shift)[order]
+        # for every line (in sorted order), the lines after it up to end start before it ends
+        ends = np.searchsorted(sorted_min_x, (max_x + stimulus_shift)[order], side="right")
+        counts = np.maximum(ends - np.arange(len(order)) - 1, 0)
+        first = np.repeat(np.arange(len(order)), counts)
+        second = first + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        first, second = order[first], order[second]
+        y_overlap = (min_y[first] <= max_y[second]) & (min_y[second] <= max_y[first])
+        return segments, stimulus_nos, first[y_overlap], second[y_overlap]
+
+    def count_intersections(self, segment_arrays):
+        """count the points where two lines cross, and where one line ends on another, in each stimulus
+        :param segment_arrays: segments of each stimulus
+        :type segment_arrays: list of numpy arrays
+        :return: (array of crossing counts, array of junction counts), one count per stimulus"""
+        segments, stimulus_nos, first, second = ComplexityMetrics.get_candidate_pairs(segment_arrays)
+        num_crossings = np.zeros(len(segment_arrays), dtype=int)
+        num_junctions = np.zeros(len(segment_arrays), dtype=int)
+        if len(first) == 0:
+            return num_crossings, num_junctions
+        start, direction = segments[first, :2], segments[first, 2:] - segments[first, :2]
+        other_start, other_direction = segments[second, :2], segments[second, 2:] - segments[second, :2]
+        denominator = direction[:, 0] * other_direction[:, 1] - direction[:, 1] * other_direction[:, 0]
+        lengths, other_lengths = np.hypot(*direction.T), np.hypot(*other_direction.T)
+        # parallel lines don't cross (overlapping collinear lines are measured by figure_coverage)
+        non_parallel = np.abs(denominator) > self.parallel_tolerance * lengths * other_lengths
+        offset = other_start - start
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (offset[:, 0] * other_direction[:, 1] - offset[:, 1] * other_direction[:, 0]) / denominator
+            u = (offset[:, 0] * direction[:, 1] - offset[:, 1] * direction[:, 0]) / denominator
+            t_tolerance, u_tolerance = self.touch_tolerance / lengths, self.touch_tolerance / other_lengths
+        touching = non_parallel & (t >= -t_tolerance) & (t <= 1 + t_tolerance) & \
+            (u >= -u_tolerance) & (u <= 1 + u_tolerance)
+        crossing = touching & (t > t_tolerance) & (t < 1 - t_tolerance) & (u > u_tolerance) & (u < 1 - u_tolerance)
+        np.add.at(num_crossings, stimulus_nos[first[crossing]], 1)
+        np.add.at(num_junctions, stimulus_nos[first[touching & ~crossing]], 1)
+        return num_crossings, num_junctions
+
+    @staticmethod
+    def count_bbox_crossings(segment_arrays, figure_arrays):
+        """count, for each stimulus, the passed lines that cross (or lie within) the bounding box of the
+        figure's segments
+        :param segment_arrays: segments of each stimulus
+        :type segment_arrays: list of numpy arrays
+        :param figure_arrays: segments of the figure of each stimulus
+        :type figure_arrays: list of numpy arrays
+        :return: int array"""
+        segments, stimulus_nos = ComplexityMetrics.concatenate(segment_arrays)
+        box_min = np.array([np.minimum(figure[:, :2], figure[:, 2:]).min(axis=0) if len(figure) else (np.inf, np.inf)
+                            for figure in figure_arrays]).reshape(-1, 2)[stimulus_nos]
+        box_max = np.array([np.maximum(figure[:, :2], figure[:, 2:]).max(axis=0) if len(figure) else (-np.inf, -np.inf)
+                            for figure in figure_arrays]).reshape(-1, 2)[stimulus_nos]
+        # clip each line to the box (Liang-Barsky), a line crosses the box if part of it remains
+        start, direction = segments[:, :2], segments[:, 2:] - segments[:, :2]
+        t_enter, t_exit = np.zeros(len(segments)), np.ones(len(segments))
+        inside = np.ones(len(segments), dtype=bool)
+        for axis in (0, 1):
+            moving = direction[:, axis] != 0
+            inside &= moving | ((start[:, axis] >= box_min[:, axis]) & (start[:, axis] <= box_max[:, axis]))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t_low = (box_min[:, axis] - start[:, axis]) / direction[:, axis]
+                t_high = (box_max[:, axis] - start[:, axis]) / direction[:, axis]
+            t_enter = np.where(moving, np.maximum(t_enter, np.minimum(t_low, t_high)), t_enter)
+            t_exit = np.where(moving, np.minimum(t_exit, np.maximum(t_low, t_high)), t_exit)
+        return np.bincount(stimulus_nos[inside & (t_enter <= t_exit)], minlength=len(segment_arrays))
+
+    def get_figure_coverages(self, figure_arrays, segment_arrays):
+        """returns, for each stimulus, the fraction of the total length of the figure's segments that is
+        covered by the passed (non-figure) segments running along them
+        :param figure_arrays: segments of the figure of each stimulus
+        :type figure_arrays: list of numpy arrays
+        :param segment_arrays: segments of each stimulus
+        :type segment_arrays: list of numpy arrays
+        :return: float array"""
+        figure_segments, figure_stimulus_nos = ComplexityMetrics.concatenate(figure_arrays)
+        segments, _ = ComplexityMetrics.concatenate(segment_arrays)
+        figure_lengths = ComplexityMetrics.get_lengths(figure_segments)
+        total_lengths = np.bincount(figure_stimulus_nos, weights=figure_lengths, minlength=len(figure_arrays))
+        figure_nos, segment_nos = ComplexityMetrics.get_pairs([len(array) for array in figure_arrays],
+                                                              [len(array) for array in segment_arrays])
+        figure_nos, segment_nos = figure_nos[figure_lengths[figure_nos] > 0], segment_nos[figure_lengths[figure_nos] > 0]
+        # position along the figure line and distance from it of both ends of every paired segment
+        units = (figure_segments[:, 2:] - figure_segments[:, :2])[figure_nos] / figure_lengths[figure_nos, None]
+        offsets = segments[segment_nos].reshape(-1, 2, 2) - figure_segments[figure_nos, None, :2]
+        along = (offsets * units[:, None, :]).sum(axis=2)
+        across = offsets[:, :, 0] * units[:, None, 1] - offsets[:, :, 1] * units[:, None, 0]
+        on_line = (np.abs(across) <= self.collinear_tolerance).all(axis=1)
+        figure_nos = figure_nos[on_line]
+        intervals = np.sort(np.clip(along[on_line], 0, figure_lengths[figure_nos, None]), axis=1)
+        covered_lengths = np.zeros(len(figure_arrays))
+        if len(intervals):
+            # merge the overlapping intervals of each figure line and add up their lengths. the intervals
+            # of different figure lines are shifted apart, so that they can all be merged at once
+            intervals = intervals + (figure_nos * (figure_lengths.max() + 1))[:, None]
+            intervals = intervals[np.argsort(intervals[:, 0], kind="stable")]
+            merged_ends = np.maximum.accumulate(intervals[:, 1])
+            new_run = np.concatenate([[True], intervals[1:, 0] > merged_ends[:-1]])
+            run_starts = np.nonzero(new_run)[0]
+            run_ends = np.concatenate([run_starts[1:] - 1, [len(intervals) - 1]])
+            run_lengths = merged_ends[run_ends] - intervals[run_starts, 0]
+            run_figure_nos = np.floor(intervals[run_starts, 0] / (figure_lengths.max() + 1)).astype(int)
+            covered_lengths = np.bincount(figure_stimulus_nos[run_figure_nos], weights=run_lengths,
+                                          minlength=len(figure_arrays))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total_lengths > 0, covered_lengths / total_lengths, 0.0)
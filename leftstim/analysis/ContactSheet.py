@@ -0,0 +1,279 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import math
+import os
+import zlib
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class ContactSheet:
+    """
+    Builds contact sheets for browsing a generated corpus: large images, each showing the thumbnails of
+    many stimuli in a grid, with every stimulus' variants (by default the image, the figure on its own and
+    the context image) side by side above its id. Thumbnails are made either from the coverage rasters of a
+    RasterDataset, downsampled a whole sheet at a time, or by drawing the lines of a GeometryStore directly
+    at the thumbnails' size. Sheets are built in parallel threads and are cached: building the sheets of a
+    corpus again only builds the sheets whose stimuli (their ids and contents) or settings have changed.
+    """
+    cache_file_name = "contact_sheets.json"
+
+    def __init__(self, columns=6, rows=10, thumbnail_size=96, variants=("embeddedfigure", "onlyfigure", "nofigure"),
+                 labels=True, supersample=2, num_workers=None):
+        """generate a ContactSheet instance
+        :param columns: number of stimuli per row of a sheet
+        :type columns: int
+        :param rows: number of rows of stimuli per sheet
+        :type rows: int
+        :param thumbnail_size: maximum width and height of each thumbnail, in pixels
+        :type thumbnail_size: int
+        :param variants: variants to show for each stimulus, from left to right
+        :type variants: tuple of str
+        :param labels: whether to write each stimulus' id below its thumbnails
+        :type labels: bool
+        :param supersample: factor by which lines from a GeometryStore are drawn larger than the
+        thumbnails, before being downsampled (which smooths their edges)
+        :type supersample: int
+        :param num_workers: number of sheets built at the same time (the number of CPUs if None)
+        :type num_workers: int"""
+        assert columns > 0 and rows > 0, "columns and rows must be at least 1"
+        assert thumbnail_size > 0, "thumbnail_size must be at least 1"
+        self.columns = columns
+        self.rows = rows
+        self.thumbnail_size = thumbnail_size
+        self.variants = tuple(variants)
+        self.labels = labels
+        self.supersample = supersample
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+        self.label_height = 12 if labels else 0
+        self.gap = 6
+
+    @property
+    def per_sheet(self):
+        """number of stimuli on each sheet"""
+        return self.columns * self.rows
+
+    def get_settings(self):
+        """returns the settings that affect what the sheets look like, which are part of each sheet's cache key
+        :return: dict"""
+        return {"columns": self.columns, "rows": self.rows, "thumbnail_size": self.thumbnail_size,
+                "variants": list(self.variants), "labels": self.labels, "supersample": self.supersample}
+
+    @staticmethod
+    def downsample(rasters, factor):
+        """returns the passed coverage rasters downsampled by an integer factor, each pixel being the mean
+        of a factor x factor block (pixels beyond the last whole block are cut off)
+        :param rasters: uint8 array of shape (..., height, width)
+        :type factor: int
+        :return: uint8 array of shape (..., height // factor, width // factor)"""
+        if factor == 1:
+            return np.asarray(rasters, dtype=np.uint8)
+        height, width = rasters.shape[-2] // factor, rasters.shape[-1] // factor
+        # the sums of up to 16 x 16 pixels fit into 16 bits
+        sum_dtype = np.uint16 if factor <= 16 else np.uint32
+        rows = np.asarray(rasters)[..., :height * factor, :width * factor].reshape(
+            rasters.shape[:-2] + (height, factor, width * factor))
+        # adding whole rows, and then whole columns, one block offset at a time is several times faster
+        # than summing over the block axes of the reshaped array
+        row_sums = rows[..., 0, :].astype(sum_dtype)
+        for offset in range(1, factor):
+            row_sums += rows[..., offset, :]
+        columns = row_sums.reshape(rasters.shape[:-2] + (height, width, factor))
+        sums = columns[..., 0].copy()
+        for offset in range(1, factor):
+            sums += columns[..., offset]
+        return ((sums + factor * factor // 2) // (factor * factor)).astype(np.uint8)
+
+    @staticmethod
+    def to_pixel_coords(segments, window_size, units):
+        """returns the passed segments, (start x, start y, end x, end y) in the passed units, as pixel
+        positions counted from the top left corner of the window (see LeftImage.to_pixel_coords())
+        :type segments: numpy array of shape (number of lines, 4)
+        :type window_size: tuple of int
+        :type units: str
+        :return: numpy array of shape (number of lines, 4)"""
+        assert units in ("pix", "norm", "height"), "only 'pix', 'norm' and 'height' units are supported"
+        width, height = window_size
+        scale = {"pix": (1, 1), "norm": (width / 2, height / 2), "height": (height, height)}[units]
+        segments = np.asarray(segments, dtype=np.float64) * np.tile(scale, 2)
+        return np.stack([width / 2 + segments[:, 0], height / 2 - segments[:, 1],
+                         width / 2 + segments[:, 2], height / 2 - segments[:, 3]], axis=1)
+
+    def get_raster_thumbnails(self, dataset, indices):
+        """returns the thumbnails of the passed sets of a RasterDataset, as coverage rasters
+        :type dataset: RasterDataset
+        :type indices: list of int
+        :return: uint8 array of shape (number of sets, number of variants, height, width)"""
+        factor = max(1, math.ceil(max(dataset.height, dataset.width) / self.thumbnail_size))
+        variant_positions = [dataset.variants.index(variant) for variant in self.variants]
+        indices = np.asarray(indices)
+        with Profiler.stage("thumbnails"):
+            if len(indices) and (np.diff(indices) == 1).all():
+                # a contiguous range of sets is read from the memory-mapped array as a single block
+                rasters = dataset.images[indices[0]:indices[-1] + 1]
+            else:
+                rasters = dataset.images[indices]
+            return ContactSheet.downsample(rasters[:, variant_positions], factor)
+
+    def render_geometry_thumbnails(self, store, indices):
+        """returns the thumbnails of the passed sets of a GeometryStore, drawn from their lines (using
+        the window size, units and line width in each set's metadata, if the store has metadata), as
+        coverage rasters
+        :type store: GeometryStore
+        :type indices: list of int
+        :return: uint8 array of shape (number of sets, number of variants, thumbnail_size, thumbnail_size)"""
+        canvas_size = self.thumbnail_size * self.supersample
+        thumbnails = np.zeros((len(indices), len(self.variants), canvas_size, canvas_size), dtype=np.uint8)
+        has_metadata = os.path.exists(os.path.join(store.directory, store.metadata_file_name))
+        with Profiler.stage("thumbnails"):
+            for position, index in enumerate(indices):
+                metadata = store.metadata[index] if has_metadata else {}
+                window_size = (metadata.get("window_width", 500), metadata.get("window_height", 500))
+                scale = canvas_size / max(window_size)
+                # windows that aren't square are centred on the thumbnail
+                offset = np.tile([(canvas_size - window_size[0] * scale) / 2,
+                                  (canvas_size - window_size[1] * scale) / 2], 2)
+                line_width = max(1, round(metadata.get("line_width", 1.8) * scale))
+                for variant_position, variant in enumerate(self.variants):
+                    segments, _ = store.get_segments(index, variant)
+                    pixel_segments = ContactSheet.to_pixel_coords(segments, window_size,
+                                                                  metadata.get("units", "pix")) * scale + offset
+                    canvas = Image.new("L", (canvas_size, canvas_size), 0)
+                    draw = ImageDraw.Draw(canvas)
+                    for segment in pixel_segments.tolist():
+                        draw.line(segment, fill=255, width=line_width)
+                    thumbnails[position, variant_position] = np.asarray(canvas)
+            return ContactSheet.downsample(thumbnails, self.supersample)
+
+    def assemble(self, thumbnails, stimulus_ids):
+        """returns a sheet showing the passed thumbnails, one stimulus after the other, row by row, with
+        dark lines on a white background. the thumbnails of all stimuli are placed at once, variant by variant
+        :param thumbnails: coverage rasters, as returned by get_raster_thumbnails()
+        :type thumbnails: uint8 array of shape (number of stimuli, number of variants, height, width)
+        :type stimulus_ids: list of str
+        :return: PIL.Image.Image"""
+        num_stimuli, num_variants, height, width = thumbnails.shape
+        tile_height = height + self.label_height + self.gap
+        tile_width = num_variants * (width + 1) - 1 + self.gap
+        with Profiler.stage("assemble"):
+            tiles = np.full((self.per_sheet, tile_height, tile_width), 255, dtype=np.uint8)
+            for variant_position in range(num_variants):
+                left = variant_position * (width + 1)
+                tiles[:num_stimuli, :height, left:left + width] = 255 - thumbnails[:, variant_position]
+                # thin grey lines around the thumbnails
+                tiles[:num_stimuli, height, left:left + width] = 160
+                if variant_position > 0:
+                    tiles[:num_stimuli, :height + 1, left - 1] = 160
+            sheet = tiles.reshape(self.rows, self.columns, tile_height, tile_width).transpose(0, 2, 1, 3).reshape(
+                self.rows * tile_height, self.columns * tile_width)
+            sheet_image = Image.fromarray(sheet)
+            if self.labels:
+                draw = ImageDraw.Draw(sheet_image)
+                for position, stimulus_id in enumerate(stimulus_ids):
+                    row, column = divmod(position, self.columns)
+                    draw.text((column * tile_width, row * tile_height + height + 1), stimulus_id, fill=0)
+        return sheet_image
+
+    @staticmethod
+    def get_raster_content_key(dataset, indices):
+        """returns a checksum of the rasters of the passed sets of a RasterDataset, as part of a sheet's
+        cache key, so that a sheet is built again if the dataset has been regenerated
+        :type dataset: RasterDataset
+        :type indices: list of int
+        :return: str"""
+        return " ".join(str(zlib.crc32(dataset.images[index].data)) for index in indices)
+
+    @staticmethod
+    def get_geometry_content_key(store, indices):
+        """returns a checksum of the lines (and metadata, which sets how they are drawn) of the passed
+        sets of a GeometryStore, as part of a sheet's cache key
+        :type store: GeometryStore
+        :type indices: list of int
+        :return: str"""
+        has_metadata = os.path.exists(os.path.join(store.directory, store.metadata_file_name))
+        checksums = []
+        for index in indices:
+            start, end = store.offsets[index, 0], store.offsets[index, -1]
+            checksum = zlib.crc32(np.ascontiguousarray(store.offsets[index] - start).data)
+            checksum = zlib.crc32(np.ascontiguousarray(store.segments[start:end]).data, checksum)
+            checksum = zlib.crc32(np.ascontiguousarray(store.kinds[start:end]).data, checksum)
+            if has_metadata:
+                checksum = zlib.crc32(json.dumps(store.metadata[index], sort_keys=True).encode("utf-8"), checksum)
+            checksums.append(str(checksum))
+        return " ".join(checksums)
+
+    def build_sheets(self, output_dir, stimulus_ids, indices, get_thumbnails, source_name, get_content_key=None):
+        """build the sheets for the passed stimuli (per_sheet stimuli per sheet, in the passed order) and
+        save them to the output directory as 'sheet_<number>.png', unless a sheet was built before with
+        the same stimuli and settings
+        :param get_thumbnails: function returning the thumbnails of the passed indices
+        :param source_name: identifies where the stimuli come from, as part of the sheets' cache keys
+        :type source_name: str
+        :param get_content_key: function returning a string that changes whenever the contents of the
+        passed indices' stimuli change, as part of the sheets' cache keys (e. g. get_raster_content_key()).
+        if None, only the stimuli's ids are used
+        :return: list of the sheets' paths"""
+        os.makedirs(output_dir, exist_ok=True)
+        cache_path = os.path.join(output_dir, ContactSheet.cache_file_name)
+        cache = {}
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                cache = json.load(f)
+        num_sheets = math.ceil(len(indices) / self.per_sheet)
+        settings = self.get_settings()
+
+        def build_sheet(sheet_number):
+            start = sheet_number * self.per_sheet
+            sheet_ids = stimulus_ids[start:start + self.per_sheet]
+            file_name = "sheet_{:05d}.png".format(sheet_number)
+            sheet_indices = indices[start:start + self.per_sheet]
+            content_key = get_content_key(sheet_indices) if get_content_key is not None else None
+            key = hashlib.sha1(json.dumps([source_name, settings, sheet_ids, content_key]).encode("utf-8")).hexdigest()
+            if cache.get(file_name) == key and os.path.exists(os.path.join(output_dir, file_name)):
+                Profiler.count("contact_sheet_cached")
+                return file_name, key
+            sheet = self.assemble(get_thumbnails(sheet_indices), sheet_ids)
+            with Profiler.stage("encode"):
+                sheet.save(os.path.join(output_dir, file_name), compress_level=1)
+            return file_name, key
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            built = list(executor.map(build_sheet, range(num_sheets)))
+        cache.update(built)
+        with open(cache_path, "w") as f:
+            json.dump(cache, f)
+        return [os.path.join(output_dir, file_name) for file_name, _ in built]
+
+    def build_from_rasters(self, dataset, output_dir, indices=None):
+        """build contact sheets of the sets of a RasterDataset
+        :type dataset: RasterDataset
+        :param output_dir: directory to save the sheets to (created if it doesn't exist)
+        :type output_dir: str
+        :param indices: indices of the sets to include, e. g. those of a subset to check (all if None)
+        :type indices: list of int
+        :return: list of the sheets' paths"""
+        indices = list(range(len(dataset))) if indices is None else list(indices)
+        stimulus_ids = [dataset.metadata[index].get("stimulus_id", str(index)) for index in indices]
+        return self.build_sheets(output_dir, stimulus_ids, indices,
+                                 lambda sheet_indices: self.get_raster_thumbnails(dataset, sheet_indices),
+                                 "rasters:" + os.path.abspath(dataset.directory),
+                                 lambda sheet_indices: ContactSheet.get_raster_content_key(dataset, sheet_indices))
+
+    def build_from_geometry(self, store, output_dir, indices=None):
+        """build contact sheets of the sets of a GeometryStore, drawing their lines at the thumbnails' size
+        :type store: GeometryStore
+        :param output_dir: directory to save the sheets to (created if it doesn't exist)
+        :type output_dir: str
+        :param indices: indices of the sets to include (all if None)
+        :type indices: list of int
+        :return: list of the sheets' paths"""
+        indices = list(range(len(store))) if indices is None else list(indices)
+        stimulus_ids = [store.ids[index] for index in indices]
+        return self.build_sheets(output_dir, stimulus_ids, indices,
+                                 lambda sheet_indices: self.render_geometry_thumbnails(store, sheet_indices),
+                                 "geometry:" + os.path.abspath(store.directory),
+                                 lambda sheet_indices: ContactSheet.get_geometry_content_key(store, sheet_indices))
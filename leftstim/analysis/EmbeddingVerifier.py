@@ -0,0 +1,225 @@
+import math
+
+import numpy as np
+
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class EmbeddingVerifier:
+    """
+    Checks whether a target figure is embedded in a set of drawn lines, i. e. whether every one of the
+    figure's segments, shifted by the same translation, lies on the drawn lines (within a tolerance).
+    A segment lies on the drawn lines if the drawn segments that are collinear with it together cover
+    it, so a figure line that is drawn as parts of several lines counts as well.
+
+    Drawn segments are hashed by their direction, so the segments that can be collinear with a figure
+    segment are looked up rather than searched for. Candidate translations are found using two
+    non-parallel figure segments: the figure can only be embedded with the first segment lying on one of
+    the drawn lines with the same direction, and the second one lying on one of the drawn lines with its
+    direction, which leaves a single translation for every pair of such drawn lines. Only these
+    translations are checked, starting with the figure segments that fit the fewest drawn lines.
+    """
+
+    def __init__(self, tolerance=1.0, angle_tolerance=0.01):
+        """generate an EmbeddingVerifier instance
+        :param tolerance: maximum distance of a figure segment from the drawn lines covering it, and
+        maximum length of a gap between them, in the units of the lines (e. g. about the line width)
+        :type tolerance: float
+        :param angle_tolerance: maximum angle between a figure segment and the drawn lines covering it, in
+        radians
+        :type angle_tolerance: float"""
+        assert tolerance > 0 and angle_tolerance > 0, "tolerance and angle_tolerance must be larger than 0"
+        self.tolerance = tolerance
+        self.angle_tolerance = angle_tolerance
+        self.num_buckets = max(1, int(math.pi / angle_tolerance))
+
+    @staticmethod
+    def to_segments(lines):
+        """returns the passed lines as an array of segments, (start x, start y, end x, end y)
+        :type lines: list of Line instances
+        :return: float array of shape (number of lines, 4)"""
+        return np.array([(line.start_point.x, line.start_point.y, line.end_point.x, line.end_point.y)
+                         for line in lines], dtype=np.float64).reshape(-1, 4)
+
+    def get_angles(self, segments):
+        """returns the direction of each segment, as an angle between 0 and pi
+        :return: float array"""
+        return np.arctan2(segments[:, 3] - segments[:, 1], segments[:, 2] - segments[:, 0]) % math.pi
+
+    def hash_directions(self, segments):
+        """returns the indices of the passed segments by direction bucket (each angle_tolerance wide)
+        :return: dict of int arrays"""
+        buckets = (self.get_angles(segments) / math.pi * self.num_buckets).astype(np.int64) % self.num_buckets
+        order = np.argsort(buckets, kind="stable")
+        keys, starts = np.unique(buckets[order], return_index=True)
+        return dict(zip(keys.tolist(), np.split(order, starts[1:])))
+
+    def get_compatible(self, target_segments, drawn_segments):
+        """returns, for every target segment, the indices of the drawn segments with (nearly) the same
+        direction, looked up in the direction hash of the drawn segments. a drawn line can pass within
+        tolerance of both ends of a short target segment at a larger angle than angle_tolerance, so the
+        angles looked up are widened accordingly for short segments
+        :return: list of int arrays"""
+        drawn_angles = self.get_angles(drawn_segments)
+        direction_hash = self.hash_directions(drawn_segments)
+        bucket_width = math.pi / self.num_buckets
+        lengths = np.hypot(target_segments[:, 2] - target_segments[:, 0], target_segments[:, 3] - target_segments[:, 1])
+        compatible = []
+        for angle, length in zip(self.get_angles(target_segments).tolist(), lengths.tolist()):
+            max_difference = max(self.angle_tolerance, math.asin(min(1.0, 2 * self.tolerance / max(length, 1e-12))))
+            bucket = int(angle / bucket_width) % self.num_buckets
+            num_shifts = min(self.num_buckets // 2, math.ceil(max_difference / bucket_width))
+            keys = {(bucket + shift) % self.num_buckets for shift in range(-num_shifts, num_shifts + 1)}
+            candidates = [direction_hash[key] for key in keys if key in direction_hash]
+            candidates = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+            angle_differences = np.abs(drawn_angles[candidates] - angle)
+            angle_differences = np.minimum(angle_differences, math.pi - angle_differences)
+            compatible.append(np.sort(candidates[angle_differences <= max_difference]))
+        return compatible
+
+    def is_covered(self, target_segment, drawn_segments):
+        """returns True if the passed target segment is covered by those of the passed drawn segments that
+        are collinear with it (the drawn segments must have the same direction as the target segment)
+        :type target_segment: float array of length 4
+        :type drawn_segments: float array of shape (number of segments, 4)
+        :return: bool"""
+        start, direction = target_segment[:2], target_segment[2:] - target_segment[:2]
+        length = math.hypot(direction[0], direction[1])
+        if length <= self.tolerance:
+            return True
+        unit = direction / length
+        # a drawn segment is collinear with the target segment if both of the target segment's ends lie
+        # within tolerance of the drawn segment's line
+        drawn_directions = drawn_segments[:, 2:] - drawn_segments[:, :2]
+        drawn_lengths = np.maximum(np.hypot(drawn_directions[:, 0], drawn_directions[:, 1]), 1e-12)
+        collinear = np.ones(len(drawn_segments), dtype=bool)
+        for point in (start, target_segment[2:]):
+            offsets = point - drawn_segments[:, :2]
+            collinear &= np.abs(drawn_directions[:, 0] * offsets[:, 1] - drawn_directions[:, 1] * offsets[:, 0]) \
+                <= self.tolerance * drawn_lengths
+        if not collinear.any():
+            return False
+        # positions of the collinear segments' end points along the target segment
+        offsets_start = drawn_segments[collinear, :2] - start
+        offsets_end = drawn_segments[collinear, 2:] - start
+        positions = np.stack([offsets_start @ unit, offsets_end @ unit], axis=1)
+        intervals = np.sort(positions, axis=1)
+        intervals = intervals[np.argsort(intervals[:, 0])]
+        # walk along the target segment, from interval to interval, until a gap is found
+        covered_until = 0.0
+        for interval_start, interval_end in intervals.tolist():
+            if interval_start > covered_until + self.tolerance:
+                break
+            covered_until = max(covered_until, interval_end)
+            if covered_until >= length - self.tolerance:
+                return True
+        return False
+
+    def get_missing(self, target_segments, drawn_segments, translation=(0, 0), compatible=None):
+        """returns the indices of the target segments that, shifted by the passed translation, are not
+        covered by the drawn segments
+        :type target_segments: float array of shape (number of segments, 4)
+        :type drawn_segments: float array of shape (number of segments, 4)
+        :param translation: shift of the target segments, (x, y)
+        :param compatible: drawn segments with the same direction as each target segment (see
+        get_compatible()), if already computed
+        :return: list of int"""
+        if compatible is None:
+            compatible = self.get_compatible(target_segments, drawn_segments)
+        shifted = target_segments + np.tile(translation, 2)
+        return [index for index in range(len(shifted))
+                if not self.is_covered(shifted[index], drawn_segments[compatible[index]])]
+
+    def get_candidate_translations(self, target_segments, drawn_segments, compatible):
+        """returns the translations for which the midpoints of two non-parallel target segments (those
+        with the fewest compatible drawn segments) both lie on the lines of drawn segments with their
+        directions
+        :return: float array of shape (number of translations, 2)"""
+        order = sorted(range(len(target_segments)), key=lambda index: len(compatible[index]))
+        anchor = order[0]
+        directions = target_segments[:, 2:] - target_segments[:, :2]
+        directions = directions / np.maximum(np.hypot(directions[:, 0], directions[:, 1]), 1e-12)[:, None]
+        second = next((index for index in order[1:]
+                       if abs(directions[anchor, 0] * directions[index, 1] -
+                              directions[anchor, 1] * directions[index, 0]) > 0.1), None)
+        midpoints = (target_segments[:, :2] + target_segments[:, 2:]) / 2
+
+        def get_constraints(index):
+            # the midpoint shifted by translation t lies on a drawn line if normal . t = normal . (point on
+            # the line - midpoint), using the drawn line's own normal
+            lines = drawn_segments[compatible[index]]
+            line_directions = lines[:, 2:] - lines[:, :2]
+            normals = np.stack([-line_directions[:, 1], line_directions[:, 0]], axis=1)
+            normals /= np.maximum(np.hypot(normals[:, 0], normals[:, 1]), 1e-12)[:, None]
+            return normals, ((lines[:, :2] - midpoints[index]) * normals).sum(axis=1)
+
+        anchor_normals, anchor_values = get_constraints(anchor)
+        if second is None:
+            # all target segments are parallel, so the translation along them is found by aligning the
+            # anchor's ends with the ends of the drawn segments instead
+            lines = drawn_segments[compatible[anchor]]
+            along = np.concatenate([(ends - target_segments[anchor, start:start + 2]) @ directions[anchor]
+                                    for ends in (lines[:, :2], lines[:, 2:]) for start in (0, 2)])
+            translations = np.tile(anchor_normals * anchor_values[:, None], (4, 1)) + \
+                np.outer(along, directions[anchor])
+        else:
+            second_normals, second_values = get_constraints(second)
+            # solve the two constraints for every pair of drawn lines at once
+            a_x, a_y, a_v = (np.repeat(values, len(second_values))
+                             for values in (anchor_normals[:, 0], anchor_normals[:, 1], anchor_values))
+            b_x, b_y, b_v = (np.tile(values, len(anchor_values))
+                             for values in (second_normals[:, 0], second_normals[:, 1], second_values))
+            determinants = a_x * b_y - a_y * b_x
+            solvable = np.abs(determinants) > 1e-9
+            translations = np.stack([(a_v * b_y - a_y * b_v)[solvable] / determinants[solvable],
+                                     (a_x * b_v - a_v * b_x)[solvable] / determinants[solvable]], axis=1)
+        # translations that are (nearly) the same are only checked once
+        _, unique_positions = np.unique(np.round(translations / (self.tolerance / 4)), axis=0, return_index=True)
+        return translations[np.sort(unique_positions)]
+
+    def find_embedding(self, target_segments, drawn_segments, check_first=(0, 0)):
+        """returns a translation by which the target segments can be shifted so that they all lie on the
+        drawn segments, or None if there is none
+        :type target_segments: float array of shape (number of segments, 4)
+        :type drawn_segments: float array of shape (number of segments, 4)
+        :param check_first: translation to check before all others (e. g. (0, 0) for the figure's own
+        position), or None
+        :return: (float, float) or None"""
+        if not len(target_segments):
+            return (0.0, 0.0)
+        with Profiler.stage("embedding"):
+            compatible = self.get_compatible(target_segments, drawn_segments)
+            if any(not len(indices) for indices in compatible):
+                return None
+            # segments that fit the fewest drawn lines are the most likely to rule out a translation
+            order = sorted(range(len(target_segments)), key=lambda index: len(compatible[index]))
+            candidates = self.get_candidate_translations(target_segments, drawn_segments, compatible)
+            if check_first is not None:
+                candidates = np.concatenate([np.array([check_first], dtype=np.float64), candidates])
+            for translation in candidates:
+                shifted = target_segments + np.tile(translation, 2)
+                if all(self.is_covered(shifted[index], drawn_segments[compatible[index]]) for index in order):
+                    return float(translation[0]), float(translation[1])
+        return None
+
+    def check_store(self, store, items=None):
+        """check the sets of a GeometryStore: whether the figure's lines (the 'figure' lines of the
+        'onlyfigure' variant, i. e. without those lying on the frame) are covered by the lines of the
+        'embeddedfigure' variant, and whether the figure is still embedded anywhere in the 'nofigure' variant
+        :type store: GeometryStore
+        :param items: stimulus ids or indices of the sets to check (all if None)
+        :type items: list
+        :return: iterator of dicts with keys 'stimulus_id', 'num_missing' (number of figure lines missing
+        from the embedded image) and 'nofigure_translation' (translation by which the figure is embedded
+        in the context image, or None)"""
+        figure_kind = store.line_kinds.index("figure")
+        items = range(len(store)) if items is None else items
+        for item in items:
+            index = store.get_index(item)
+            figure_segments, kinds = store.get_segments(index, "onlyfigure")
+            target_segments = np.asarray(figure_segments[kinds == figure_kind], dtype=np.float64)
+            embedded_segments = np.asarray(store.get_segments(index, "embeddedfigure")[0], dtype=np.float64)
+            nofigure_segments = np.asarray(store.get_segments(index, "nofigure")[0], dtype=np.float64)
+            yield {"stimulus_id": store.ids[index],
+                   "num_missing": len(self.get_missing(target_segments, embedded_segments)),
+                   "nofigure_translation": self.find_embedding(target_segments, nofigure_segments)}
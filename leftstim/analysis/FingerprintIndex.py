@@ -0,0 +1,95 @@
+import random
+
+
+class FingerprintIndex:
+    __prime = (1 << 61) - 1
+
+    def __init__(self, threshold=0.8, num_bands=16, rows_per_band=4, seed=0):
+        """generate a FingerprintIndex instance, which uses MinHash locality-sensitive hashing
+        to find previously added GeometricFingerprints that are similar to a queried one, without
+        comparing against every fingerprint in the index
+        :param threshold: minimum Jaccard similarity for two fingerprints to count as near-duplicates
+        :type threshold: float
+        :param num_bands: number of LSH bands. more bands catch more near-duplicates, at the cost
+        of more candidates to check
+        :type num_bands: int
+        :param rows_per_band: number of MinHash values per band. more rows make each band more selective
+        :type rows_per_band: int
+        :param seed: seed for generating the MinHash functions. indexes that are to be compared
+        or merged must use the same seed
+        :type seed: int"""
+        self.threshold = threshold
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        hash_rng = random.Random(seed)
+        num_hashes = num_bands * rows_per_band
+        self.hash_params = [(hash_rng.randrange(1, self.__prime), hash_rng.randrange(0, self.__prime))
+                            for _ in range(num_hashes)]
+        self.buckets = {}
+        self.fingerprints = {}
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def get_signature(self, fingerprint):
+        """returns the MinHash signature of the passed fingerprint's tokens
+        :type fingerprint: GeometricFingerprint
+        :return: tuple of int"""
+        tokens = fingerprint.get_tokens()
+        if not tokens:
+            return tuple(0 for _ in self.hash_params)
+        return tuple(min((a * token + b) % self.__prime for token in tokens) for a, b in self.hash_params)
+
+    def get_band_keys(self, fingerprint):
+        """returns the bucket keys of the passed fingerprint, one per band. fingerprints for
+        different figures never share a bucket
+        :type fingerprint: GeometricFingerprint
+        :return: list of tuples"""
+        signature = self.get_signature(fingerprint)
+        rows = self.rows_per_band
+        return [(fingerprint.figure_name, band, signature[band * rows:(band + 1) * rows])
+                for band in range(self.num_bands)]
+
+    def add(self, key, fingerprint):
+        """add the passed fingerprint to the index, identified by the passed key
+        :param key: identifier of the stimulus, e. g. its file name
+        :type key: hashable
+        :type fingerprint: GeometricFingerprint
+        :return: None"""
+        self.fingerprints[key] = fingerprint
+        for band_key in self.get_band_keys(fingerprint):
+            self.buckets.setdefault(band_key, []).append(key)
+
+    def query(self, fingerprint):
+        """returns the keys of all fingerprints in the index that are at least threshold similar to
+        the passed fingerprint, along with their similarity, most similar first
+        :type fingerprint: GeometricFingerprint
+        :return: list of (key, float) tuples"""
+        candidate_keys = set()
+        for band_key in self.get_band_keys(fingerprint):
+            candidate_keys.update(self.buckets.get(band_key, ()))
+        matches = []
+        for key in candidate_keys:
+            similarity = fingerprint.similarity(self.fingerprints[key])
+            if similarity >= self.threshold:
+                matches.append((key, similarity))
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    def has_near_duplicate(self, fingerprint):
+        """returns True if the index holds a fingerprint that is at least threshold similar to the
+        passed fingerprint, otherwise returns False
+        :type fingerprint: GeometricFingerprint
+        :return: bool"""
+        return bool(self.query(fingerprint))
+
+    def add_if_new(self, key, fingerprint):
+        """add the passed fingerprint to the index and return True, unless the index already holds
+        a near-duplicate of it (in that case return False)
+        :param key: identifier of the stimulus, e. g. its file name
+        :type key: hashable
+        :type fingerprint: GeometricFingerprint
+        :return: bool"""
+        if self.has_near_duplicate(fingerprint):
+            return False
+        self.add(key, fingerprint)
+        return True
@@ -0,0 +1,88 @@
+import hashlib
+import struct
+
+from leftstim.basic_components.FigureLine import FigureLine
+
+
+class GeometricFingerprint:
+    def __init__(self, segment_hashes, figure_name=None, figure_position=None):
+        """generate a GeometricFingerprint instance, representing a stimulus' geometry as an
+        order-independent set of quantized line segment hashes
+        :param segment_hashes: hashes of the stimulus' quantized line segments
+        :type segment_hashes: iterable of int
+        :param figure_name: name of the stimulus' figure, or None if there is no figure
+        :type figure_name: str
+        :param figure_position: quantized (x, y) coordinates of the figure's lower left corner
+        :type figure_position: tuple of int"""
+        self.segment_hashes = frozenset(segment_hashes)
+        self.figure_name = figure_name
+        self.figure_position = figure_position
+
+    def __key(self):
+        return self.segment_hashes, self.figure_name, self.figure_position
+
+    def __eq__(self, other_fingerprint):
+        if isinstance(other_fingerprint, GeometricFingerprint):
+            return self.__key() == other_fingerprint.__key()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    @classmethod
+    def from_image(cls, left_image, quantum=4):
+        """generate the fingerprint of the passed image's current geometry. coordinates are
+        rounded to multiples of quantum before hashing, so that lines that differ by less than
+        (roughly) quantum units get the same hash
+        :param left_image: image to generate the fingerprint for
+        :type left_image: LeftImage
+        :param quantum: quantization step, in the image's units
+        :type quantum: float
+        :return: GeometricFingerprint"""
+        segment_hashes = []
+        for line in left_image.get_all_lines():
+            if isinstance(line, FigureLine):
+                start_point, end_point = line.start_ext_point, line.end_ext_point
+            else:
+                start_point, end_point = line.start_point, line.end_point
+            segment_hashes.append(cls.hash_segment(start_point, end_point, quantum))
+        if left_image.figure is None:
+            return cls(segment_hashes)
+        figure = left_image.nonextended_figure
+        figure_position = (round(figure.get_lowest_x_coord() / quantum),
+                           round(figure.get_lowest_y_coord() / quantum))
+        return cls(segment_hashes, figure.figure_name, figure_position)
+
+    @staticmethod
+    def hash_segment(start_point, end_point, quantum=4):
+        """returns a stable 64 bit hash of the quantized segment running between the passed points.
+        the hash does not depend on which of the points is the start point
+        :type start_point: Point
+        :type end_point: Point
+        :param quantum: quantization step
+        :type quantum: float
+        :return: int"""
+        ends = sorted(((round(start_point.x / quantum), round(start_point.y / quantum)),
+                       (round(end_point.x / quantum), round(end_point.y / quantum))))
+        digest = hashlib.blake2b(struct.pack("<4q", *ends[0], *ends[1]), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def get_tokens(self):
+        """returns the set of hashes that identify this fingerprint, i. e. its segment hashes plus
+        a hash representing the figure's placement
+        :return: set of int"""
+        if self.figure_name is None:
+            return set(self.segment_hashes)
+        placement = "{}:{}:{}".format(self.figure_name, *self.figure_position).encode()
+        digest = hashlib.blake2b(placement, digest_size=8).digest()
+        return set(self.segment_hashes) | {int.from_bytes(digest, "little")}
+
+    def similarity(self, other_fingerprint):
+        """returns the Jaccard similarity (0 to 1) of this and the passed other fingerprint's tokens
+        :type other_fingerprint: GeometricFingerprint
+        :return: float"""
+        tokens = self.get_tokens()
+        other_tokens = other_fingerprint.get_tokens()
+        if not tokens and not other_tokens:
+            return 1.0
+        return len(tokens & other_tokens) / len(tokens | other_tokens)
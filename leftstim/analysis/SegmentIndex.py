@@ -0,0 +1,241 @@
+import math
+
+import numpy as np
+
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class SegmentIndex:
+    """
+    A spatial index of a stimulus' lines, for quickly finding the line nearest to a point, e. g. to
+    score a participant's click on (or tracing of) the embedded figure while the stimulus is shown. The
+    lines are sorted into the cells of a uniform grid over the frame, each line into every cell it
+    passes through, so that a query only has to measure the distance to the lines in the cells around
+    the queried point. Cells further away are only searched if the nearest line found so far could lie
+    outside the cells searched, so the result is always the truly nearest line.
+    """
+
+    def __init__(self, tagged_lines, bounds=None, cell_size=None):
+        """generate a SegmentIndex instance
+        :param tagged_lines: lines to index, each together with its kind (see LeftImage.get_tagged_drawn_lines())
+        :type tagged_lines: list of (str, Line) tuples
+        :param bounds: area covered by the grid, as (left, bottom, right, top), e. g. the frame's. the
+        lines' bounding box if None. lines (and queried points) outside of it are still handled correctly
+        :type bounds: tuple of float
+        :param cell_size: width and height of the grid's cells. if None, it is chosen so that there are
+        about twice as many columns and rows as the square root of the number of lines
+        :type cell_size: float"""
+        self.kinds = [kind for kind, _ in tagged_lines]
+        self.lines = [line for _, line in tagged_lines]
+        self.segments = np.array([(line.start_point.x, line.start_point.y, line.end_point.x, line.end_point.y)
+                                  for line in self.lines], dtype=np.float64).reshape(-1, 4)
+        self.is_figure = np.array([kind == "figure" for kind in self.kinds], dtype=bool)
+        if bounds is None:
+            bounds = (self.segments[:, [0, 2]].min(), self.segments[:, [1, 3]].min(),
+                      self.segments[:, [0, 2]].max(), self.segments[:, [1, 3]].max()) if len(self.lines) \
+                else (0, 0, 1, 1)
+        left, bottom, right, top = (float(value) for value in bounds)
+        if cell_size is None:
+            cell_size = max(right - left, top - bottom) / max(1, round(2 * math.sqrt(len(self.lines))))
+        assert cell_size > 0, "cell_size must be larger than 0 (the bounds must not be empty)"
+        self.cell_size = float(cell_size)
+        self.origin = np.array([left, bottom])
+        self.num_columns = max(1, math.ceil((right - left) / self.cell_size))
+        self.num_rows = max(1, math.ceil((top - bottom) / self.cell_size))
+        # grid area actually covered by the cells (may extend slightly past the bounds)
+        self.grid_max = self.origin + self.cell_size * np.array([self.num_columns, self.num_rows])
+        with Profiler.stage("segment_index"):
+            self.cell_starts, self.cell_segments = self.build_cells()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def get_cell(self, coords):
+        """returns the column and row of the cell each of the passed positions lies in. positions outside
+        of the grid are assigned to the nearest cell
+        :type coords: numpy array of shape (number of positions, 2)
+        :return: int array of shape (number of positions, 2)"""
+        cells = np.floor((coords - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, [self.num_columns - 1, self.num_rows - 1])
+
+    def build_cells(self):
+        """sort the segments into the cells they pass through. for every column a segment spans, the rows
+        it covers within that column are computed from where it enters and leaves the column, so all
+        cells are found without stepping along the segment
+        :return: (offset of each cell's entries in the second array, with the total number of entries
+        appended; indices of the segments, cell by cell)"""
+        num_cells = self.num_columns * self.num_rows
+        if not len(self.segments):
+            return np.zeros(num_cells + 1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # order each segment's points from left to right
+        swap = self.segments[:, 2] < self.segments[:, 0]
+        x0 = np.where(swap, self.segments[:, 2], self.segments[:, 0])
+        y0 = np.where(swap, self.segments[:, 3], self.segments[:, 1])
+        x1 = np.where(swap, self.segments[:, 0], self.segments[:, 2])
+        y1 = np.where(swap, self.segments[:, 1], self.segments[:, 3])
+        first_columns = self.get_cell(np.stack([x0, y0], axis=1))[:, 0]
+        last_columns = self.get_cell(np.stack([x1, y1], axis=1))[:, 0]
+        # one entry per (segment, column) pair
+        column_counts = last_columns - first_columns + 1
+        segment_ids = np.repeat(np.arange(len(self.segments)), column_counts)
+        columns = np.repeat(first_columns, column_counts) + np.arange(column_counts.sum()) - \
+            np.repeat(np.cumsum(column_counts) - column_counts, column_counts)
+        column_lefts = self.origin[0] + columns * self.cell_size
+        # the part of the segment inside the column (the whole segment for the first and last column,
+        # so that segments partly outside of the grid end up in the nearest cells)
+        xa = np.where(columns == first_columns[segment_ids], x0[segment_ids], column_lefts)
+        xb = np.where(columns == last_columns[segment_ids], x1[segment_ids], column_lefts + self.cell_size)
+        dx = (x1 - x0)[segment_ids]
+        slopes = np.divide((y1 - y0)[segment_ids], dx, out=np.zeros_like(dx), where=dx != 0)
+        ya = np.where(dx != 0, y0[segment_ids] + (xa - x0[segment_ids]) * slopes, y0[segment_ids])
+        yb = np.where(dx != 0, y0[segment_ids] + (xb - x0[segment_ids]) * slopes, y1[segment_ids])
+        first_rows = self.get_cell(np.stack([xa, np.minimum(ya, yb)], axis=1))[:, 1]
+        last_rows = self.get_cell(np.stack([xa, np.maximum(ya, yb)], axis=1))[:, 1]
+        # one entry per (segment, cell) pair
+        row_counts = last_rows - first_rows + 1
+        cell_segment_ids = np.repeat(segment_ids, row_counts)
+        rows = np.repeat(first_rows, row_counts) + np.arange(row_counts.sum()) - \
+            np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+        cells = rows * self.num_columns + np.repeat(columns, row_counts)
+        order = np.argsort(cells, kind="stable")
+        cell_starts = np.searchsorted(cells[order], np.arange(num_cells + 1))
+        return cell_starts, cell_segment_ids[order]
+
+    def get_candidates(self, first_cell, last_cell):
+        """returns the indices of the segments in the rectangle of cells from first_cell to last_cell
+        (each given as (column, row)), without duplicates
+        :return: int array"""
+        columns = np.arange(first_cell[0], last_cell[0] + 1)
+        rows = np.arange(first_cell[1], last_cell[1] + 1)
+        cells = (rows[:, None] * self.num_columns + columns).ravel()
+        starts, ends = self.cell_starts[cells], self.cell_starts[cells + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.unique(self.cell_segments[positions])
+
+    @staticmethod
+    def get_distances(coords, segments):
+        """returns the distance from every passed position to every passed segment
+        :type coords: numpy array of shape (number of positions, 2)
+        :type segments: numpy array of shape (number of segments, 4)
+        :return: numpy array of shape (number of positions, number of segments)"""
+        starts, directions = segments[:, :2], segments[:, 2:] - segments[:, :2]
+        squared_lengths = (directions ** 2).sum(axis=1)
+        offsets = coords[:, None, :] - starts
+        # position along each segment of the point nearest to each position, between 0 and 1
+        t = np.divide((offsets * directions).sum(axis=2), squared_lengths,
+                      out=np.zeros((len(coords), len(segments))), where=squared_lengths > 0)
+        np.clip(t, 0, 1, out=t)
+        return np.hypot(offsets[..., 0] - t * directions[:, 0], offsets[..., 1] - t * directions[:, 1])
+
+    def query_points(self, coords, max_distance=None):
+        """returns the index of the segment nearest to each of the passed positions, and the distance to
+        it. the cells around the positions are searched first, and the searched rectangle of cells is
+        grown until no unsearched cell can hold a segment nearer than the nearest one found
+        :param coords: positions, in the same units as the lines
+        :type coords: numpy array of shape (number of positions, 2)
+        :param max_distance: if passed, segments further away than this are not searched for (their index
+        is then -1 and their distance infinite), which makes queries far from any segment faster
+        :type max_distance: float
+        :return: (int array of segment indices, float array of distances)"""
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        best_indices = np.full(len(coords), -1, dtype=np.int64)
+        best_distances = np.full(len(coords), np.inf)
+        if not len(coords) or not len(self.segments):
+            return best_indices, best_distances
+        limit = np.inf if max_distance is None else max_distance
+        # distances from a position outside of the grid to the cells are at least as large as those from
+        # the nearest position inside of it
+        projected = np.clip(coords, self.origin, self.grid_max)
+        cells = self.get_cell(coords)
+        grid_last = np.array([self.num_columns - 1, self.num_rows - 1])
+        ring = 0
+        with Profiler.stage("segment_query"):
+            while True:
+                first_cell = np.maximum(cells.min(axis=0) - ring, 0)
+                last_cell = np.minimum(cells.max(axis=0) + ring, grid_last)
+                candidates = self.get_candidates(first_cell, last_cell)
+                if len(candidates):
+                    # the distances to the segments found in earlier rings are measured again, which is
+                    # cheaper than leaving them out, as only few rings are usually needed. candidates are
+                    # sorted, so ties go to the lowest index
+                    distances = SegmentIndex.get_distances(coords, self.segments[candidates])
+                    nearest = distances.argmin(axis=1)
+                    best_indices = candidates[nearest]
+                    best_distances = distances[np.arange(len(coords)), nearest]
+                # distance from each position to the nearest unsearched cell (none beyond the grid's edges)
+                rect_min = self.origin + first_cell * self.cell_size
+                rect_max = self.origin + (last_cell + 1) * self.cell_size
+                margins = np.minimum(np.where(first_cell > 0, projected - rect_min, np.inf),
+                                     np.where(last_cell < grid_last, rect_max - projected, np.inf)).min(axis=1)
+                if ((best_distances <= margins) | (margins >= limit)).all():
+                    break
+                ring += 1
+        too_far = best_distances > limit
+        best_indices[too_far] = -1
+        best_distances[too_far] = np.inf
+        return best_indices, best_distances
+
+    def get_hit(self, index, distance):
+        """returns a dict describing the segment with the passed index, as found by a query, with keys
+        'line', 'kind', 'is_figure', 'index' and 'distance', or None if no segment was found
+        :return: dict or None"""
+        if index < 0:
+            return None
+        return {"line": self.lines[index], "kind": self.kinds[index], "is_figure": bool(self.is_figure[index]),
+                "index": int(index), "distance": float(distance)}
+
+    def hit_test(self, x, y, max_distance=None):
+        """returns the line nearest to the passed position, as a dict (see get_hit()), or None if there
+        is no line within max_distance
+        :type x: float
+        :type y: float
+        :param max_distance: maximum distance of the line from the position (no maximum if None)
+        :type max_distance: float
+        :return: dict or None"""
+        indices, distances = self.query_points([(x, y)], max_distance)
+        return self.get_hit(indices[0], distances[0])
+
+    def hit_test_polyline(self, points, max_distance=None, step=None):
+        """score a traced response, e. g. the path of the mouse while a participant traces the figure.
+        the polyline is sampled at regular intervals, and the nearest line of each sample is looked up.
+        returns a dict holding the line that came nearest to the polyline ('nearest', see get_hit()),
+        the fraction of samples whose nearest line is a figure line ('figure_fraction'), the mean
+        distance of the samples to their nearest lines ('mean_distance'), the indices of the figure
+        lines that were nearest to any sample ('figure_lines_hit') and the number of samples
+        ('num_samples'). samples without a line within max_distance count as not being near a figure
+        line, and aren't included in the mean distance
+        :param points: the polyline's points, in the same units as the lines
+        :type points: list of (x, y) tuples
+        :param max_distance: maximum distance of a sample from its nearest line (no maximum if None)
+        :type max_distance: float
+        :param step: distance between samples (half of the index's cell size if None)
+        :type step: float
+        :return: dict"""
+        samples = SegmentIndex.sample_polyline(points, step if step is not None else self.cell_size / 2)
+        indices, distances = self.query_points(samples, max_distance)
+        found = indices >= 0
+        nearest_sample = int(np.argmin(distances)) if len(distances) else 0
+        on_figure = found & self.is_figure[np.maximum(indices, 0)] if len(self.segments) else found
+        return {"nearest": self.get_hit(indices[nearest_sample], distances[nearest_sample]) if len(indices) else None,
+                "figure_fraction": float(on_figure.mean()) if len(samples) else 0.0,
+                "mean_distance": float(distances[found].mean()) if found.any() else None,
+                "figure_lines_hit": sorted(set(indices[on_figure].tolist())),
+                "num_samples": len(samples)}
+
+    @staticmethod
+    def sample_polyline(points, step):
+        """returns positions along the passed polyline, including its points, no further apart than step
+        :type points: list of (x, y) tuples
+        :type step: float
+        :return: numpy array of shape (number of samples, 2)"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) < 2:
+            return points
+        lengths = np.hypot(*(points[1:] - points[:-1]).T)
+        num_steps = np.maximum(1, np.ceil(lengths / step).astype(np.int64))
+        segment_ids = np.repeat(np.arange(len(lengths)), num_steps)
+        t = (np.arange(num_steps.sum()) - np.repeat(np.cumsum(num_steps) - num_steps, num_steps)) / \
+            np.repeat(num_steps, num_steps)
+        samples = points[segment_ids] + t[:, None] * (points[segment_ids + 1] - points[segment_ids])
+        return np.concatenate([samples, points[-1:]])
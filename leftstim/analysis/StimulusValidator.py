@@ -0,0 +1,175 @@
+from leftstim.analysis.EmbeddingVerifier import EmbeddingVerifier
+from leftstim.basic_components.AttachedLine import AttachedLine
+
+
+class StimulusValidator:
+    def __init__(self, min_line_length=1, duplicate_tolerance=2, min_line_spacing=3,
+                 parallel_tolerance=0.035, allow_fallbacks=False, check_embedding=False, embedding_tolerance=1.0):
+        """generate a StimulusValidator instance, used for checking a LeftImage's geometry for
+        problems before any rendering takes place
+        :param min_line_length: lines shorter than this are reported as zero-length lines
+        :type min_line_length: float
+        :param duplicate_tolerance: two lines whose start/end points all lie within this distance
+        of each other are reported as duplicates
+        :type duplicate_tolerance: float
+        :param min_line_spacing: (near-)parallel, overlapping lines that run closer to each other
+        than this are reported as too close
+        :type min_line_spacing: float
+        :param parallel_tolerance: maximum sine of the angle between two lines for them to be
+        considered parallel
+        :type parallel_tolerance: float
+        :param allow_fallbacks: if False, lines that had to be replaced by random lines when
+        extending/jiggling them are reported
+        :type allow_fallbacks: bool
+        :param check_embedding: if True, it is checked that the figure is covered by the drawn lines (in
+        place of the check that each figure line is covered by its own drawn line) and, once the figure
+        has been replaced, that it can't be found anywhere in the image (see EmbeddingVerifier)
+        :type check_embedding: bool
+        :param embedding_tolerance: maximum distance of the figure's lines from the drawn lines covering them
+        :type embedding_tolerance: float"""
+        self.min_line_length = min_line_length
+        self.duplicate_tolerance = duplicate_tolerance
+        self.min_line_spacing = min_line_spacing
+        self.parallel_tolerance = parallel_tolerance
+        self.allow_fallbacks = allow_fallbacks
+        self.embedding_verifier = EmbeddingVerifier(tolerance=embedding_tolerance) if check_embedding else None
+
+    def validate(self, left_image):
+        """check the passed image's current geometry and return a list of strings describing
+        each problem found. an empty list means that the image passed all checks
+        :param left_image: image to check
+        :type left_image: LeftImage
+        :return: list of str"""
+        reasons = []
+        if left_image.figure is not None:
+            reasons.extend(self.check_figure_in_frame(left_image))
+            if self.embedding_verifier is None:
+                reasons.extend(self.check_figure_present(left_image))
+        if self.embedding_verifier is not None and left_image.nonextended_figure is not None:
+            reasons.extend(self.check_figure_embedding(left_image))
+        drawn_lines = left_image.get_drawn_lines(include_frame=False)
+        reasons.extend(self.check_line_lengths(drawn_lines))
+        reasons.extend(self.check_line_pairs(drawn_lines))
+        if not self.allow_fallbacks:
+            reasons.extend(self.check_fallbacks(left_image))
+        return reasons
+
+    def is_valid(self, left_image):
+        """returns True if the passed image passes all checks, otherwise returns False
+        :param left_image: image to check
+        :type left_image: LeftImage
+        :return: bool"""
+        return not self.validate(left_image)
+
+    def check_figure_in_frame(self, left_image):
+        """checks that all of the (non-extended) figure's points lie inside of the image's frame
+        :return: list of str"""
+        figure = left_image.nonextended_figure
+        outside_points = [point for line in figure.lines for point in (line.start_point, line.end_point)
+                          if not point.is_in_frame(left_image.frame)]
+        if outside_points:
+            return ["figure {} has {} point(s) outside of the frame".format(figure.figure_name,
+                                                                           len(outside_points))]
+        return []
+
+    def check_figure_present(self, left_image):
+        """checks that every line of the (non-extended) figure is covered by the corresponding
+        drawn figure line, i. e. that the figure is actually embedded in the image
+        :return: list of str"""
+        figure_lines = left_image.figure.lines
+        nonextended_lines = left_image.nonextended_figure.lines
+        if len(figure_lines) != len(nonextended_lines):
+            return ["figure has {} line(s), but {} line(s) are drawn".format(len(nonextended_lines),
+                                                                              len(figure_lines))]
+        missing = 0
+        for figure_line, nonextended_line in zip(figure_lines, nonextended_lines):
+            drawn_start, drawn_end = figure_line.start_ext_point, figure_line.end_ext_point
+            drawn_length = drawn_start.dist(drawn_end)
+            for point in (nonextended_line.start_point, nonextended_line.end_point):
+                detour = drawn_start.dist(point) + point.dist(drawn_end) - drawn_length
+                if detour > self.duplicate_tolerance:
+                    missing += 1
+                    break
+        if missing:
+            return ["{} figure line(s) are not present in the embedded image".format(missing)]
+        return []
+
+    def check_figure_embedding(self, left_image):
+        """checks that every line of the (non-extended) figure is covered by the drawn lines, or, if the
+        figure has been replaced (see LeftImage.replace_figure_with_lines()), that the figure can't be found
+        at any position in the drawn lines, e. g. because too many of its lines were left as they were
+        :return: list of str"""
+        figure = left_image.nonextended_figure
+        target_segments = EmbeddingVerifier.to_segments(figure.lines)
+        drawn_segments = EmbeddingVerifier.to_segments(left_image.get_drawn_lines())
+        if left_image.figure is not None:
+            missing = self.embedding_verifier.get_missing(target_segments, drawn_segments)
+            if missing:
+                return ["{} figure line(s) are not covered by the drawn lines".format(len(missing))]
+            return []
+        translation = self.embedding_verifier.find_embedding(target_segments, drawn_segments)
+        if translation is not None:
+            return ["figure {} is still embedded in the image (shifted by {:.1f}, {:.1f})".format(
+                figure.figure_name, *translation)]
+        return []
+
+    def check_line_lengths(self, lines):
+        """checks that none of the passed lines is (close to) zero-length
+        :return: list of str"""
+        short_lines = [line for line in lines if line.get_length() < self.min_line_length]
+        if short_lines:
+            return ["{} zero-length line(s)".format(len(short_lines))]
+        return []
+
+    def check_line_pairs(self, lines):
+        """checks all pairs of the passed lines for duplicates and for parallel lines
+        that run too close to each other
+        :return: list of str"""
+        num_duplicates = 0
+        num_too_close = 0
+        for i, line in enumerate(lines):
+            for other_line in lines[i + 1:]:
+                if line.get_max_dist(other_line) < self.duplicate_tolerance:
+                    num_duplicates += 1
+                elif self.are_too_close(line, other_line):
+                    num_too_close += 1
+        reasons = []
+        if num_duplicates:
+            reasons.append("{} duplicate line pair(s)".format(num_duplicates))
+        if num_too_close:
+            reasons.append("{} line pair(s) closer than {} units".format(num_too_close, self.min_line_spacing))
+        return reasons
+
+    def are_too_close(self, line, other_line):
+        """returns True if the two passed lines are (near-)parallel, overlap and run closer to
+        each other than the minimum line spacing, otherwise returns False
+        :return: bool"""
+        length = line.get_length()
+        if length < self.min_line_length or other_line.get_length() < self.min_line_length:
+            return False
+        unit_vec = line.get_dir_vector().get_normalized_vector()
+        other_unit_vec = other_line.get_dir_vector().get_normalized_vector()
+        if abs(unit_vec.x * other_unit_vec.y - unit_vec.y * other_unit_vec.x) > self.parallel_tolerance:
+            return False
+        projections = []
+        for point in (other_line.start_point, other_line.end_point):
+            dist_vec = line.start_point.get_dist_vector(point)
+            if abs(unit_vec.x * dist_vec.y - unit_vec.y * dist_vec.x) >= self.min_line_spacing:
+                return False
+            projections.append(unit_vec.x * dist_vec.x + unit_vec.y * dist_vec.y)
+        return max(projections) > 0 and min(projections) < length
+
+    @staticmethod
+    def check_fallbacks(left_image):
+        """checks whether any of the image's lines had to be replaced with random lines, because
+        jiggling them or extending them to their parent lines failed
+        :return: list of str"""
+        attached_lines = [line for line in left_image.get_all_lines() if isinstance(line, AttachedLine)]
+        reasons = []
+        num_skipped = sum([line.jiggle_skipped for line in attached_lines])
+        num_replaced = sum([line.extension_replaced for line in attached_lines])
+        if num_skipped:
+            reasons.append("{} line(s) could not be jiggled".format(num_skipped))
+        if num_replaced:
+            reasons.append("{} line(s) could not be extended and were replaced".format(num_replaced))
+        return reasons
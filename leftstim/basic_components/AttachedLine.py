@@ -1,7 +1,11 @@
 from leftstim.basic_components.Point import Point
 from leftstim.basic_components.Line import Line
+from leftstim.instrumentation.Profiler import Profiler
 
 class AttachedLine(Line):
+    jiggle_skipped = False
+    extension_replaced = False
+
     def __init__(self, start_point, end_point, start_line, end_line):
         """generate AttachedLine instance that represents a non-curved line in 2D space, connected
         at its ends to other lines
@@ -35,29 +39,35 @@ class AttachedLine(Line):
         :type new_end_line: Line
         :return: None
         """
-        self.start_point = new_end_point
-        self.start_line = new_end_line
+        self.end_point = new_end_point
+        self.end_line = new_end_line
 
-    def jiggle_start(self):
+    def jiggle_start(self, rng=None):
         """randomly change this line's starting point, while forcing it to stay on the line
         attached to the start of this line
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
         :return: None"""
-        self.start_point = self.get_jiggle_line_start().get_random_point()
+        self.start_point = self.get_jiggle_line_start().get_random_point(rng)
 
-    def jiggle_end(self):
+    def jiggle_end(self, rng=None):
         """randomly change this line's end point, while forcing it to stay on the line
         attached to the end of this line
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
         :return: None"""
-        self.end_point = self.get_jiggle_line_end().get_random_point()
+        self.end_point = self.get_jiggle_line_end().get_random_point(rng)
 
-    def jiggle_all(self):
+    def jiggle_all(self, rng=None):
         """randomly change this line's start and end point, while forcing them to stay on the lines
         attached to the start/end of this line, respectively. takes into account what orientation
         the line originally had.
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
         :return: None"""
         orientation = self.get_orientation()
         try:
-            self.jiggle_start()
+            self.jiggle_start(rng)
             if orientation == "horizontal":
                 horizontal_line = Line(self.start_point, self.start_point + Point(1, 0))
                 inter_point = horizontal_line.get_intersection(self.end_line)
@@ -67,10 +77,10 @@ class AttachedLine(Line):
                 inter_point = vertical_line.get_intersection(self.end_line)
                 self.end_point = inter_point
             else:
-                self.jiggle_end()
-        except AttributeError as e:
-            print(e)
-            print('skipping jiggling line')
+                self.jiggle_end(rng)
+        except AttributeError:
+            self.jiggle_skipped = True
+            Profiler.count("jiggle_skipped")
 
 
     def get_jiggle_line_start(self):
@@ -94,10 +104,14 @@ class AttachedLine(Line):
         raise Exception("This is an AttachedLine instance. Shift should not be used with AttachedLine instances. "
                         "Please use the .change_start_line() and .change_end.line() methods instead.")
 
-    def extend_to_parents(self, frame):
+    def extend_to_parents(self, frame, rng=None):
         """extends the attached line so that it touches the start_line and end_line, if possible. if the
         resulting line reaches outside of the frame, or it's not possible to extend to start/end_lines,
-        replace this line with a random line running between the start_line and end_line"""
+        replace this line with a random line running between the start_line and end_line
+        :type frame: Frame
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
+        :return: None"""
         extension_successful = False
         try:
             start_point = self.get_intersection(self.start_line)
@@ -106,11 +120,12 @@ class AttachedLine(Line):
                 self.start_point = start_point
                 self.end_point = end_point
                 extension_successful = True
-        except AttributeError as e:
-            print(e)
-            print('Unable to extend line, replacing with random line...')
+        except AttributeError:
+            pass
         finally:
             if not extension_successful:
-                self.start_point = self.start_line.get_random_point()
-                self.end_point = self.end_line.get_random_point()
+                self.extension_replaced = True
+                Profiler.count("extension_fallbacks")
+                self.start_point = self.start_line.get_random_point(rng)
+                self.end_point = self.end_line.get_random_point(rng)
 
@@ -1,9 +1,9 @@
-import random
-
 import numpy as np
 
 from leftstim.basic_components.Point import Point
+from leftstim.basic_components.RandomFunctions import RandomFunctions
 from leftstim.basic_components.Vector import Vector
+from leftstim.instrumentation.Profiler import Profiler
 
 class Line:
     def __init__(self, start_point, end_point):
@@ -27,20 +27,43 @@ class Line:
         line_object.end = (self.end_point.x, self.end_point.y)
         line_object.draw()
 
-    def get_random_point(self):
+    def get_random_point(self, rng=None):
         """returns a Point instance that is placed somewhere on the line
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
         :return: Point"""
+        rng = RandomFunctions.get_rng(rng)
         if self.is_horizontal():
-            rand_x_coord = random.uniform(self.start_point.x, self.end_point.x)
+            rand_x_coord = RandomFunctions.uniform(rng, self.start_point.x, self.end_point.x)
             return Point(rand_x_coord, self.start_point.y)
         if self.is_vertical():
-            rand_y_coord = random.uniform(self.start_point.y, self.end_point.y)
+            rand_y_coord = RandomFunctions.uniform(rng, self.start_point.y, self.end_point.y)
             return Point(self.start_point.x, rand_y_coord)
-        rand_x_coord = random.uniform(self.start_point.x, self.end_point.x)
+        rand_x_coord = RandomFunctions.uniform(rng, self.start_point.x, self.end_point.x)
         delta_x = rand_x_coord - self.start_point.x
         rand_y_coord = delta_x * self.get_slope() + self.start_point.y
         return Point(rand_x_coord, rand_y_coord)
 
+    def get_random_coords(self, n, rng=None):
+        """returns the coordinates of n random points on the line, drawn all at once
+        :param n: number of points
+        :type n: int
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
+        :return: numpy array with shape (n, 2)"""
+        rng = RandomFunctions.get_rng(rng)
+        coords = np.empty((n, 2))
+        if self.is_vertical():
+            coords[:, 0] = self.start_point.x
+            coords[:, 1] = RandomFunctions.uniform(rng, self.start_point.y, self.end_point.y, size=n)
+            return coords
+        coords[:, 0] = RandomFunctions.uniform(rng, self.start_point.x, self.end_point.x, size=n)
+        if self.is_horizontal():
+            coords[:, 1] = self.start_point.y
+        else:
+            coords[:, 1] = (coords[:, 0] - self.start_point.x) * self.get_slope() + self.start_point.y
+        return coords
+
     def get_slope(self):
         """returns a coefficient representing this line's slope, i. e. the k in y = kx+m.
         if the line is actually horizontal or vertical, raise an error
@@ -138,26 +161,29 @@ class Line:
         intersect_point = Point(this_vec_scalar * this_dir_vec.x, this_vec_scalar * this_dir_vec.y) + self.start_point
         return intersect_point
 
-    def fling_to_line(self, other_line):
+    def fling_to_line(self, other_line, rng=None):
         """returns a Line instance that has its starting point somewhere on this
         line, its end point somewhere on the other_line, and a length of a minimum of
-        50 units (throws an error if this is not attainable)
+        50 units (throws an error if this is not attainable). 100 candidate lines are drawn at
+        once, and the first one that is long enough is used
         :param other_line: line that generated Line instance's end point should be placed on
         :type other_line: Line
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
         :return: Line"""
         from leftstim.basic_components.AttachedLine import AttachedLine
 
-        distant_enough = False
-        counter = 100
-        while not distant_enough:
-            if counter <= 0:
-                raise AttributeError("tried to fling to a line that is too close")
-            start_point = self.get_random_point()
-            end_point = other_line.get_random_point()
-            if start_point.dist(end_point) > 50:
-                distant_enough = True
-            counter -= 1
-        return AttachedLine(start_point=start_point, end_point=end_point,
+        start_coords = self.get_random_coords(100, rng)
+        end_coords = other_line.get_random_coords(100, rng)
+        distant_enough = np.hypot(*(end_coords - start_coords).T) > 50
+        if not distant_enough.any():
+            Profiler.count("fling_to_line_attempts", 100)
+            Profiler.count("fling_to_line_failures")
+            raise AttributeError("tried to fling to a line that is too close")
+        index = int(np.argmax(distant_enough))
+        Profiler.count("fling_to_line_attempts", index + 1)
+        return AttachedLine(start_point=Point(*start_coords[index].tolist()),
+                            end_point=Point(*end_coords[index].tolist()),
                             start_line=self, end_line=other_line)
     
     def get_extended_version(self, frame):
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class RandomFunctions:
+    """
+    Helpers for drawing random values from numpy.random.Generator instances. All randomness in the
+    package goes through an explicitly passed generator; when none is passed, the shared (unseeded)
+    default_rng is used.
+    """
+    default_rng = np.random.default_rng()
+
+    @staticmethod
+    def get_rng(rng=None):
+        """returns the passed generator, or the shared default generator if rng is None
+        :type rng: numpy.random.Generator
+        :return: numpy.random.Generator"""
+        if rng is None:
+            return RandomFunctions.default_rng
+        return rng
+
+    @staticmethod
+    def make_rng(seed=None):
+        """returns a new generator seeded with the passed seed (an int, a numpy.random.SeedSequence or
+        None for a random seed). if a generator is passed, it is returned as is
+        :return: numpy.random.Generator"""
+        return np.random.default_rng(seed)
+
+    @staticmethod
+    def spawn_seeds(seed, n):
+        """returns n independent child seed sequences of the passed seed, e. g. one for each parallel
+        worker. child sequences are picklable, and generators created from them produce
+        non-overlapping streams
+        :param seed: int or numpy.random.SeedSequence
+        :param n: number of child seed sequences
+        :type n: int
+        :return: list of numpy.random.SeedSequence"""
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        return seed.spawn(n)
+
+    @staticmethod
+    def spawn_rngs(seed, n):
+        """returns n generators with independent streams, derived from the passed seed
+        :param seed: int or numpy.random.SeedSequence
+        :param n: number of generators
+        :type n: int
+        :return: list of numpy.random.Generator"""
+        return [np.random.default_rng(child_seed) for child_seed in RandomFunctions.spawn_seeds(seed, n)]
+
+    @staticmethod
+    def uniform(rng, a, b, size=None):
+        """returns a random float (or a numpy array of them, if size is passed) between a and b.
+        unlike Generator.uniform, a may be larger than b
+        :type rng: numpy.random.Generator
+        :return: float or numpy array"""
+        return a + (b - a) * rng.random(size)
+
+    @staticmethod
+    def choice(rng, sequence):
+        """returns a randomly chosen element of the passed sequence
+        :type rng: numpy.random.Generator
+        :type sequence: list or tuple"""
+        return sequence[rng.integers(len(sequence))]
+
+    @staticmethod
+    def sample(rng, sequence, k):
+        """returns a list of k distinct, randomly chosen elements of the passed sequence, in random order
+        :type rng: numpy.random.Generator
+        :type sequence: list or tuple
+        :type k: int
+        :return: list"""
+        return [sequence[i] for i in rng.permutation(len(sequence))[:k]]
+
+    @staticmethod
+    def shuffled(rng, sequence):
+        """returns a randomly reordered copy of the passed sequence
+        :type rng: numpy.random.Generator
+        :type sequence: list or tuple
+        :return: list"""
+        return RandomFunctions.sample(rng, sequence, len(sequence))
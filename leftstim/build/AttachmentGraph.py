@@ -0,0 +1,96 @@
+from leftstim.basic_components.AttachedLine import AttachedLine
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class AttachmentGraph:
+    def __init__(self):
+        """generate an AttachmentGraph instance, which keeps track of which lines the image's
+        AttachedLines are attached to (their parents), and which lines are attached to each line
+        (its dependents). lines are used as keys by identity"""
+        self.parents = {}
+        self.dependents = {}
+        self.changed_lines = {}
+
+    def add(self, line):
+        """register the passed line with the graph. lines that aren't AttachedLines (e. g. frame or
+        figure lines) only take part in the graph as parents, and don't need to be added
+        :type line: AttachedLine
+        :return: None"""
+        if not isinstance(line, AttachedLine):
+            return
+        if line in self.parents:
+            self.remove(line)
+        self.parents[line] = (line.start_line, line.end_line)
+        for parent in (line.start_line, line.end_line):
+            parent_dependents = self.dependents.setdefault(parent, [])
+            if line not in parent_dependents:
+                parent_dependents.append(line)
+
+    def remove(self, line):
+        """remove the passed line from the graph. lines attached to it are marked as needing to be
+        re-extended (they keep the removed line as their parent)
+        :type line: Line
+        :return: None"""
+        for parent in self.parents.pop(line, ()):
+            parent_dependents = self.dependents.get(parent, [])
+            if line in parent_dependents:
+                parent_dependents.remove(line)
+        self.changed_lines.pop(line, None)
+        if self.dependents.get(line):
+            self.changed_lines[line] = None
+
+    def update(self, line):
+        """re-register the passed line after its parents have been changed (e. g. using
+        AttachedLine.change_start_line()), and mark it as changed
+        :type line: AttachedLine
+        :return: None"""
+        self.add(line)
+        self.mark_changed(line)
+
+    def mark_changed(self, line):
+        """mark the passed line as changed (e. g. jiggled), meaning that it and the lines attached
+        to it need to be re-extended
+        :type line: Line
+        :return: None"""
+        self.changed_lines[line] = None
+
+    def get_lines_to_extend(self):
+        """returns the changed AttachedLines and all lines that are (directly or indirectly) attached
+        to a changed line, with every line coming after the lines it is attached to
+        :return: list of AttachedLine instances"""
+        to_extend = {line: None for line in self.changed_lines if line in self.parents}
+        stack = list(self.changed_lines)
+        while stack:
+            line = stack.pop()
+            for dependent in self.dependents.get(line, ()):
+                if dependent not in to_extend:
+                    to_extend[dependent] = None
+                    stack.append(dependent)
+        num_unextended_parents = {line: sum([parent in to_extend for parent in set(self.parents[line])])
+                                  for line in to_extend}
+        ordered_lines = [line for line, count in num_unextended_parents.items() if count == 0]
+        for line in ordered_lines:
+            for dependent in self.dependents.get(line, ()):
+                if dependent in num_unextended_parents:
+                    num_unextended_parents[dependent] -= 1
+                    if num_unextended_parents[dependent] == 0:
+                        ordered_lines.append(dependent)
+        # lines attached to each other in a cycle can't be ordered, they are extended last
+        ordered_lines.extend(line for line, count in num_unextended_parents.items() if count > 0)
+        return ordered_lines
+
+    def extend_changed(self, frame, rng=None):
+        """re-extend every changed line, and every line that is (directly or indirectly) attached to
+        a changed line, so that it touches its parents again (or is replaced, see
+        AttachedLine.extend_to_parents()), parents first. afterwards, no lines are marked as changed
+        :param frame: frame that the lines must stay inside of
+        :type frame: Frame
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
+        :return: list of the lines that were re-extended"""
+        lines_to_extend = self.get_lines_to_extend()
+        for line in lines_to_extend:
+            line.extend_to_parents(frame, rng=rng)
+        Profiler.count("lines_reextended", len(lines_to_extend))
+        self.changed_lines = {}
+        return lines_to_extend
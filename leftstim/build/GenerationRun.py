@@ -0,0 +1,168 @@
+import json
+import os
+
+from leftstim.build.Recipe import Recipe
+from leftstim.storage.Colorways import Colorways
+from leftstim.storage.DirectorySink import DirectorySink
+
+
+class GenerationRun:
+    """
+    A resumable run that builds and saves one image set per seed in a range, following a recipe. The
+    run directory holds the recipe ('recipe.json'), the seed range ('run.json') and a journal of
+    the seeds that have been completed ('journal.tsv'), which is synced to disk in batches. If the
+    run is interrupted, creating a GenerationRun for the same directory again and calling run()
+    continues with the seeds that haven't been completed; as every image only depends on the recipe
+    and its seed, the result is the same as that of an uninterrupted run.
+
+    A run can be split across several machines/processes by giving each of them its own run
+    directory, the same recipe and seeds, the same num_shards and a different shard_index. Shard k
+    builds every num_shards-th seed, starting with the k-th one. The resulting runs can be checked
+    and combined using RunMerger.
+    """
+    recipe_file_name = "recipe.json"
+    run_file_name = "run.json"
+    journal_file_name = "journal.tsv"
+
+    def __init__(self, run_dir, recipe=None, seeds=None, batch_size=100, shard_index=0, num_shards=1):
+        """generate a GenerationRun instance. if the run directory already holds a run, its recipe,
+        seed range and sharding are used (if recipe/seeds are passed as well, they must be the same)
+        :param run_dir: the run's directory (created if it doesn't exist)
+        :type run_dir: str
+        :param recipe: recipe to build images with
+        :type recipe: Recipe
+        :param seeds: seeds to build images for, one image set per seed
+        :type seeds: range
+        :param batch_size: number of completed seeds after which the journal is synced to disk.
+        at most this many image sets are built again when resuming after a crash
+        :type batch_size: int
+        :param shard_index: which part of the seeds this run builds, between 0 and num_shards - 1
+        :type shard_index: int
+        :param num_shards: number of parts the seeds are split into
+        :type num_shards: int"""
+        assert 0 <= shard_index < num_shards, "shard_index must be between 0 and num_shards - 1"
+        self.run_dir = run_dir
+        self.batch_size = batch_size
+        os.makedirs(run_dir, exist_ok=True)
+        recipe_path = os.path.join(run_dir, GenerationRun.recipe_file_name)
+        run_path = os.path.join(run_dir, GenerationRun.run_file_name)
+        if os.path.exists(run_path):
+            existing_recipe = Recipe.load(recipe_path)
+            with open(run_path) as f:
+                run_info = json.load(f)
+            existing_seeds = range(run_info["seed_start"], run_info["seed_stop"], run_info["seed_step"])
+            assert recipe is None or recipe == existing_recipe, \
+                "the run directory holds a run with a different recipe"
+            assert seeds is None or seeds == existing_seeds, "the run directory holds a run with different seeds"
+            recipe, seeds = existing_recipe, existing_seeds
+            existing_sharding = (run_info.get("shard_index", 0), run_info.get("num_shards", 1))
+            assert (shard_index, num_shards) in ((0, 1), existing_sharding), "the run directory holds a different shard"
+            shard_index, num_shards = existing_sharding
+        else:
+            assert recipe is not None and seeds is not None, "a recipe and seeds are required for a new run"
+            recipe.save(recipe_path)
+            with open(run_path, "w") as f:
+                json.dump({"seed_start": seeds.start, "seed_stop": seeds.stop, "seed_step": seeds.step,
+                           "shard_index": shard_index, "num_shards": num_shards}, f)
+        self.recipe = recipe
+        self.seeds = seeds
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.completed = self.read_journal()
+
+    def read_journal(self):
+        """returns the completed seeds recorded in the journal, mapped to whether the image set was saved
+        (True) or rejected (False). an incompletely written last line (e. g. after a crash) is removed
+        :return: dict"""
+        completed = {}
+        journal_path = os.path.join(self.run_dir, GenerationRun.journal_file_name)
+        if not os.path.exists(journal_path):
+            return completed
+        complete_length = 0
+        with open(journal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                seed, saved = line.decode().split("\t")
+                completed[int(seed)] = saved.strip() == "1"
+                complete_length += len(line)
+        os.truncate(journal_path, complete_length)
+        return completed
+
+    def get_shard_seeds(self):
+        """returns the seeds this run builds (all seeds, unless the run is one of several shards)
+        :return: range"""
+        return self.seeds[self.shard_index::self.num_shards]
+
+    def get_remaining_seeds(self):
+        """returns the seeds of this run that haven't been completed, in order
+        :return: list of int"""
+        return [seed for seed in self.get_shard_seeds() if seed not in self.completed]
+
+    def is_complete(self):
+        """returns True if all seeds have been completed
+        :return: bool"""
+        return not self.get_remaining_seeds()
+
+    @staticmethod
+    def get_stimulus_id(figure_name, seed):
+        """returns the identifier used for the image set with the passed figure and seed
+        :return: str"""
+        return "{}_{}".format(figure_name, seed)
+
+    def run(self, sink=None, validator=None, manifest=None, max_sets=None, encoder=None, metrics=None):
+        """build and save image sets for the seeds that haven't been completed yet
+        :param sink: sink to write the image sets to (e. g. a ShardWriter), or a GeometryStoreWriter to
+        only store their lines. if None, the image sets are saved as files named '<stimulus id>_<variant>'
+        in the 'images' directory in the run directory (see DirectorySink). if the recipe has colour
+        schemes, every image set is written once per scheme
+        :param validator: if passed, image sets that fail validation are not saved (see LeftImage.save_to_sink())
+        :type validator: StimulusValidator
+        :param manifest: if passed, a row is added for each image set (see ManifestWriter)
+        :type manifest: ManifestWriter
+        :param max_sets: maximum number of seeds to complete in this call (all remaining ones if None)
+        :type max_sets: int
+        :param encoder: encoder to use when saving files, if no sink is passed (see LeftImage)
+        :type encoder: ImageEncoder
+        :param metrics: if passed, the complexity metrics of each image are included in its metadata and
+        in the manifest. if no sink is passed, the metadata is then saved as '<stimulus id>.json' as well
+        :type metrics: ComplexityMetrics
+        :return: number of seeds completed in this call"""
+        if sink is None:
+            sink = DirectorySink(os.path.join(self.run_dir, "images"), encoder, write_metadata=metrics is not None)
+        colorways = Colorways(self.recipe.color_schemes) if self.recipe.color_schemes else None
+        remaining_seeds = self.get_remaining_seeds()
+        if max_sets is not None:
+            remaining_seeds = remaining_seeds[:max_sets]
+        num_unsynced = 0
+        with open(os.path.join(self.run_dir, GenerationRun.journal_file_name), "a") as journal:
+            for seed in remaining_seeds:
+                img = self.recipe.build(seed, encoder=encoder, metrics=metrics)
+                stimulus_id = GenerationRun.get_stimulus_id(img.figure.figure_name, seed)
+                if hasattr(sink, "write_geometry"):
+                    saved = img.save_geometry(sink, stimulus_id=stimulus_id, validator=validator, manifest=manifest)
+                elif colorways is not None:
+                    saved = img.save_colorways_to_sink(sink, colorways, stimulus_id=stimulus_id, validator=validator,
+                                                       manifest=manifest)
+                else:
+                    saved = img.save_to_sink(sink, stimulus_id=stimulus_id, validator=validator,
+                                             manifest=manifest)
+                journal.write("{}\t{}\n".format(seed, int(saved)))
+                self.completed[seed] = saved
+                num_unsynced += 1
+                if num_unsynced >= self.batch_size:
+                    GenerationRun.sync(journal, sink, manifest)
+                    num_unsynced = 0
+            GenerationRun.sync(journal, sink, manifest)
+        return len(remaining_seeds)
+
+    @staticmethod
+    def sync(journal, sink, manifest):
+        """write the sink's and the manifest's output (if passed) to disk, then the journal. the
+        journal is synced last, so that it never records seeds whose output isn't on disk
+        :return: None"""
+        for output in (sink, manifest):
+            if output is not None:
+                output.flush()
+        journal.flush()
+        os.fsync(journal.fileno())
@@ -1,59 +1,133 @@
 from copy import deepcopy
 import inspect
+import json
 import math
+import numbers
 import os
-import random
 
+import numpy as np
+from PIL import Image, ImageDraw
 from psychopy import visual
 
-from leftstim.basic_components.AttachedLine import AttachedLine
+from leftstim.analysis.GeometricFingerprint import GeometricFingerprint
+from leftstim.analysis.SegmentIndex import SegmentIndex
+from leftstim.analysis.StimulusValidator import StimulusValidator
 from leftstim.basic_components.Line import Line
 from leftstim.basic_components.Point import Point
+from leftstim.basic_components.RandomFunctions import RandomFunctions
+from leftstim.build.AttachmentGraph import AttachmentGraph
 from leftstim.complex_components.Frame import Frame
 from leftstim.complex_components.Figure import Figure
+from leftstim.instrumentation.Profiler import Profiler
 
 from leftstim.original_targets.FigureLineCollections import FigureLineCollections
+from leftstim.original_targets.TargetTemplate import TargetTemplate
+from leftstim.storage.Colorways import Colorways
+from leftstim.storage.ImageEncoder import ImageEncoder
 
 class LeftImage:
+    line_kinds = ("frame", "figure", "non_fig", "figure_linked")
+
     def __init__(self, window_width, window_height,
                  frame_width, frame_height,
                  line_width, line_color,
-                 background_color, units):
+                 background_color, units, seed=None, encoder=None, window=None, metrics=None):
+        """generate a LeftImage instance
+        :param seed: seed for the image's random number generator (an int or a
+        numpy.random.SeedSequence, e. g. from RandomFunctions.spawn_seeds()), or a
+        numpy.random.Generator to use. images generated with the same seed and the same
+        method calls are identical. if None, a random seed is used
+        :param encoder: encoder used for saving images (e. g. as palette PNGs, see ImageEncoder). if
+        None, images are saved as RGB PNGs using PsychoPy
+        :type encoder: ImageEncoder
+        :param window: PsychoPy window to draw in, e. g. an experiment's window (see LivePresenter). if None,
+        a window of the passed size is opened for the image, once something is drawn
+        :type window: psychopy.visual.Window
+        :param metrics: if passed, the image's complexity metrics are included in its metadata (see get_metadata())
+        :type metrics: ComplexityMetrics
+        """
+        self.seed = int(seed) if isinstance(seed, numbers.Integral) else None
+        self.rng = RandomFunctions.make_rng(seed)
         self.non_fig_lines = []
         self.figure = None
         self.nonextended_figure = None
         self.figure_linked_lines = []
-        self.window = visual.Window(size=(window_width, window_height),
-                                    color=background_color, units=units)
-        self.line_object = visual.Line(self.window, units=units,
-                                       lineWidth=line_width, lineColor=line_color,
-                                       lineColorSpace="rgb",
-                                       start=(0, 0),
-                                       end=(0, 0),
-                                       opacity=1,
-                                       interpolate=True)
+        self.attachment_graph = AttachmentGraph()
+        self.rejection_reasons = []
+        self.window_size = (window_width, window_height)
+        self.units = units
+        self.frame_size = (frame_width, frame_height)
+        self.line_width = line_width
+        self.line_color = line_color
+        self.background_color = background_color
+        self.figure_aligned = False
+        self.figure_shifted = False
+        self.encoder = encoder
+        self.metrics = metrics
+        # the window is only opened once something is drawn, so that images can be built (e. g. in a
+        # background thread, see StimulusPool) without opening a window
+        self.__window = window
+        self.has_own_window = window is None
+        self.__line_object = None
         frame_top = Line(Point(-frame_width/2, frame_height/2), Point(frame_width/2, frame_height/2))
         frame_right = Line(Point(frame_width/2, frame_height/2), Point(frame_width/2, -frame_height/2))
-        self.frame = Frame(frame_top, frame_right)
+        self.frame = Frame(frame_top, frame_right, rng=self.rng)
+
+    @property
+    def window(self):
+        """PsychoPy window the image is drawn in (opened on first use)"""
+        if self.__window is None:
+            self.__window = visual.Window(size=self.window_size, color=self.background_color, units=self.units)
+        return self.__window
+
+    @property
+    def line_object(self):
+        """PsychoPy line instance the image's lines are drawn with (created on first use)"""
+        if self.__line_object is None:
+            self.__line_object = visual.Line(self.window, units=self.units,
+                                             lineWidth=self.line_width, lineColor=self.line_color,
+                                             lineColorSpace="rgb",
+                                             start=(0, 0),
+                                             end=(0, 0),
+                                             opacity=1,
+                                             interpolate=True)
+        return self.__line_object
+
+    def close_window(self):
+        """close the image's window, if it has been opened (a window that was passed when creating the
+        image is left open)
+        :return: None"""
+        if self.__window is not None and self.has_own_window:
+            self.__window.close()
 
     def add_figure(self, figure):
         """set the image's figure. there may only be one. its frame will be set to this Image
         instance's frame, if it was a different one.
         :type figure: Figure"""
         figure.frame = self.frame
+        figure.rng = self.rng
         self.figure = figure
-        self.nonextended_figure = deepcopy(figure)
+        self.figure_aligned = False
+        self.figure_shifted = False
+        self.store_nonextended_figure()
+
+    def store_nonextended_figure(self):
+        """store a copy of the figure in its current state, to be used for drawing just the figure"""
+        # the copy shares the (unchanging) frame and the random number generator with the figure
+        shared_objects = {id(self.frame): self.frame, id(self.rng): self.rng}
+        with Profiler.stage("deepcopy"):
+            self.nonextended_figure = deepcopy(self.figure, shared_objects)
 
     def add_random_figure(self):
-        fig_name, line_collection = FigureLineCollections.grab_random_collection()
-        rand_fig = Figure(line_collection, self.frame)
+        fig_name, _ = FigureLineCollections.grab_random_collection(self.rng)
+        rand_fig = Figure.from_template(TargetTemplate.get_by_name(fig_name), self.frame, rng=self.rng)
         rand_fig.figure_name = fig_name
         self.add_figure(rand_fig)
 
     def add_figure_by_name(self, figure_name):
         assert figure_name in FigureLineCollections.all_line_collections.keys(), "Please specify a valid figure " \
                                                                                    "name, in the format <[A-D][1-4]>"
-        named_fig = Figure(FigureLineCollections.all_line_collections[figure_name], self.frame)
+        named_fig = Figure.from_template(TargetTemplate.get_by_name(figure_name), self.frame, rng=self.rng)
         named_fig.figure_name = figure_name
         self.add_figure(named_fig)
 
@@ -61,7 +135,9 @@ class LeftImage:
         if self.figure is None:
             return False
         self.figure.randomly_position()
-        self.nonextended_figure = deepcopy(self.figure)
+        self.figure_aligned = False
+        self.figure_shifted = False
+        self.store_nonextended_figure()
         return True
 
     def extend_figure_line(self):
@@ -103,29 +179,51 @@ class LeftImage:
     def align_figure_with_frame(self):
         if self.figure is None:
             return False
-        self.figure.align_with_frame()
-        self.nonextended_figure = deepcopy(self.figure)
+        res = self.figure.align_with_frame()
+        self.figure_aligned = self.figure_aligned or res
+        self.store_nonextended_figure()
+        return res
 
     def shift_figure_to_frame(self):
         if self.figure is None:
             return False
         res = self.figure.shift_to_frame()
-        self.nonextended_figure = deepcopy(self.figure)
+        self.figure_shifted = self.figure_shifted or res
+        self.store_nonextended_figure()
         return res
 
+    def add_non_fig_line(self, line):
+        """add the passed line to the image's non-figure lines, registering it with the attachment graph
+        :type line: Line"""
+        self.non_fig_lines.append(line)
+        self.attachment_graph.add(line)
+
+    def add_figure_linked_line(self, line):
+        """add the passed line to the lines that are attached to the figure, registering it with
+        the attachment graph
+        :type line: Line"""
+        self.figure_linked_lines.append(line)
+        self.attachment_graph.add(line)
+
     def add_side2side_line(self, orientation):
         """add a line to the image that runs from one of the frame's sides
-         to another side, with specified orientation"""
+         to another side, with specified orientation (throws an error if no line that is
+         far enough away from all existing lines is found within 100 attempts)"""
         already_existing_lines = self.get_all_lines()
         too_close = True
+        counter = 100
         while too_close:
+            if counter <= 0:
+                raise AttributeError("no room for another side-to-side line")
+            counter -= 1
             too_close = False
             new_line_candidate = self.frame.fling_side_to_side(orientation=orientation)
             for line in already_existing_lines:
                 if line.get_max_dist(new_line_candidate) < 40:
                     too_close = True
+                    Profiler.count("side2side_rejections")
                     break
-        self.non_fig_lines.append(new_line_candidate)
+        self.add_non_fig_line(new_line_candidate)
 
     def add_side2line_line(self, orientation):
         """add a line, with specified orientation, to the image that runs from one of the frame's sides
@@ -134,33 +232,32 @@ class LeftImage:
         if len(self.non_fig_lines) < 1 and self.figure is None:
             return False
         if self.figure is None:
-            start_line = random.choice(self.non_fig_lines)
-            self.non_fig_lines.append(self.frame.fling_side_to_line(start_line=start_line,
-                                                                     orientation=orientation))
+            start_line = RandomFunctions.choice(self.rng, self.non_fig_lines)
+            self.add_non_fig_line(self.frame.fling_side_to_line(start_line=start_line, orientation=orientation))
         else:
-            start_line = random.choice(self.figure.lines + self.non_fig_lines)
+            start_line = RandomFunctions.choice(self.rng, self.figure.lines + self.non_fig_lines)
             if start_line in self.figure.lines:
-                self.figure_linked_lines.append(self.frame.fling_side_to_line(start_line=start_line,
-                                                                               orientation=orientation))
+                self.add_figure_linked_line(self.frame.fling_side_to_line(start_line=start_line,
+                                                                          orientation=orientation))
             else:
-                self.non_fig_lines.append(self.frame.fling_side_to_line(start_line=start_line,
-                                                                         orientation=orientation))
+                self.add_non_fig_line(self.frame.fling_side_to_line(start_line=start_line,
+                                                                    orientation=orientation))
 
     def add_line2line_line(self):
         """add a line to the image that runs between two non-frame lines, if at least two non-frame lines exist"""
         if len(self.non_fig_lines) < 2 and (self.figure is None or len(self.non_fig_lines) < 1):
             return False
         if self.figure is None:
-            start_line, end_line = random.sample(self.non_fig_lines, 2)
-            self.non_fig_lines.append(start_line.fling_to_line(end_line))
+            start_line, end_line = RandomFunctions.sample(self.rng, self.non_fig_lines, 2)
+            self.add_non_fig_line(start_line.fling_to_line(end_line, rng=self.rng))
         else:
             all_lines = self.figure.lines + self.non_fig_lines
-            start_line = random.choice(all_lines)
-            end_line = random.choice(self.non_fig_lines)
+            start_line = RandomFunctions.choice(self.rng, all_lines)
+            end_line = RandomFunctions.choice(self.rng, self.non_fig_lines)
             if start_line in self.figure.lines or end_line in self.figure.lines:
-                self.figure_linked_lines.append(start_line.fling_to_line(end_line))
+                self.add_figure_linked_line(start_line.fling_to_line(end_line, rng=self.rng))
             else:
-                self.non_fig_lines.append(start_line.fling_to_line(end_line))
+                self.add_non_fig_line(start_line.fling_to_line(end_line, rng=self.rng))
 
     def add_random_line(self, orientation='diagonal'):
         """add a random line. the different kinds of lines are weighted, so that
@@ -176,165 +273,578 @@ class LeftImage:
         line_added = False
         while not line_added:
             try:
-                line_func = random.choice(line_funcs)
+                line_func = RandomFunctions.choice(self.rng, line_funcs)
                 if 'orientation' in inspect.getfullargspec(line_func).args:
                     line_func(orientation)
                 else:
                     line_func()
                 line_added = True
-            except AttributeError as e:
-                print(e)
-                print('trying to add random line again...')
+            except AttributeError:
+                Profiler.count("random_line_retries")
 
     def draw(self):
         """draw all the elements in the Image instance"""
-        self.frame.draw(self.window, self.line_object)
-        if self.figure is not None:
-            for line in self.figure.lines:
-                if line.is_horizontal() and line.start_point.y in \
-                        (self.frame.top_line.start_point.y, self.frame.bottom_line.start_point.y):
-                    continue
-                elif line.is_vertical() and line.start_point.x in \
-                        (self.frame.left_line.start_point.x, self.frame.right_line.start_point.x):
-                    continue
-                line.draw(self.window, self.line_object)
-        for line in self.non_fig_lines:
-            if line.is_horizontal() and line.start_point.y in \
-                    (self.frame.top_line.start_point.y, self.frame.bottom_line.start_point.y):
-                continue
-            elif line.is_vertical() and line.start_point.x in \
-                    (self.frame.left_line.start_point.x, self.frame.right_line.start_point.x):
-                continue
-            line.draw(self.window, self.line_object)
-        for line in self.figure_linked_lines:
-            line.draw(self.window, self.line_object)
+        self.draw_lines(self.get_drawn_lines())
 
     def draw_just_figure(self):
         """draw all the elements in the Image instance"""
-        self.frame.draw(self.window, self.line_object)
+        self.draw_lines(self.get_drawn_just_figure_lines())
+
+    def draw_lines(self, lines):
+        """draw the passed lines, e. g. as returned by get_drawn_lines()
+        :type lines: list of Line instances"""
+        with Profiler.stage("draw"):
+            for line in lines:
+                line.draw(self.window, self.line_object)
+
+    def save_frame(self, file_path):
+        """flip the window, then read back and save what was drawn to the specified file path. if the
+        image has an encoder, the file extension may be changed to match the encoder's format
+        :return: the path the image was saved to"""
+        with Profiler.stage("flip"):
+            self.window.flip()
+        with Profiler.stage("readback"):
+            frame_image = self.window.getMovieFrame()
+        with Profiler.stage("encode"):
+            if self.encoder is None:
+                self.window.saveMovieFrames(fileName=file_path)
+                return file_path
+            self.window.movieFrames = []
+            return self.encoder.save(frame_image, file_path, self.background_color, self.line_color)
+
+    def render_frame(self, lines):
+        """draw the passed lines, flip the window and return what was drawn as an image, without
+        saving it to a file
+        :type lines: list of Line instances
+        :return: PIL.Image.Image"""
+        self.draw_lines(lines)
+        with Profiler.stage("flip"):
+            self.window.flip()
+        with Profiler.stage("readback"):
+            frame_image = self.window.getMovieFrame()
+            self.window.movieFrames = []
+        return frame_image
+
+    def to_pixel_coords(self, x, y):
+        """returns the pixel position, (column, row) counted from the top left corner of the saved
+        images, of the passed position in the image's units. only 'pix', 'norm' and 'height' units
+        are supported
+        :return: tuple of float"""
+        assert self.units in ("pix", "norm", "height"), \
+            "pixel positions can only be computed for 'pix', 'norm' and 'height' units"
+        width, height = self.window_size
+        if self.units == "norm":
+            x, y = x * width / 2, y * height / 2
+        elif self.units == "height":
+            x, y = x * height, y * height
+        return width / 2 + x, height / 2 - y
+
+    def from_pixel_coords(self, column, row):
+        """returns the position, in the image's units, of the passed pixel position (column, row) counted
+        from the top left corner of the saved images, e. g. a click on an image shown in a web browser.
+        the inverse of to_pixel_coords()
+        :return: tuple of float"""
+        assert self.units in ("pix", "norm", "height"), \
+            "pixel positions can only be converted for 'pix', 'norm' and 'height' units"
+        width, height = self.window_size
+        x, y = column - width / 2, height / 2 - row
+        if self.units == "norm":
+            return x * 2 / width, y * 2 / height
+        if self.units == "height":
+            return x / height, y / height
+        return x, y
+
+    def get_figure_bbox(self):
+        """returns the bounding box of the (non-extended) figure as drawn, in pixels, as [left, top,
+        right, bottom], counted from the top left corner of the saved images. the box includes the
+        width of the lines and is clipped to the window. returns None if there is no figure
+        :return: list of float or None"""
+        if self.nonextended_figure is None:
+            return None
+        pixel_points = [self.to_pixel_coords(point.x, point.y) for line in self.nonextended_figure.lines
+                        for point in (line.start_point, line.end_point)]
+        half_width = self.line_width / 2
+        columns, rows = [point[0] for point in pixel_points], [point[1] for point in pixel_points]
+        return [max(0, min(columns) - half_width), max(0, min(rows) - half_width),
+                min(self.window_size[0], max(columns) + half_width), min(self.window_size[1], max(rows) + half_width)]
+
+    def render_figure_mask(self):
+        """returns a single-channel ('L') image, of the same size as the rendered images, where the pixels
+        covered by the (non-extended) figure's lines are 255 and all other pixels are 0. the mask is drawn
+        directly from the figure's geometry, without using the window and without anti-aliasing, so it
+        only approximates the pixels PsychoPy draws (edge pixels of the anti-aliased lines may differ)
+        :return: PIL.Image.Image"""
+        assert self.nonextended_figure is not None, "the Image instance must include a figure in order to " \
+                                                    "use render_figure_mask()"
+        with Profiler.stage("labels"):
+            return self.render_lines_without_window(self.nonextended_figure.lines, as_mask=True)
+
+    def render_lines_without_window(self, lines, as_mask=False):
+        """draw the passed lines using PIL instead of PsychoPy, without anti-aliasing, and return the
+        result as an image of the window's size
+        :type lines: list of Line instances
+        :param as_mask: if True, a single-channel ('L') image is returned, with the lines drawn as 255 on
+        0, instead of an RGB image in the image's colours
+        :type as_mask: bool
+        :return: PIL.Image.Image"""
+        if as_mask:
+            image, line_color = Image.new("L", self.window_size, 0), 255
+        else:
+            background_color, line_color = (tuple(ImageEncoder.to_rgb255(color).round().astype(int).tolist())
+                                            for color in (self.background_color, self.line_color))
+            image = Image.new("RGB", self.window_size, background_color)
+        draw = ImageDraw.Draw(image)
+        for line in lines:
+            draw.line([self.to_pixel_coords(line.start_point.x, line.start_point.y),
+                       self.to_pixel_coords(line.end_point.x, line.end_point.y)],
+                      fill=line_color, width=max(1, round(self.line_width)))
+        return image
+
+    def is_on_frame_border(self, line):
+        """returns True if the passed line is horizontal/vertical and lies on top of one of the
+        frame's sides (such lines are not drawn, as the frame is drawn in their place)
+        :type line: Line
+        :return: bool"""
+        if line.is_horizontal():
+            return line.start_point.y in (self.frame.top_line.start_point.y, self.frame.bottom_line.start_point.y)
+        if line.is_vertical():
+            return line.start_point.x in (self.frame.left_line.start_point.x, self.frame.right_line.start_point.x)
+        return False
+
+    def get_drawn_lines(self, include_frame=True):
+        """returns new Line instances, with copied points, for every line that draw() would
+        draw given the image's current state. figure lines are returned with their extended points
+        :param include_frame: whether to include the frame's lines
+        :type include_frame: bool
+        :return: list of Line instances"""
+        return [line for _, line in self.get_tagged_drawn_lines(include_frame)]
+
+    def get_tagged_drawn_lines(self, include_frame=True):
+        """like get_drawn_lines(), but returns each line together with its kind, as a (kind, Line)
+        tuple. the kind is one of LeftImage.line_kinds: 'frame', 'figure', 'non_fig' or 'figure_linked'
+        :param include_frame: whether to include the frame's lines
+        :type include_frame: bool
+        :return: list of tuples"""
+        drawn_lines = [("frame", line) for line in self.frame.lines] if include_frame else []
         if self.figure is not None:
-            for line in self.nonextended_figure.lines:
-                if line.is_horizontal() and line.start_point.y in \
-                        (self.frame.top_line.start_point.y, self.frame.bottom_line.start_point.y):
-                    continue
-                elif line.is_vertical() and line.start_point.x in \
-                        (self.frame.left_line.start_point.x, self.frame.right_line.start_point.x):
+            drawn_lines.extend(("figure", Line(line.start_ext_point, line.end_ext_point))
+                               for line in self.figure.lines if not self.is_on_frame_border(line))
+        drawn_lines.extend(("non_fig", line) for line in self.non_fig_lines if not self.is_on_frame_border(line))
+        drawn_lines.extend(("figure_linked", line) for line in self.figure_linked_lines)
+        return [(kind, Line(Point(line.start_point.x, line.start_point.y), Point(line.end_point.x, line.end_point.y)))
+                for kind, line in drawn_lines]
+
+    def get_drawn_just_figure_lines(self, include_frame=True):
+        """returns new Line instances, with copied points, for every line that draw_just_figure()
+        would draw given the image's current state
+        :param include_frame: whether to include the frame's lines
+        :type include_frame: bool
+        :return: list of Line instances"""
+        return [line for _, line in self.get_tagged_drawn_just_figure_lines(include_frame)]
+
+    def get_tagged_drawn_just_figure_lines(self, include_frame=True):
+        """like get_drawn_just_figure_lines(), but returns each line together with its kind (see
+        get_tagged_drawn_lines())
+        :param include_frame: whether to include the frame's lines
+        :type include_frame: bool
+        :return: list of tuples"""
+        drawn_lines = [("frame", line) for line in self.frame.lines] if include_frame else []
+        if self.figure is not None:
+            drawn_lines.extend(("figure", line) for line in self.nonextended_figure.lines
+                               if not self.is_on_frame_border(line))
+        return [(kind, Line(Point(line.start_point.x, line.start_point.y), Point(line.end_point.x, line.end_point.y)))
+                for kind, line in drawn_lines]
+
+    def get_segment_index(self, include_frame=True, cell_size=None):
+        """returns a spatial index of the lines drawn given the image's current state (see
+        get_tagged_drawn_lines()), over the frame, for finding the line nearest to a point or a traced
+        path, e. g. a participant's response (see SegmentIndex.hit_test() and hit_test_polyline()). only
+        the figure's own (non-extended) lines are indexed as 'figure' lines; the parts by which they
+        have been extended are distractors, and are indexed as 'figure_extension' lines. as the index
+        isn't updated when the image changes, it should be created once the image is final, and before
+        the figure is replaced
+        :param include_frame: whether the frame's lines can be hit as well
+        :type include_frame: bool
+        :param cell_size: size of the index's grid cells (see SegmentIndex)
+        :type cell_size: float
+        :return: SegmentIndex"""
+        tagged_lines = [(kind, line) for kind, line in self.get_tagged_drawn_lines(include_frame) if kind != "figure"]
+        if self.figure is not None:
+            for line in self.figure.lines:
+                if self.is_on_frame_border(line):
                     continue
-                line.draw(self.window, self.line_object)
+                tagged_lines.append(("figure", Line(Point(line.start_point.x, line.start_point.y),
+                                                    Point(line.end_point.x, line.end_point.y))))
+                for start, end in ((line.start_ext_point, line.start_point), (line.end_point, line.end_ext_point)):
+                    if (start.x, start.y) != (end.x, end.y):
+                        tagged_lines.append(("figure_extension", Line(Point(start.x, start.y), Point(end.x, end.y))))
+        frame_width, frame_height = self.frame_size
+        return SegmentIndex(tagged_lines,
+                            bounds=(-frame_width / 2, -frame_height / 2, frame_width / 2, frame_height / 2),
+                            cell_size=cell_size)
+
+    def validate(self, validator=None):
+        """check the image's current geometry for problems, without rendering anything, and
+        return a list of strings describing each problem found (empty if there were none)
+        :param validator: validator to use. a StimulusValidator with default settings is used if None
+        :type validator: StimulusValidator
+        :return: list of str"""
+        if validator is None:
+            validator = StimulusValidator()
+        return validator.validate(self)
 
     def get_all_lines(self):
         if self.figure is None:
             return self.non_fig_lines + self.figure_linked_lines
         return self.figure.lines + self.non_fig_lines + self.figure_linked_lines
 
+    def get_metadata(self):
+        """returns a dict describing how the image was generated, e. g. for storing alongside the
+        saved images (see save_to_sink()). if the image has metrics, its complexity metrics are
+        included as well. should be called before the figure is replaced
+        :return: dict"""
+        metadata = {
+            "seed": self.seed,
+            "window_width": self.window_size[0], "window_height": self.window_size[1], "units": self.units,
+            "frame_width": self.frame_size[0], "frame_height": self.frame_size[1],
+            "line_width": self.line_width,
+            "line_color": list(self.line_color), "background_color": list(self.background_color),
+            "figure_name": None, "figure_x": None, "figure_y": None,
+            "figure_width": None, "figure_height": None, "figure_offset_x": None, "figure_offset_y": None,
+            "figure_locked_x": False, "figure_locked_y": False,
+            "figure_aligned": self.figure_aligned, "figure_shifted": self.figure_shifted,
+            "num_figure_lines": 0, "num_extended_figure_lines": 0,
+            "num_non_fig_lines": len(self.non_fig_lines), "num_figure_linked_lines": len(self.figure_linked_lines),
+            "figure_bbox": None
+        }
+        metadata.update(self.get_line_type_counts())
+        if self.figure is not None:
+            metadata.update({
+                "figure_name": self.figure.figure_name,
+                "figure_x": self.figure.get_lowest_x_coord(), "figure_y": self.figure.get_lowest_y_coord(),
+                "figure_width": self.figure.width, "figure_height": self.figure.height,
+                "figure_offset_x": self.figure.offset_x, "figure_offset_y": self.figure.offset_y,
+                "figure_locked_x": self.figure.locked_x, "figure_locked_y": self.figure.locked_y,
+                "num_figure_lines": len(self.figure.lines),
+                "num_extended_figure_lines": sum([line.extended for line in self.figure.lines])
+            })
+            if self.units in ("pix", "norm", "height"):
+                metadata["figure_bbox"] = self.get_figure_bbox()
+        if self.metrics is not None:
+            metadata.update(self.metrics.compute(self))
+        return metadata
+
+    def get_line_type_counts(self):
+        """returns how many of the image's non-figure lines run from one frame side to another, from a
+        frame side to another line, and between two other lines
+        :return: dict"""
+        counts = {"num_frame_to_frame_lines": 0, "num_frame_to_line_lines": 0, "num_line_to_line_lines": 0}
+        for line in self.non_fig_lines + self.figure_linked_lines:
+            num_frame_parents = sum([parent in self.frame.lines for parent in (line.start_line, line.end_line)])
+            key = ("num_line_to_line_lines", "num_frame_to_line_lines", "num_frame_to_frame_lines")[num_frame_parents]
+            counts[key] += 1
+        return counts
+
+    def get_fingerprint(self, quantum=4):
+        """returns a fingerprint of the image's current geometry, which can be used for detecting
+        near-duplicate images (see FingerprintIndex)
+        :param quantum: quantization step, in the image's units
+        :type quantum: float
+        :return: GeometricFingerprint"""
+        return GeometricFingerprint.from_image(self, quantum=quantum)
+
     def jiggle_non_fig_lines(self):
         for line in self.non_fig_lines:
-            line.jiggle_all()
+            line.jiggle_all(rng=self.rng)
+            self.attachment_graph.mark_changed(line)
 
     def replace_figure_with_lines(self):
-        """remove the image's figure and replace it with random lines"""
+        """remove the image's figure and replace it with random lines. afterwards, only the lines
+        that have been changed since they were added, e. g. jiggled, and the lines attached
+        (directly or indirectly) to them are re-extended to their parents"""
         assert self.figure is not None, "the Image instance must include a figure in order to use " \
                                          "draw_without_figure()"
         assert len(self.get_all_lines()) > 5, "Image instance must hold a minimum of 6 lines before replacing figure"
         extended_lines = [line.get_extended_version(self.frame) for line in self.figure.lines + self.figure_linked_lines]
         num_non_extended_fig_lines = sum([line.extended for line in self.figure.lines])
+        for line in self.figure_linked_lines:
+            self.attachment_graph.remove(line)
         self.figure = None
         self.figure_linked_lines = []
-        num_to_jiggle = random.randint(len(extended_lines)//3, len(extended_lines)//3*2)
+        num_to_jiggle = int(self.rng.integers(len(extended_lines)//3, len(extended_lines)//3*2 + 1))
         num_not_to_jiggle = len(extended_lines)-num_to_jiggle
-        num_to_leave_alone = random.randint(num_not_to_jiggle//3, num_not_to_jiggle//3*2)
-        num_to_replace = len(extended_lines) - num_to_jiggle - num_to_leave_alone
+        num_to_leave_alone = int(self.rng.integers(num_not_to_jiggle//3, num_not_to_jiggle//3*2 + 1))
 
-        jiggle_lines = random.sample(extended_lines, num_to_jiggle)
-        non_jiggle_lines = set(extended_lines) - set(jiggle_lines)
-        leave_alone_lines = random.sample(non_jiggle_lines, num_to_leave_alone)
-        to_be_replaced_lines = set(extended_lines) - set(jiggle_lines) - set(leave_alone_lines)
+        # the lines are split up by shuffling them once, so that the split is reproducible for a given seed
+        shuffled_lines = RandomFunctions.shuffled(self.rng, extended_lines)
+        jiggle_lines = shuffled_lines[:num_to_jiggle]
+        leave_alone_lines = shuffled_lines[num_to_jiggle:num_to_jiggle + num_to_leave_alone]
+        to_be_replaced_lines = shuffled_lines[num_to_jiggle + num_to_leave_alone:]
 
         for line in jiggle_lines:
-            line.jiggle_all()
-            self.non_fig_lines.append(line)
+            line.jiggle_all(rng=self.rng)
+            self.add_non_fig_line(line)
+            self.attachment_graph.mark_changed(line)
 
-        self.non_fig_lines.extend(leave_alone_lines)
+        for line in leave_alone_lines:
+            self.add_non_fig_line(line)
 
         for line in to_be_replaced_lines:
             orientation = line.get_orientation()
             if num_non_extended_fig_lines > 0:
-                add_fun = random.choice(["line2line", "side2line"])
-                if add_fun == "line2line":
-                    self.add_line2line_line()
-                else:
-                    self.add_side2side_line(orientation)
+                add_fun = RandomFunctions.choice(self.rng, ["line2line", "side2line"])
+                try:
+                    if add_fun == "line2line":
+                        self.add_line2line_line()
+                    else:
+                        self.add_side2side_line(orientation)
+                except AttributeError:
+                    self.add_random_line(orientation=orientation)
                 num_non_extended_fig_lines -= 1
             else:
                 self.add_random_line(orientation=orientation)
 
-        all_lines_after_transform = self.get_all_lines()
-        for line in all_lines_after_transform:
-            if isinstance(line, AttachedLine):
-                line.extend_to_parents(self.frame)
+        self.attachment_graph.extend_changed(self.frame, rng=self.rng)
 
     def close_figure_free_points(self):
         if self.figure is None:
             return False
-        grown_lines = self.figure.close_up_free_points()
-        self.non_fig_lines.extend(grown_lines)
+        for grown_line in self.figure.close_up_free_points():
+            self.add_non_fig_line(grown_line)
 
     def grow_figure_line(self):
         if self.figure is None:
             return False
-        orientation = random.choice(["horizontal", "vertical", "diagonal", "diagonal"])
+        orientation = RandomFunctions.choice(self.rng, ["horizontal", "vertical", "diagonal", "diagonal"])
         grown_line = self.figure.grow_line(orientation=orientation)
         if grown_line:
-            self.non_fig_lines.append(grown_line)
+            self.add_non_fig_line(grown_line)
             return True
         return False
 
     def save_image(self, file_dir):
         """draw and save the image to the specified file directory"""
         if self.figure is None:
-            file_path = os.path.join(file_dir, "no_figure_" + str(random.randint(1, 20000)) + ".png")
+            file_path = os.path.join(file_dir, "no_figure_" + str(self.rng.integers(1, 20001)) + ".png")
         else:
-            file_path = os.path.join(file_dir, self.figure.figure_name + "_" + str(random.randint(1, 20000)) + ".png")
+            file_path = os.path.join(file_dir, self.figure.figure_name + "_" + str(self.rng.integers(1, 20001)) + ".png")
         self.draw()
-        self.window.flip()
-        self.window.getMovieFrame()
-        self.window.saveMovieFrames(fileName=file_path)
+        self.save_frame(file_path)
+
+    def get_image_and_context_lines(self, validator=None, tagged=False):
+        """returns the lines to draw for an image where only the figure/target is included, the image
+        itself and a context image where the figure has been replaced with random lines (replacing
+        the figure in the process), as a dict with keys 'onlyfigure', 'embeddedfigure' and
+        'nofigure'. if a validator is passed, the geometry of all three images is checked, and None is
+        returned if a problem is found (the problems found are then stored in the rejection_reasons
+        attribute, and the window is closed)
+        :type validator: StimulusValidator
+        :param tagged: if True, each line is returned together with its kind (see get_tagged_drawn_lines())
+        :type tagged: bool
+        :return: dict or None"""
+        self.rejection_reasons = []
+        if validator is not None:
+            with Profiler.stage("validate"):
+                self.rejection_reasons.extend(validator.validate(self))
+        only_figure_lines = self.get_tagged_drawn_just_figure_lines()
+        embedded_figure_lines = self.get_tagged_drawn_lines()
+        with Profiler.stage("replace_figure"):
+            self.jiggle_non_fig_lines()
+            self.replace_figure_with_lines()
+        if validator is not None:
+            with Profiler.stage("validate"):
+                self.rejection_reasons.extend("no figure: " + reason for reason in validator.validate(self))
+        if self.rejection_reasons:
+            self.close_window()
+            return None
+        variant_lines = {"onlyfigure": only_figure_lines, "embeddedfigure": embedded_figure_lines,
+                         "nofigure": self.get_tagged_drawn_lines()}
+        if tagged:
+            return variant_lines
+        return {variant: [line for _, line in lines] for variant, lines in variant_lines.items()}
 
-    def save_image_and_context(self, file_dir):
+    def save_image_and_context(self, file_dir, validator=None, manifest=None, with_labels=False, stimulus_id=None):
         """draw and save the image, a context image where the figure has been replaced with
         random lines, and an image where only the figure/target is included,
-        to the specified file directory
+        to the specified file directory. if a validator is passed, the geometry of all three
+        images is checked before anything is rendered, and nothing is saved if a problem is
+        found. returns True if the images were saved, otherwise False (the problems found are
+        then stored in the rejection_reasons attribute)
+        :type validator: StimulusValidator
+        :param manifest: if passed, a row describing the image (also if it was rejected) is added to it
+        :type manifest: ManifestWriter
+        :param with_labels: if True, a mask of the figure's pixels (see render_figure_mask()) is saved as
+        well, as variant 'figuremask', together with the figure's bounding box (see get_figure_bbox()) as
+        '<stimulus id>_figurebox.json'
+        :type with_labels: bool
+        :param stimulus_id: stem of the file names, '<stimulus id>_<variant>.png'. if None, the figure's
+        name followed by a random number is used, so use a unique identifier when saving many images to
+        the same directory
+        :type stimulus_id: str
+        :return: bool
         """
         assert self.figure is not None, "the Image instance must include a figure in order to use " \
                                          "save_image_and_contexts()"
-        file_no = str(random.randint(1, 20000))
-        file_path = os.path.join(
-            file_dir,
-            self.figure.figure_name + "_" +
-                file_no + "_onlyfigure.png"
-        )
-        self.draw_just_figure()
-        self.window.flip()
-        self.window.getMovieFrame()
-        self.window.saveMovieFrames(fileName=file_path)
-        file_path = os.path.join(
-            file_dir,
-            self.figure.figure_name + "_" +
-                file_no + "_embeddedfigure.png"
-        )
-        self.draw()
-        self.window.flip()
-        self.window.getMovieFrame()
-        self.window.saveMovieFrames(fileName=file_path)
-        file_path = os.path.join(
-            file_dir,
-            self.figure.figure_name + "_" +
-                file_no + "_nofigure.png"
-        )
-        self.jiggle_non_fig_lines()
-        self.replace_figure_with_lines()
-        self.draw()
-        self.window.flip()
-        self.window.getMovieFrame()
-        self.window.saveMovieFrames(fileName=file_path)
-        self.window.close()
+        if stimulus_id is None:
+            stimulus_id = self.figure.figure_name + "_" + str(self.rng.integers(1, 20001))
+        metadata = self.get_metadata() if manifest is not None else None
+        figure_mask = self.render_figure_mask() if with_labels else None
+        figure_bbox = self.get_figure_bbox() if with_labels else None
+        variant_lines = self.get_image_and_context_lines(validator)
+        if variant_lines is None:
+            if manifest is not None:
+                manifest.add(stimulus_id, metadata, self.rejection_reasons)
+            return False
+
+        file_paths = []
+        for variant, lines in variant_lines.items():
+            file_path = os.path.join(file_dir, stimulus_id + "_" + variant + ".png")
+            self.draw_lines(lines)
+            file_paths.append(self.save_frame(file_path))
+        self.close_window()
+        if figure_mask is not None:
+            file_path = os.path.join(file_dir, stimulus_id + "_figuremask.png")
+            with Profiler.stage("encode"):
+                figure_mask.save(file_path)
+            file_paths.append(file_path)
+            file_path = os.path.join(file_dir, stimulus_id + "_figurebox.json")
+            with open(file_path, "w") as f:
+                json.dump({"figure_bbox": figure_bbox}, f)
+            file_paths.append(file_path)
+        if manifest is not None:
+            manifest.add(stimulus_id, metadata, output=";".join(file_paths))
+        return True
+
+    def render_image_and_context(self, validator=None, with_labels=False):
+        """like save_image_and_context(), but returns the three images, as a dict with keys
+        'onlyfigure', 'embeddedfigure' and 'nofigure', instead of saving them. returns None if a
+        validator is passed and a problem is found
+        :type validator: StimulusValidator
+        :param with_labels: if True, a mask of the figure's pixels (see render_figure_mask()) is
+        included as well, with key 'figuremask'
+        :type with_labels: bool
+        :return: dict of PIL.Image.Image or None"""
+        assert self.figure is not None, "the Image instance must include a figure in order to use " \
+                                         "render_image_and_context()"
+        figure_mask = self.render_figure_mask() if with_labels else None
+        variant_lines = self.get_image_and_context_lines(validator)
+        if variant_lines is None:
+            return None
+        images = {variant: self.render_frame(lines) for variant, lines in variant_lines.items()}
+        self.close_window()
+        if figure_mask is not None:
+            images["figuremask"] = figure_mask
+        return images
+
+    def render_coverage_and_context(self, validator=None, with_labels=False):
+        """like render_image_and_context(), but returns each image as a coverage raster (see
+        Colorways), from which the images can be produced in any colour scheme. the image's own line and
+        background colours are only used for rendering, so they should contrast strongly. the figure mask
+        (with_labels=True) is returned as it is, as an array of 0 and 255
+        :type validator: StimulusValidator
+        :type with_labels: bool
+        :return: dict of numpy arrays of uint8 or None"""
+        images = self.render_image_and_context(validator, with_labels=with_labels)
+        if images is None:
+            return None
+        with Profiler.stage("coverage"):
+            return {variant: np.asarray(image) if ImageEncoder.is_label(image) else
+                    Colorways.to_coverage_raster(image, self.background_color, self.line_color)
+                    for variant, image in images.items()}
+
+    def save_to_sink(self, sink, stimulus_id=None, validator=None, manifest=None, with_labels=False):
+        """render the image, the context image and the figure-only image (see save_image_and_context())
+        and write them, together with the image's metadata (see get_metadata()), to the passed sink
+        (e. g. a DirectorySink or a ShardWriter). returns True if the images were written, otherwise
+        False (if a validator was passed and a problem was found)
+        :param stimulus_id: identifier for the set of images. if None, an identifier in the same format
+        as the file names used by save_image_and_context() is generated
+        :type stimulus_id: str
+        :type validator: StimulusValidator
+        :param manifest: if passed, a row describing the image (also if it was rejected) is added to it
+        :type manifest: ManifestWriter
+        :param with_labels: if True, a mask of the figure's pixels is written as well (see
+        render_image_and_context())
+        :type with_labels: bool
+        :return: bool"""
+        assert self.figure is not None, "the Image instance must include a figure in order to use " \
+                                         "save_to_sink()"
+        if stimulus_id is None:
+            stimulus_id = self.figure.figure_name + "_" + str(self.rng.integers(1, 20001))
+        metadata = self.get_metadata()
+        images = self.render_image_and_context(validator, with_labels=with_labels)
+        if images is None:
+            if manifest is not None:
+                manifest.add(stimulus_id, metadata, self.rejection_reasons)
+            return False
+        metadata["stimulus_id"] = stimulus_id
+        output = sink.write_set(stimulus_id, images, metadata)
+        if manifest is not None:
+            manifest.add(stimulus_id, metadata, output=output)
+        return True
+
+    def save_colorways_to_sink(self, sink, colorways, stimulus_id=None, validator=None, manifest=None,
+                               with_labels=False):
+        """like save_to_sink(), but renders the images only once and writes them in each of the passed
+        colour schemes, as a separate set with identifier '<stimulus id>_<scheme name>'. the metadata of
+        each set holds the scheme's colours and its name, as 'color_scheme'
+        :type colorways: Colorways
+        :param stimulus_id: identifier for the images (see save_to_sink())
+        :type stimulus_id: str
+        :type validator: StimulusValidator
+        :param manifest: if passed, a row describing the image (also if it was rejected) is added to it,
+        with the outputs of all colour schemes
+        :type manifest: ManifestWriter
+        :type with_labels: bool
+        :return: bool"""
+        assert self.figure is not None, "the Image instance must include a figure in order to use " \
+                                         "save_colorways_to_sink()"
+        if stimulus_id is None:
+            stimulus_id = self.figure.figure_name + "_" + str(self.rng.integers(1, 20001))
+        metadata = self.get_metadata()
+        coverages = self.render_coverage_and_context(validator, with_labels=with_labels)
+        if coverages is None:
+            if manifest is not None:
+                manifest.add(stimulus_id, metadata, self.rejection_reasons)
+            return False
+        metadata["stimulus_id"] = stimulus_id
+        # the figure mask is a label rather than a rendering, so it is written as it is for every scheme
+        figure_mask = coverages.pop("figuremask", None)
+        outputs = []
+        for name, images in colorways.recolor_set(coverages).items():
+            if figure_mask is not None:
+                images["figuremask"] = Image.fromarray(figure_mask)
+            background_color, line_color = colorways.color_schemes[name]
+            scheme_metadata = dict(metadata, stimulus_id=stimulus_id + "_" + name, color_scheme=name,
+                                   background_color=list(background_color), line_color=list(line_color))
+            outputs.append(sink.write_set(stimulus_id + "_" + name, images, scheme_metadata))
+        if manifest is not None:
+            manifest.add(stimulus_id, metadata, output=";".join(outputs))
+        return True
+
+    def save_geometry(self, store, stimulus_id=None, validator=None, manifest=None):
+        """like save_to_sink(), but writes the lines of the image, the context image and the
+        figure-only image to the passed GeometryStoreWriter instead of rendering them. the images can
+        be rendered later on from the stored lines (see GeometryStore.get_lines())
+        :type store: GeometryStoreWriter
+        :param stimulus_id: identifier for the set (see save_to_sink())
+        :type stimulus_id: str
+        :type validator: StimulusValidator
+        :type manifest: ManifestWriter
+        :return: bool"""
+        assert self.figure is not None, "the Image instance must include a figure in order to use " \
+                                         "save_geometry()"
+        if stimulus_id is None:
+            stimulus_id = self.figure.figure_name + "_" + str(self.rng.integers(1, 20001))
+        metadata = self.get_metadata()
+        variant_lines = self.get_image_and_context_lines(validator, tagged=True)
+        if variant_lines is None:
+            if manifest is not None:
+                manifest.add(stimulus_id, metadata, self.rejection_reasons)
+            return False
+        self.close_window()
+        metadata["stimulus_id"] = stimulus_id
+        output = store.write_geometry(stimulus_id, variant_lines, metadata)
+        if manifest is not None:
+            manifest.add(stimulus_id, metadata, output=output)
+        return True
@@ -0,0 +1,150 @@
+import json
+
+from leftstim.basic_components.RandomFunctions import RandomFunctions
+from leftstim.build.LeftImage import LeftImage
+from leftstim.original_targets.FigureLineCollections import FigureLineCollections
+
+
+class Recipe:
+    """
+    Describes how to build an image, so that the same kind of image can be built for any seed (see
+    build()). All random choices are made using the image's own random number generator, meaning that
+    a recipe and a seed fully determine the resulting image. Recipes can be saved to/loaded from
+    JSON files.
+    """
+    parameter_names = ("window_width", "window_height", "frame_width", "frame_height", "line_width",
+                       "line_color", "background_color", "units", "figure_names", "align_probability",
+                       "shift_probability", "extend", "close_free_points", "min_extra_lines",
+                       "max_extra_lines", "grow_probability", "orientations", "color_schemes")
+    extend_options = ("two_thirds", "all", "none")
+
+    def __init__(self, window_width=500, window_height=500, frame_width=300, frame_height=300, line_width=1.8,
+                 line_color=(-1, -1, -1), background_color=(1, 1, 1), units="pix", figure_names=None,
+                 align_probability=0, shift_probability=0, extend="two_thirds", close_free_points=False,
+                 min_extra_lines=5, max_extra_lines=5, grow_probability=0.2,
+                 orientations=("horizontal", "vertical", "diagonal"), color_schemes=None):
+        """generate a Recipe instance. the window, frame and line parameters are passed on to LeftImage
+        :param figure_names: names of the figures to randomly choose from (all original targets if None)
+        :type figure_names: list of str
+        :param align_probability: probability of aligning the figure with the frame
+        :type align_probability: float
+        :param shift_probability: probability of shifting the figure to the frame
+        :type shift_probability: float
+        :param extend: which figure lines to extend, 'two_thirds', 'all' or 'none'
+        :type extend: str
+        :param close_free_points: whether to close up the figure's free points with new lines
+        :type close_free_points: bool
+        :param min_extra_lines: minimum number of extra lines to add
+        :type min_extra_lines: int
+        :param max_extra_lines: maximum number of extra lines to add
+        :type max_extra_lines: int
+        :param grow_probability: probability of each extra line being grown out of the figure, rather than
+        being a random line
+        :type grow_probability: float
+        :param orientations: orientations to randomly choose from for random lines
+        :type orientations: list of str
+        :param color_schemes: if passed, each image is rendered once, with the line and background colours,
+        and saved in each of these colour schemes (see Colorways) instead
+        :type color_schemes: dict of (background_color, line_color) pairs by scheme name"""
+        assert extend in Recipe.extend_options, "extend must be one of {}".format(", ".join(Recipe.extend_options))
+        assert 0 <= min_extra_lines <= max_extra_lines, "min_extra_lines may not be larger than max_extra_lines"
+        self.window_width = window_width
+        self.window_height = window_height
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.line_width = line_width
+        self.line_color = tuple(line_color)
+        self.background_color = tuple(background_color)
+        self.units = units
+        if figure_names is None:
+            figure_names = sorted(FigureLineCollections.all_line_collections)
+        self.figure_names = tuple(figure_names)
+        self.align_probability = align_probability
+        self.shift_probability = shift_probability
+        self.extend = extend
+        self.close_free_points = close_free_points
+        self.min_extra_lines = min_extra_lines
+        self.max_extra_lines = max_extra_lines
+        self.grow_probability = grow_probability
+        self.orientations = tuple(orientations)
+        # stored as lists, so that a recipe equals itself after being saved and loaded
+        self.color_schemes = None if color_schemes is None else \
+            {name: [list(background_color), list(line_color)]
+             for name, (background_color, line_color) in color_schemes.items()}
+
+    def __eq__(self, other):
+        return isinstance(other, Recipe) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return "Recipe({})".format(", ".join("{}={!r}".format(name, value) for name, value in self.to_dict().items()))
+
+    def to_dict(self):
+        """returns the recipe's parameters as a dict (of JSON-compatible values)
+        :return: dict"""
+        return {name: list(value) if isinstance(value, tuple) else value
+                for name, value in ((name, getattr(self, name)) for name in Recipe.parameter_names)}
+
+    @staticmethod
+    def from_dict(parameters):
+        """returns a recipe with the passed parameters (as returned by to_dict())
+        :type parameters: dict
+        :return: Recipe"""
+        return Recipe(**parameters)
+
+    def save(self, file_path):
+        """save the recipe to a JSON file
+        :type file_path: str
+        :return: None"""
+        with open(file_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @staticmethod
+    def load(file_path):
+        """load a recipe from a JSON file written by save()
+        :type file_path: str
+        :return: Recipe"""
+        with open(file_path) as f:
+            return Recipe.from_dict(json.load(f))
+
+    def copy(self, **changes):
+        """returns a copy of the recipe, with the passed parameters changed
+        :return: Recipe"""
+        parameters = self.to_dict()
+        parameters.update(changes)
+        return Recipe.from_dict(parameters)
+
+    def build(self, seed, encoder=None, window=None, metrics=None):
+        """build an image following the recipe. the same seed always gives the same image
+        :param seed: seed for the image's random number generator (see LeftImage)
+        :param encoder: encoder used for saving the image (see LeftImage)
+        :type encoder: ImageEncoder
+        :param window: existing window to draw the image in (see LeftImage)
+        :type window: psychopy.visual.Window
+        :param metrics: metrics to include in the image's metadata (see LeftImage)
+        :type metrics: ComplexityMetrics
+        :return: LeftImage"""
+        img = LeftImage(self.window_width, self.window_height, self.frame_width, self.frame_height,
+                        line_width=self.line_width, line_color=self.line_color,
+                        background_color=self.background_color, units=self.units, seed=seed, encoder=encoder,
+                        window=window, metrics=metrics)
+        rng = img.rng
+        img.add_figure_by_name(RandomFunctions.choice(rng, self.figure_names))
+        img.randomly_position_figure()
+        if rng.random() < self.align_probability:
+            img.align_figure_with_frame()
+        if rng.random() < self.shift_probability:
+            img.shift_figure_to_frame()
+        if self.extend == "two_thirds":
+            img.extend_two_thirds_figure_lines()
+        elif self.extend == "all":
+            img.extend_all_figure_lines()
+        if self.close_free_points:
+            img.close_figure_free_points()
+        num_extra_lines = int(rng.integers(self.min_extra_lines, self.max_extra_lines + 1))
+        for _ in range(num_extra_lines):
+            has_been_grown = False
+            if rng.random() < self.grow_probability:
+                has_been_grown = img.grow_figure_line()
+            if not has_been_grown:
+                img.add_random_line(RandomFunctions.choice(rng, self.orientations))
+        return img
@@ -0,0 +1,135 @@
+import csv
+import json
+import os
+
+import pandas as pd
+
+from leftstim.build.GenerationRun import GenerationRun
+from leftstim.storage.ShardWriter import ShardWriter
+
+
+class RunMerger:
+    """
+    Checks and combines the runs that together make up one sharded generation run (see
+    GenerationRun's shard_index and num_shards), e. g. after running them on separate machines and
+    copying their run directories to one place.
+    """
+    corpus_file_name = "corpus.json"
+
+    def __init__(self, run_dirs, shards_dir_name="shards", manifest_file_name="manifest.csv"):
+        """generate a RunMerger instance
+        :param run_dirs: directories of the runs to combine
+        :type run_dirs: list of str
+        :param shards_dir_name: name of the directory, within each run directory, that the run's
+        ShardWriter wrote to (runs without it are combined without shards)
+        :type shards_dir_name: str
+        :param manifest_file_name: name of the CSV manifest file within each run directory (runs without
+        it are combined without manifests)
+        :type manifest_file_name: str"""
+        self.runs = [GenerationRun(run_dir) for run_dir in run_dirs]
+        self.shards_dir_name = shards_dir_name
+        self.manifest_file_name = manifest_file_name
+
+    def validate(self):
+        """check that the runs belong together, that each shard is present once and complete, and that
+        every seed has been completed by exactly one run. returns a list of strings describing each
+        problem found (empty if there were none)
+        :return: list of str"""
+        if not self.runs:
+            return ["no runs to merge"]
+        problems = []
+        first_run = self.runs[0]
+        for run in self.runs[1:]:
+            if run.recipe != first_run.recipe:
+                problems.append("{} has a different recipe than {}".format(run.run_dir, first_run.run_dir))
+            if run.seeds != first_run.seeds or run.num_shards != first_run.num_shards:
+                problems.append("{} has different seeds/sharding than {}".format(run.run_dir, first_run.run_dir))
+        if problems:
+            return problems
+        shard_indices = [run.shard_index for run in self.runs]
+        for shard_index in range(first_run.num_shards):
+            count = shard_indices.count(shard_index)
+            if count != 1:
+                problems.append("shard {} of {} is present {} times".format(shard_index, first_run.num_shards, count))
+        completed_by = {}
+        for run in self.runs:
+            remaining_seeds = run.get_remaining_seeds()
+            if remaining_seeds:
+                problems.append("{} has {} seed(s) left, e. g. {}".format(run.run_dir, len(remaining_seeds),
+                                                                          remaining_seeds[0]))
+            for seed in run.completed:
+                if seed in completed_by:
+                    problems.append("seed {} was completed by both {} and {}".format(seed, completed_by[seed],
+                                                                                     run.run_dir))
+                completed_by[seed] = run.run_dir
+        num_missing = sum([seed not in completed_by for seed in first_run.seeds])
+        if num_missing:
+            problems.append("{} seed(s) have not been completed by any run".format(num_missing))
+        num_outside = len(set(completed_by) - set(first_run.seeds))
+        if num_outside:
+            problems.append("{} completed seed(s) lie outside of the seed range".format(num_outside))
+        return problems
+
+    def merge(self, output_dir, check=True):
+        """combine the runs into one corpus view in the passed directory: a combined shard index (so that
+        ShardReader(output_dir) reads the shards of all runs, which stay where they are), a combined
+        manifest and a 'corpus.json' file listing the runs
+        :param output_dir: directory to write to (created if it doesn't exist)
+        :type output_dir: str
+        :param check: if True, an AssertionError is raised if validate() finds problems
+        :type check: bool
+        :return: list of problems found by validate()"""
+        problems = self.validate()
+        assert not check or not problems, "the runs can't be merged: " + "; ".join(problems)
+        os.makedirs(output_dir, exist_ok=True)
+        runs = sorted(self.runs, key=lambda run: run.shard_index)
+        self.merge_shard_indexes(runs, output_dir)
+        self.merge_manifests(runs, output_dir)
+        with open(os.path.join(output_dir, RunMerger.corpus_file_name), "w") as f:
+            json.dump({"recipe": runs[0].recipe.to_dict(),
+                       "seed_start": runs[0].seeds.start, "seed_stop": runs[0].seeds.stop,
+                       "seed_step": runs[0].seeds.step, "num_shards": runs[0].num_shards,
+                       "run_dirs": [os.path.relpath(run.run_dir, output_dir) for run in runs],
+                       "num_saved": sum([sum(run.completed.values()) for run in runs]),
+                       "problems": problems}, f, indent=2)
+        return problems
+
+    def merge_shard_indexes(self, runs, output_dir):
+        """write a shard index combining the indexes of the passed runs, with shard paths relative to
+        output_dir. if a set was written more than once (e. g. when a run was resumed), the last
+        written copy is used
+        :return: None"""
+        shard_of_set = {}
+        for run in runs:
+            shards_dir = os.path.join(run.run_dir, self.shards_dir_name)
+            index_path = os.path.join(shards_dir, ShardWriter.index_file_name)
+            if not os.path.exists(index_path):
+                continue
+            with open(index_path, newline="") as f:
+                rows = csv.reader(f)
+                next(rows)
+                for stimulus_id, shard in rows:
+                    shard_of_set[stimulus_id] = os.path.relpath(os.path.join(shards_dir, shard), output_dir)
+        if not shard_of_set:
+            return
+        with open(os.path.join(output_dir, ShardWriter.index_file_name), "w", newline="") as f:
+            index = csv.writer(f)
+            index.writerow(["stimulus_id", "shard"])
+            index.writerows(shard_of_set.items())
+
+    def merge_manifests(self, runs, output_dir, chunk_size=10000):
+        """write a manifest combining the manifests of the passed runs, reading them in chunks. rows for
+        stimuli that were recorded more than once (e. g. when a run was resumed) are only included once
+        :return: None"""
+        merged_path = os.path.join(output_dir, self.manifest_file_name)
+        if os.path.exists(merged_path):
+            os.remove(merged_path)
+        seen_ids = set()
+        for run in runs:
+            manifest_path = os.path.join(run.run_dir, self.manifest_file_name)
+            if not os.path.exists(manifest_path):
+                continue
+            for chunk in pd.read_csv(manifest_path, chunksize=chunk_size):
+                chunk = chunk[~chunk["stimulus_id"].isin(seen_ids)].drop_duplicates("stimulus_id")
+                seen_ids.update(chunk["stimulus_id"])
+                chunk.to_csv(merged_path, mode="a", header=not os.path.exists(merged_path), index=False)
@@ -0,0 +1,176 @@
+import itertools
+import multiprocessing
+import queue
+import threading
+
+from leftstim.build.GenerationRun import GenerationRun
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class StimulusPool:
+    """
+    Builds upcoming stimuli in the background while the current one is shown, e. g. during an
+    experiment, so that taking the next stimulus never has to wait for one to be built. Stimuli are
+    built following a recipe, one per seed, in the order of the seeds, and are kept as lines (see
+    LeftImage.get_image_and_context_lines()), so no window is opened in the background. Each
+    stimulus is a dict with keys 'stimulus_id', 'seed', 'lines' (dict of lines by variant name) and
+    'metadata'.
+    """
+
+    def __init__(self, recipe, seeds=None, depth=10, validator=None, use_process=False):
+        """generate a StimulusPool instance. building starts when start() is called (or when the pool
+        is used as a context manager)
+        :param recipe: recipe to build the stimuli with
+        :type recipe: Recipe
+        :param seeds: seeds to build stimuli for, in order (0, 1, 2, ... if None)
+        :type seeds: iterable of int
+        :param depth: maximum number of stimuli built ahead of time
+        :type depth: int
+        :param validator: if passed, stimuli that fail validation are skipped
+        :type validator: StimulusValidator
+        :param use_process: if True, stimuli are built in a separate process instead of a thread, so that
+        building them doesn't compete with the main thread for the interpreter
+        :type use_process: bool"""
+        assert depth > 0, "depth must be at least 1"
+        self.recipe = recipe
+        self.seeds = itertools.count() if seeds is None else seeds
+        self.depth = depth
+        self.validator = validator
+        self.use_process = use_process
+        self.num_taken = 0
+        self.num_dry = 0
+        self.is_exhausted = False
+        # exception raised while building, after which the background worker has stopped
+        self.error = None
+        if use_process:
+            self.__stimuli = multiprocessing.Queue(maxsize=depth)
+            self.__stop_event = multiprocessing.Event()
+        else:
+            self.__stimuli = queue.Queue(maxsize=depth)
+            self.__stop_event = threading.Event()
+        self.__rejection_count = multiprocessing.Value("q", 0)
+        self.__worker = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def num_rejected(self):
+        """number of seeds that were skipped because their stimulus failed validation"""
+        return self.__rejection_count.value
+
+    def start(self):
+        """start building stimuli in the background
+        :return: None"""
+        assert self.__worker is None, "the pool has already been started"
+        worker_args = (self.recipe, self.seeds, self.validator, self.__stimuli, self.__stop_event,
+                       self.__rejection_count)
+        if self.use_process:
+            self.__worker = multiprocessing.Process(target=StimulusPool.fill_pool, args=worker_args, daemon=True)
+        else:
+            self.__worker = threading.Thread(target=StimulusPool.fill_pool, args=worker_args, daemon=True)
+        self.__worker.start()
+
+    def stop(self):
+        """stop building stimuli. stimuli that were built but not taken are discarded
+        :return: None"""
+        if self.__worker is None:
+            return
+        self.__stop_event.set()
+        self.__worker.join()
+        if self.use_process:
+            self.__stimuli.cancel_join_thread()
+
+    def get_num_ready(self):
+        """returns the number of stimuli that have been built and not yet taken (approximate when using
+        a process)
+        :return: int"""
+        return self.__stimuli.qsize()
+
+    def get(self, wait=True):
+        """take the next stimulus. if none is ready, the pool has run dry: this is counted (see num_dry)
+        and, if wait is True, the next stimulus is waited for, otherwise None is returned. raises
+        StopIteration once all seeds have been used. if building a stimulus raised an exception, it is
+        raised instead, on this call and all later ones (no more stimuli are built after it)
+        :type wait: bool
+        :return: dict or None"""
+        assert self.__worker is not None, "the pool must be started before stimuli can be taken"
+        if self.error is not None:
+            raise self.error
+        if self.is_exhausted:
+            raise StopIteration
+        try:
+            stimulus = self.__stimuli.get_nowait()
+        except queue.Empty:
+            self.num_dry += 1
+            Profiler.count("pool_dry")
+            if not wait:
+                return None
+            stimulus = self.__stimuli.get()
+        if isinstance(stimulus, StopIteration):
+            self.is_exhausted = True
+            raise stimulus
+        if isinstance(stimulus, Exception):
+            self.error = stimulus
+            raise stimulus
+        self.num_taken += 1
+        return stimulus
+
+    @staticmethod
+    def build_stimulus(recipe, seed, validator=None):
+        """build the image for the passed seed following the recipe and return the lines of its three
+        variants, without drawing anything. returns None if a validator is passed and a problem is found
+        :type recipe: Recipe
+        :type seed: int
+        :type validator: StimulusValidator
+        :return: dict or None"""
+        img = recipe.build(seed)
+        metadata = img.get_metadata()
+        variant_lines = img.get_image_and_context_lines(validator)
+        if variant_lines is None:
+            return None
+        stimulus_id = GenerationRun.get_stimulus_id(metadata["figure_name"], seed)
+        metadata["stimulus_id"] = stimulus_id
+        return {"stimulus_id": stimulus_id, "seed": seed, "lines": variant_lines, "metadata": metadata}
+
+    @staticmethod
+    def fill_pool(recipe, seeds, validator, stimuli, stop_event, rejection_count):
+        """build stimuli for the passed seeds, in order, and put them into the stimuli queue until the
+        stop event is set (runs in the pool's background thread/process). rejected seeds are skipped.
+        if an exception is raised, it is put into the queue, so that it is raised in the main thread
+        :return: None"""
+        try:
+            for seed in seeds:
+                stimulus = StimulusPool.build_stimulus(recipe, seed, validator)
+                if stimulus is None:
+                    with rejection_count.get_lock():
+                        rejection_count.value += 1
+                elif not StimulusPool.put_until_stopped(stimuli, stimulus, stop_event):
+                    return
+            StimulusPool.put_until_stopped(stimuli, StopIteration(), stop_event)
+        except Exception as e:
+            StimulusPool.put_until_stopped(stimuli, e, stop_event)
+
+    @staticmethod
+    def put_until_stopped(stimuli, item, stop_event):
+        """put the item into the stimuli queue, waiting for a free place unless the stop event is set.
+        returns False if the item wasn't put into the queue because the stop event was set
+        :return: bool"""
+        while not stop_event.is_set():
+            try:
+                stimuli.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except StopIteration:
+                return
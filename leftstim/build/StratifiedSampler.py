@@ -0,0 +1,172 @@
+import itertools
+
+import numpy as np
+
+from leftstim.analysis.ComplexityMetrics import ComplexityMetrics
+from leftstim.build.GenerationRun import GenerationRun
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class StratifiedSampler:
+    """
+    Generates a corpus with a requested number of stimuli for every combination of figure and
+    difficulty bin (e. g. 50 stimuli of each figure with 0-9, 10-19 and 20-39 intersections), while
+    throwing away as few stimuli as possible. Rather than generating stimuli at random and rejecting
+    those that fall into bins that are already full, the sampler keeps track of which bins the
+    stimuli built with each figure and recipe setting (number of extra lines, grow probability,
+    orientations) have fallen into, and for every attempt chooses the figure and setting that are most
+    likely to result in a stimulus for a bin that still needs many stimuli. Thompson sampling is used
+    for this, so that settings that haven't been tried much are tried as well. Every attempt uses the
+    next seed, so the corpus only depends on the sampler's parameters.
+    """
+
+    def __init__(self, recipe, bin_edges, count_per_stratum, metric="num_intersections", figure_names=None,
+                 grow_probabilities=None, orientation_mixes=None, metrics=None, seed=0):
+        """generate a StratifiedSampler instance
+        :param recipe: recipe the stimuli are built with. the number of extra lines is chosen between its
+        min_extra_lines and max_extra_lines
+        :type recipe: Recipe
+        :param bin_edges: edges of the difficulty bins, e. g. [0, 10, 20, 40] for the bins 0-9, 10-19
+        and 20-39 (a value equal to the last edge lies outside of the bins)
+        :type bin_edges: list of float
+        :param count_per_stratum: number of stimuli to generate for every combination of figure and bin
+        :type count_per_stratum: int
+        :param metric: name of the metric the bins refer to (see ComplexityMetrics)
+        :type metric: str
+        :param figure_names: figures to generate stimuli for (the recipe's figures if None)
+        :type figure_names: list of str
+        :param grow_probabilities: grow probabilities to choose from (only the recipe's if None)
+        :type grow_probabilities: list of float
+        :param orientation_mixes: orientations for random lines to choose from (only the recipe's if None)
+        :type orientation_mixes: list of lists of str
+        :param metrics: metrics instance used for computing the metric (one with default settings if None)
+        :type metrics: ComplexityMetrics
+        :param seed: first seed to use. the following attempts use the following seeds
+        :type seed: int"""
+        assert metric in ComplexityMetrics.metric_names, \
+            "metric must be one of {}".format(", ".join(ComplexityMetrics.metric_names))
+        assert len(bin_edges) >= 2, "at least two bin edges are required"
+        self.recipe = recipe
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        self.count_per_stratum = count_per_stratum
+        self.metric = metric
+        self.figure_names = tuple(figure_names if figure_names is not None else recipe.figure_names)
+        self.metrics = metrics if metrics is not None else ComplexityMetrics()
+        self.settings = [{"min_extra_lines": num_lines, "max_extra_lines": num_lines,
+                          "grow_probability": grow_probability, "orientations": list(orientations)}
+                         for num_lines, grow_probability, orientations in itertools.product(
+                             range(recipe.min_extra_lines, recipe.max_extra_lines + 1),
+                             grow_probabilities if grow_probabilities is not None else [recipe.grow_probability],
+                             orientation_mixes if orientation_mixes is not None else [recipe.orientations])]
+        self.next_seed = seed
+        self.rng = np.random.default_rng(seed)
+        num_bins = len(self.bin_edges) - 1
+        self.fill = {figure_name: np.zeros(num_bins, dtype=int) for figure_name in self.figure_names}
+        # for each figure and setting, the number of attempts that ended up in each bin (the last column
+        # counts those outside of the bins)
+        self.hits = {figure_name: np.zeros((len(self.settings), num_bins + 1)) for figure_name in self.figure_names}
+        self.num_attempts = 0
+        self.num_accepted = 0
+        self.num_full = 0
+        self.num_outside_bins = 0
+        self.num_invalid = 0
+
+    @property
+    def acceptance_rate(self):
+        """fraction of the attempts so far that resulted in a stimulus being accepted"""
+        return self.num_accepted / self.num_attempts if self.num_attempts else None
+
+    def is_complete(self):
+        """returns True if every stratum holds the requested number of stimuli
+        :return: bool"""
+        return all((fill >= self.count_per_stratum).all() for fill in self.fill.values())
+
+    def get_bin(self, value):
+        """returns the index of the bin the passed metric value lies in, or None if it lies outside of the bins
+        :return: int or None"""
+        bin_index = int(np.searchsorted(self.bin_edges, value, side="right")) - 1
+        return bin_index if 0 <= bin_index < len(self.bin_edges) - 1 else None
+
+    def choose_figure_and_setting(self):
+        """returns the figure name and the index of the setting to use for the next attempt. for every
+        figure and setting, probabilities of the stimulus falling into each bin are drawn from the
+        Dirichlet distribution given by the attempts so far, and the figure and setting with the highest
+        probability of a stimulus for a bin that isn't full (weighted by how many stimuli the bin still
+        needs) are chosen. the attempts with the other figures are included with half the weight, as
+        the settings affect the metrics of different figures similarly
+        :return: (str, int)"""
+        total_hits = sum(self.hits.values())
+        best_score, best_choice = -1, None
+        for figure_name in self.figure_names:
+            needed = np.maximum(self.count_per_stratum - self.fill[figure_name], 0) / self.count_per_stratum
+            if not needed.any():
+                continue
+            hits = self.hits[figure_name] + 0.5 * (total_hits - self.hits[figure_name])
+            probabilities = self.rng.gamma(hits + 1)
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            scores = probabilities[:, :-1] @ needed
+            if scores.max() > best_score:
+                best_score, best_choice = scores.max(), (figure_name, int(np.argmax(scores)))
+        return best_choice
+
+    def attempt(self):
+        """build one stimulus, with the figure and setting chosen by choose_figure_and_setting(), and record
+        which bin it fell into.
+        returns the image and a dict describing it ('seed', 'figure_name', 'bin', 'value', 'setting_index'
+        and 'setting'), with 'bin' being None if the stimulus isn't needed (its bin lies outside of the bins
+        or is full)
+        :return: (LeftImage, dict)"""
+        figure_name, setting_index = self.choose_figure_and_setting()
+        setting = self.settings[setting_index]
+        seed = self.next_seed
+        self.next_seed += 1
+        self.num_attempts += 1
+        img = self.recipe.copy(figure_names=[figure_name], **setting).build(seed)
+        value = self.metrics.compute(img)[self.metric]
+        bin_index = self.get_bin(value)
+        self.hits[figure_name][setting_index, -1 if bin_index is None else bin_index] += 1
+        if bin_index is None:
+            self.num_outside_bins += 1
+            Profiler.count("stratified_outside_bins")
+        elif self.fill[figure_name][bin_index] >= self.count_per_stratum:
+            self.num_full += 1
+            Profiler.count("stratified_full")
+            bin_index = None
+        return img, {"seed": seed, "figure_name": figure_name, "bin": bin_index, "value": value,
+                     "setting_index": setting_index, "setting": setting}
+
+    def run(self, sink, validator=None, manifest=None, max_attempts=None):
+        """generate stimuli until every stratum holds the requested number of them, writing them to the
+        passed sink (see LeftImage.save_to_sink()). the metrics are included in each stimulus' metadata
+        :param sink: sink to write the stimuli to (e. g. a ShardWriter)
+        :param validator: if passed, stimuli that fail validation are not used
+        :type validator: StimulusValidator
+        :param manifest: if passed, a row is added for each stimulus that is saved or fails validation
+        :type manifest: ManifestWriter
+        :param max_attempts: maximum number of attempts (no limit if None, which means that run() doesn't
+        return if one of the strata can't be filled with the recipe's settings)
+        :type max_attempts: int
+        :return: True if every stratum has been filled, otherwise False"""
+        while not self.is_complete() and (max_attempts is None or self.num_attempts < max_attempts):
+            img, stimulus = self.attempt()
+            if stimulus["bin"] is None:
+                img.close_window()
+                continue
+            img.metrics = self.metrics
+            stimulus_id = GenerationRun.get_stimulus_id(stimulus["figure_name"], stimulus["seed"])
+            saved = img.save_to_sink(sink, stimulus_id=stimulus_id, validator=validator, manifest=manifest)
+            if saved:
+                self.fill[stimulus["figure_name"]][stimulus["bin"]] += 1
+                self.num_accepted += 1
+            else:
+                self.num_invalid += 1
+        return self.is_complete()
+
+    def get_report(self):
+        """returns the number of attempts, how many of them were accepted, the acceptance rate, why the
+        others weren't, and the number of stimuli in each stratum (by figure name, one count per bin)
+        :return: dict"""
+        return {"num_attempts": self.num_attempts, "num_accepted": self.num_accepted,
+                "acceptance_rate": self.acceptance_rate, "num_full": self.num_full,
+                "num_outside_bins": self.num_outside_bins, "num_invalid": self.num_invalid,
+                "fill": {figure_name: fill.tolist() for figure_name, fill in self.fill.items()}}
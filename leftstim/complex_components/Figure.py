@@ -1,32 +1,94 @@
-import random
+import numpy as np
 
 from leftstim.basic_components.FigureLine import FigureLine
+from leftstim.basic_components.Point import Point
+from leftstim.basic_components.RandomFunctions import RandomFunctions
+from leftstim.original_targets.TargetTemplate import TargetTemplate
 
 class Figure:
     locked_x = False
     locked_y = False
-    all_points = []
     figure_name = "unnamed"
 
-    def __init__(self, lines, frame):
-        """ generate a Figure instance, defined by the passed list of lines
+    def __init__(self, lines, frame, rng=None):
+        """ generate a Figure instance, defined by the passed list of lines. the lines' points are
+        not used by the figure itself (the figure has its own points), so they may be shared
+        between lines and figures
         :param lines: lines of which the figure consists
         :type lines: list of Line instances
         :param frame: frame that the figure is to be inside of
         :type frame: Frame
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
         """
-        self.lines = [FigureLine(line.start_point, line.end_point) for line in lines]
-
-        points_with_duplicates = [point for line in lines for point in [line.start_point, line.end_point]]
-        self.unique_points = set(points_with_duplicates)
-        for point in points_with_duplicates:
-            if not sum([point is x for x in self.all_points]):
-                self.all_points.append(point)
-
-        self.closed = lines[0].start_point == lines[len(lines) - 1].end_point
-        self.height = self.get_highest_y_coord() - self.get_lowest_y_coord()
-        self.width = self.get_highest_x_coord() - self.get_lowest_x_coord()
+        self.set_template(TargetTemplate(lines), frame, rng)
+
+    @classmethod
+    def from_template(cls, template, frame, rng=None):
+        """ generate a Figure instance from a precomputed template. this doesn't depend on the
+        number of lines in the figure, as the figure's points are only created when first needed
+        :param template: template describing the figure's shape
+        :type template: TargetTemplate
+        :param frame: frame that the figure is to be inside of
+        :type frame: Frame
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
+        :return: Figure
+        """
+        figure = cls.__new__(cls)
+        figure.set_template(template, frame, rng)
+        return figure
+
+    def set_template(self, template, frame, rng=None):
+        """ (re)initialize the figure so that it has the shape described by the passed template,
+        without any offset
+        :type template: TargetTemplate
+        :type frame: Frame
+        :type rng: numpy.random.Generator
+        :return: None
+        """
+        self.rng = RandomFunctions.get_rng(rng)
+        self.template = template
+        self.offset_x = 0
+        self.offset_y = 0
+        self.closed = template.closed
+        self.height = template.height
+        self.width = template.width
         self.frame = frame
+        self.__lines = None
+        self.__points_offset = None
+
+    @property
+    def lines(self):
+        """ the figure's lines, created from the template when first needed. the figure's offset is
+        applied to their points lazily, i. e. only when the lines are accessed after the figure
+        has been moved
+        :return: list of FigureLine instances
+        """
+        if self.__lines is None:
+            self.__lines = [FigureLine(Point(0, 0), Point(0, 0)) for _ in self.template.coords]
+        if self.__points_offset != (self.offset_x, self.offset_y):
+            for line, (start_x, start_y, end_x, end_y) in zip(self.__lines, self.template.coords):
+                line.start_point.x = start_x + self.offset_x
+                line.start_point.y = start_y + self.offset_y
+                line.end_point.x = end_x + self.offset_x
+                line.end_point.y = end_y + self.offset_y
+            self.__points_offset = (self.offset_x, self.offset_y)
+        return self.__lines
+
+    @property
+    def all_points(self):
+        """ all of the figure's points, i. e. the start/end points of each of its lines in order
+        :return: list of Point instances
+        """
+        return [point for line in self.lines for point in (line.start_point, line.end_point)]
+
+    @property
+    def unique_points(self):
+        """ the figure's points, with points that have the same coordinates only included once
+        :return: set of Point instances
+        """
+        return set(self.all_points)
 
     def draw(self, window, line_object):
         """draws the figure in a specified window using a specified line object
@@ -44,8 +106,8 @@ class Figure:
 
         :return: Point
         """
-        rand_line = random.choice(self.lines)
-        return rand_line.get_random_point()
+        rand_line = RandomFunctions.choice(self.rng, self.lines)
+        return rand_line.get_random_point(self.rng)
 
     def shift(self, x_shift, y_shift):
         """ shift all the figure's lines by the specified x/y shifts
@@ -55,20 +117,31 @@ class Figure:
         :type y_shift: float
         :return: None
         """
-        for point in self.all_points:
-            point.shift(x_shift, y_shift)
+        self.set_offset(self.offset_x + x_shift, self.offset_y + y_shift)
+
+    def set_offset(self, offset_x, offset_y):
+        """ place the figure so that its template's coordinates are translated by the specified x/y
+        offsets. the figure's points are updated the next time they are needed
+        :param offset_x: number of units to translate x-coordinates by
+        :type offset_x: float
+        :param offset_y: number of units to translate y-coordinates by
+        :type offset_y: float
+        :return: None
+        """
+        self.offset_x = offset_x
+        self.offset_y = offset_y
 
     def get_lowest_x_coord(self):
-        return min([point.x for point in self.unique_points])
+        return self.template.min_x + self.offset_x
 
     def get_highest_x_coord(self):
-        return max([point.x for point in self.unique_points])
+        return self.template.max_x + self.offset_x
 
     def get_lowest_y_coord(self):
-        return min([point.y for point in self.unique_points])
+        return self.template.min_y + self.offset_y
 
     def get_highest_y_coord(self):
-        return max([point.y for point in self.unique_points])
+        return self.template.max_y + self.offset_y
 
     def has_top_line(self):
         """ checks to see if there is a horizontal line at the top of the figure,
@@ -122,8 +195,7 @@ class Figure:
         """
         top_lines = self.has_top_line()
         if not self.locked_y and top_lines:
-            y_shift = self.frame.top_line.start_point.y - self.get_highest_y_coord()
-            self.shift(x_shift=0, y_shift=y_shift)
+            self.set_offset(self.offset_x, self.frame.top_line.start_point.y - self.template.max_y)
             self.locked_y = True
             for line in top_lines:
                 line.extended = True
@@ -138,8 +210,7 @@ class Figure:
         """
         right_lines = self.has_rightmost_line()
         if not self.locked_x and right_lines:
-            x_shift = self.frame.right_line.start_point.x - self.get_highest_x_coord()
-            self.shift(x_shift=x_shift, y_shift=0)
+            self.set_offset(self.frame.right_line.start_point.x - self.template.max_x, self.offset_y)
             self.locked_x = True
             for line in right_lines:
                 line.extended = True
@@ -154,8 +225,7 @@ class Figure:
         """
         bottom_lines = self.has_bottom_line()
         if not self.locked_y and bottom_lines:
-            y_shift = self.frame.bottom_line.start_point.y - self.get_lowest_y_coord()
-            self.shift(x_shift=0, y_shift=y_shift)
+            self.set_offset(self.offset_x, self.frame.bottom_line.start_point.y - self.template.min_y)
             self.locked_y = True
             for line in bottom_lines:
                 line.extended = True
@@ -170,8 +240,7 @@ class Figure:
         """
         left_lines = self.has_leftmost_line()
         if not self.locked_x and left_lines:
-            x_shift = self.frame.left_line.start_point.x - self.get_lowest_x_coord()
-            self.shift(x_shift=x_shift, y_shift=0)
+            self.set_offset(self.frame.left_line.start_point.x - self.template.min_x, self.offset_y)
             self.locked_x = True
             for line in left_lines:
                 line.extended = True
@@ -187,8 +256,7 @@ class Figure:
         """
         align_functions = [self.align_with_frame_top, self.align_with_frame_right,
                            self.align_with_frame_bottom, self.align_with_frame_left]
-        random.shuffle(align_functions)
-        for align_fn in align_functions:
+        for align_fn in RandomFunctions.shuffled(self.rng, align_functions):
             if align_fn():
                 return True
         return False
@@ -240,7 +308,7 @@ class Figure:
         """
         top_point = self.get_top_point()
         if top_point and not self.locked_y:
-            self.shift(x_shift=0, y_shift=self.frame.top_line.start_point.y - self.get_highest_y_coord())
+            self.set_offset(self.offset_x, self.frame.top_line.start_point.y - self.template.max_y)
             return True
         return False
 
@@ -251,7 +319,7 @@ class Figure:
         """
         right_point = self.get_rightmost_point()
         if right_point and not self.locked_x:
-            self.shift(x_shift=self.frame.right_line.start_point.x - self.get_highest_x_coord(), y_shift=0)
+            self.set_offset(self.frame.right_line.start_point.x - self.template.max_x, self.offset_y)
             return True
         return False
 
@@ -262,7 +330,7 @@ class Figure:
         """
         bottom_point = self.get_bottom_point()
         if bottom_point and not self.locked_y:
-            self.shift(x_shift=0, y_shift=self.frame.bottom_line.start_point.y - self.get_lowest_y_coord())
+            self.set_offset(self.offset_x, self.frame.bottom_line.start_point.y - self.template.min_y)
             return True
         return False
 
@@ -273,7 +341,7 @@ class Figure:
         """
         left_point = self.get_leftmost_point()
         if left_point and not self.locked_x:
-            self.shift(x_shift=self.frame.left_line.start_point.x - self.get_lowest_x_coord(), y_shift=0)
+            self.set_offset(self.frame.left_line.start_point.x - self.template.min_x, self.offset_y)
             return True
         return False
 
@@ -285,8 +353,7 @@ class Figure:
         """
         shift_functions = [self.shift_to_frame_top, self.shift_to_frame_right,
                            self.shift_to_frame_bottom, self.shift_to_frame_left]
-        random.shuffle(shift_functions)
-        for shift_fn in shift_functions:
+        for shift_fn in RandomFunctions.shuffled(self.rng, shift_functions):
             result = shift_fn()
             if result:
                 return True
@@ -296,8 +363,7 @@ class Figure:
         """extend a random figure line so that it runs all the way to the passed frame's sides
         and return True, unless all lines are already extended (in that case return False)
         :return: bool"""
-        shuffled_lines = random.sample(self.lines, k=len(self.lines))
-        for line in shuffled_lines:
+        for line in RandomFunctions.shuffled(self.rng, self.lines):
             if line.extend(self.frame):
                 return True
         return False
@@ -313,8 +379,8 @@ class Figure:
         min_shift_x = self.frame.left_line.start_point.x - self.get_lowest_x_coord() + 15
         max_shift_y = self.frame.top_line.start_point.y - self.get_highest_y_coord() - 15
         min_shift_y = self.frame.bottom_line.start_point.y - self.get_lowest_y_coord() + 15
-        x_shift = random.uniform(min_shift_x, max_shift_x)
-        y_shift = random.uniform(min_shift_y, max_shift_y)
+        x_shift, y_shift = RandomFunctions.uniform(self.rng, np.array((min_shift_x, min_shift_y)),
+                                                   np.array((max_shift_x, max_shift_y)), size=2).tolist()
         self.shift(x_shift=x_shift, y_shift=y_shift)
         return True
 
@@ -325,8 +391,7 @@ class Figure:
         :param orientation: "horizontal", "vertical" or "diagonal"
         :type orientation: string
         :return: AttachedLine or bool"""
-        randomly_ordered_points = random.sample(self.unique_points, len(self.unique_points))
-        for point in randomly_ordered_points:
+        for point in RandomFunctions.shuffled(self.rng, sorted(self.unique_points, key=lambda p: (p.x, p.y))):
             line_or_false = point.grow_line(frame=self.frame, orientation=orientation)
             if line_or_false:
                 return line_or_false
@@ -337,27 +402,21 @@ class Figure:
         are more than 3 units away from all other figure points
         :return: list of Point objects"""
         free_points = []
-        for point_index in range(len(self.all_points)):
-            curr_point = self.all_points[point_index]
+        lines = self.lines
+        for point_index, curr_point in enumerate(self.all_points):
             if curr_point.grown:
                 continue
             if curr_point.x in [self.frame.left_line.start_point.x, self.frame.right_line.start_point.x]:
                 continue
             if curr_point.y in [self.frame.top_line.start_point.y, self.frame.bottom_line.start_point.y]:
                 continue
-            set_without_curr_point = set([point for i, point in enumerate(self.all_points) if i != point_index])
-            if curr_point in set_without_curr_point:
+            # the template knows which points lie within 3 units of each other, including identical points
+            if self.template.neighbours[point_index]:
                 continue
-            related_line = [line for line in self.lines if curr_point in [line.start_point, line.end_point]][0]
+            related_line = lines[point_index // 2]
             if related_line.extended:
                 continue
-            has_nearby_point = False
-            for compare_point in set_without_curr_point:
-                if curr_point.dist(compare_point) < 3:
-                    has_nearby_point = True
-                    break
-            if not has_nearby_point:
-                free_points.append(curr_point)
+            free_points.append(curr_point)
         return free_points
 
     def close_up_free_points(self):
@@ -366,7 +425,7 @@ class Figure:
         free_points = self.find_free_points()
         grown_lines = []
         for point in free_points:
-            orientation = random.choice(["horizontal", "vertical", "diagonal", "diagonal"])
+            orientation = RandomFunctions.choice(self.rng, ["horizontal", "vertical", "diagonal", "diagonal"])
             grown_lines.append(point.grow_line(frame=self.frame, orientation=orientation))
         self.closed = True
         return grown_lines
@@ -1,17 +1,22 @@
-import random
+import numpy as np
 
 from leftstim.basic_components.AttachedLine import AttachedLine
 from leftstim.basic_components.Line import Line
 from leftstim.basic_components.Point import Point
+from leftstim.basic_components.RandomFunctions import RandomFunctions
+from leftstim.instrumentation.Profiler import Profiler
 
 class Frame:
-    def __init__(self, top_line, right_line):
+    def __init__(self, top_line, right_line, rng=None):
         """generate a Frame instance that represents a rectangular frame in 2D space
         :param top_line: line representing top of frame
         :type top_line: Line
         :param right_line: line representing right border of frame
         :type right_line: Line
+        :param rng: random number generator to use (the shared default generator if None)
+        :type rng: numpy.random.Generator
         """
+        self.rng = RandomFunctions.get_rng(rng)
         self.width = abs(top_line.end_point.x - top_line.start_point.x)
         self.height = abs(right_line.end_point.y - right_line.start_point.y)
         self.top_line = top_line
@@ -40,24 +45,26 @@ class Frame:
         :return: AttachedLine
         """
         if orientation == "vertical":
-            start_point = self.top_line.get_random_point()
+            start_point = self.top_line.get_random_point(self.rng)
             end_point = start_point - Point(x=0, y=self.height)
             start_line = self.top_line
             end_line = self.bottom_line
         elif orientation == "horizontal":
-            start_point = self.right_line.get_random_point()
+            start_point = self.right_line.get_random_point(self.rng)
             end_point = start_point - Point(x=self.width, y=0)
             start_line = self.right_line
             end_line = self.left_line
         else:
-            start_line = random.choice(self.lines)
-            end_line = random.choice([line for line in self.lines if line is not start_line])
-            return start_line.fling_to_line(end_line)
+            start_line = RandomFunctions.choice(self.rng, self.lines)
+            end_line = RandomFunctions.choice(self.rng, [line for line in self.lines if line is not start_line])
+            return start_line.fling_to_line(end_line, rng=self.rng)
         return AttachedLine(start_point=start_point, end_point=end_point,
                             start_line=start_line, end_line=end_line)
 
     def fling_side_to_line(self, start_line, orientation):
-        """ generate an AttachedLine instance that stretches from specified line to one of this frame's sides
+        """ generate an AttachedLine instance that stretches from specified line to one of this frame's sides,
+        with a length of a minimum of 50 units (throws an error if this is not attainable). 100 candidate
+        lines are drawn at once, and the first one that is long enough is used
         :param start_line: specified start line
         :type start_line: Line
         :param orientation: specification of the generated line's orientation. one of "horizontal" / "vertical" /
@@ -65,27 +72,37 @@ class Frame:
         :type orientation: str
         :return: AttachedLine
         """
-        distant_enough = False
-        counter = 100
-        while not distant_enough:
-            if counter <= 0:
-                raise AttributeError("tried to fling to a line that is too close")
-            start_point = start_line.get_random_point()
+        num_candidates = 100
+        start_coords = start_line.get_random_coords(num_candidates, self.rng)
+        if orientation == "vertical":
+            end_line_options = [self.top_line, self.bottom_line]
+        elif orientation == "horizontal":
+            end_line_options = [self.right_line, self.left_line]
+        else:
+            end_line_options = self.lines
+        end_line_indices = self.rng.integers(len(end_line_options), size=num_candidates)
+        end_coords = np.empty((num_candidates, 2))
+        for i, end_line in enumerate(end_line_options):
+            chosen = end_line_indices == i
             if orientation == "vertical":
-                end_line = random.choice((self.top_line, self.bottom_line))
-                end_point = Point(end_line.start_point.x, start_point.y)
+                end_coords[chosen] = (end_line.start_point.x, 0)
+                end_coords[chosen, 1] = start_coords[chosen, 1]
             elif orientation == "horizontal":
-                end_line = random.choice((self.right_line, self.left_line))
-                end_point = Point(start_point.x, end_line.start_point.y)
+                end_coords[chosen] = (0, end_line.start_point.y)
+                end_coords[chosen, 0] = start_coords[chosen, 0]
             else:
-                end_line = random.choice(self.lines)
-                end_point = end_line.get_random_point()
-            if start_point.dist(end_point) > 50:
-                distant_enough = True
-            counter -= 1
-        return AttachedLine(start_point=start_point, end_point=end_point,
-                            start_line=start_line, end_line=end_line)
+                end_coords[chosen] = end_line.get_random_coords(int(chosen.sum()), self.rng)
+        distant_enough = np.hypot(*(end_coords - start_coords).T) > 50
+        if not distant_enough.any():
+            Profiler.count("fling_side_to_line_attempts", num_candidates)
+            Profiler.count("fling_side_to_line_failures")
+            raise AttributeError("tried to fling to a line that is too close")
+        index = int(np.argmax(distant_enough))
+        Profiler.count("fling_side_to_line_attempts", index + 1)
+        return AttachedLine(start_point=Point(*start_coords[index].tolist()),
+                            end_point=Point(*end_coords[index].tolist()),
+                            start_line=start_line, end_line=end_line_options[end_line_indices[index]])
 
     def get_random_point(self):
-        rand_line = random.choice(self.lines)
-        return rand_line.get_random_point()
+        rand_line = RandomFunctions.choice(self.rng, self.lines)
+        return rand_line.get_random_point(self.rng)
@@ -0,0 +1,175 @@
+from contextlib import contextmanager, nullcontext
+import threading
+import time
+import tracemalloc
+
+_NULL_STAGE = nullcontext()
+
+
+class Profiler:
+    """
+    Collects per-stage timings, event counters (retries, fallbacks) and, optionally,
+    allocation statistics during stimulus generation. Instrumentation is disabled unless a
+    Profiler instance has been enabled, in which case the hooks spread throughout the package
+    report to it (Profiler.active). One enabled instance aggregates over any number of images, and
+    may be reported to from several threads at once (e. g. a StimulusPool's worker thread and the
+    main thread), as its records are updated under a lock.
+    """
+    active = None
+
+    def __init__(self, callback=None, track_allocations=False):
+        """generate a Profiler instance
+        :param callback: optional function that is called for every recorded event, with
+        arguments (kind, name, value), where kind is "stage" (value: seconds) or "count"
+        (value: amount added)
+        :type callback: function
+        :param track_allocations: whether to record the net number of bytes allocated during each
+        stage (using tracemalloc, which slows down execution noticeably)
+        :type track_allocations: bool"""
+        self.callback = callback
+        self.track_allocations = track_allocations
+        self.timings = {}
+        self.counters = {}
+        self.allocations = {}
+        self.peak_allocation = 0
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        # the lock can't be pickled, e. g. when returning a profiler from a worker process
+        state = self.__dict__.copy()
+        del state["_Profiler__lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    def enable(self):
+        """make this the active profiler, so that instrumentation hooks report to it
+        :return: None"""
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        Profiler.active = self
+
+    def disable(self):
+        """stop reporting to this profiler, if it is the active one
+        :return: None"""
+        if Profiler.active is self:
+            Profiler.active = None
+        if self.track_allocations and tracemalloc.is_tracing():
+            self.peak_allocation = max(self.peak_allocation, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    @staticmethod
+    def stage(name):
+        """returns a context manager that times the enclosed block as the named stage, if a profiler
+        is active (otherwise returns a shared no-op context manager)
+        :param name: name of the stage
+        :type name: str"""
+        profiler = Profiler.active
+        if profiler is None:
+            return _NULL_STAGE
+        return profiler.time_stage(name)
+
+    @staticmethod
+    def count(name, amount=1):
+        """add amount to the named counter of the active profiler, if there is one
+        :param name: name of the counter
+        :type name: str
+        :param amount: number to add
+        :type amount: int
+        :return: None"""
+        profiler = Profiler.active
+        if profiler is not None:
+            profiler.add_count(name, amount)
+
+    @contextmanager
+    def time_stage(self, name):
+        """context manager that times the enclosed block as the named stage
+        :param name: name of the stage
+        :type name: str"""
+        tracing = self.track_allocations and tracemalloc.is_tracing()
+        start_memory = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            allocated = tracemalloc.get_traced_memory()[0] - start_memory if tracing else None
+            self.add_timing(name, seconds, allocated)
+
+    def add_timing(self, name, seconds, allocated=None):
+        """record one execution of the named stage
+        :param name: name of the stage
+        :type name: str
+        :param seconds: duration of the execution
+        :type seconds: float
+        :param allocated: net number of bytes allocated during the execution, if tracked
+        :type allocated: int
+        :return: None"""
+        with self.__lock:
+            timing = self.timings.setdefault(name, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            timing["calls"] += 1
+            timing["total_seconds"] += seconds
+            timing["max_seconds"] = max(timing["max_seconds"], seconds)
+            if allocated is not None:
+                self.allocations[name] = self.allocations.get(name, 0) + allocated
+        if self.callback is not None:
+            self.callback("stage", name, seconds)
+
+    def add_count(self, name, amount=1):
+        """add amount to the named counter
+        :param name: name of the counter
+        :type name: str
+        :param amount: number to add
+        :type amount: int
+        :return: None"""
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        if self.callback is not None:
+            self.callback("count", name, amount)
+
+    def merge(self, other):
+        """add the passed other profiler's (e. g. from a worker process) timings, counters and
+        allocation statistics to this profiler's
+        :type other: Profiler
+        :return: None"""
+        with self.__lock:
+            for name, other_timing in other.timings.items():
+                timing = self.timings.setdefault(name, {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                timing["calls"] += other_timing["calls"]
+                timing["total_seconds"] += other_timing["total_seconds"]
+                timing["max_seconds"] = max(timing["max_seconds"], other_timing["max_seconds"])
+            for name, amount in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            for name, allocated in other.allocations.items():
+                self.allocations[name] = self.allocations.get(name, 0) + allocated
+            self.peak_allocation = max(self.peak_allocation, other.peak_allocation)
+
+    def reset(self):
+        """discard everything recorded so far
+        :return: None"""
+        with self.__lock:
+            self.timings = {}
+            self.counters = {}
+            self.allocations = {}
+            self.peak_allocation = 0
+
+    def summary(self):
+        """returns everything recorded so far as a dictionary (suitable for e. g. json.dump)
+        :return: dict"""
+        stages = {}
+        with self.__lock:
+            for name, timing in self.timings.items():
+                stages[name] = dict(timing, mean_seconds=timing["total_seconds"] / timing["calls"])
+                if name in self.allocations:
+                    stages[name]["allocated_bytes"] = self.allocations[name]
+            counters = dict(self.counters)
+        return {"stages": stages, "counters": counters, "peak_allocated_bytes": self.peak_allocation}
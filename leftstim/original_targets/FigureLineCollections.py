@@ -1,5 +1,4 @@
-import random
-
+from leftstim.basic_components.RandomFunctions import RandomFunctions
 from leftstim.original_targets.ConversionFunctions import ConversionFunctions
 
 """
@@ -46,6 +45,7 @@ class FigureLineCollections:
                             'D4': __d4}
 
     @staticmethod
-    def grab_random_collection():
-        random_key = random.choice(list(FigureLineCollections.all_line_collections.keys()))
+    def grab_random_collection(rng=None):
+        rng = RandomFunctions.get_rng(rng)
+        random_key = RandomFunctions.choice(rng, list(FigureLineCollections.all_line_collections.keys()))
         return random_key, FigureLineCollections.all_line_collections[random_key]
@@ -0,0 +1,53 @@
+class TargetTemplate:
+    """
+    Immutable, precomputed description of a figure's shape: its line coordinates, bounding box,
+    closedness and which line endpoints lie close to each other. Templates are shared between
+    all figures of the same kind - figures only add a translation to them - so they must never
+    be modified. Templates for the original L-EFT targets are cached (see get_by_name()).
+    """
+    __cache = {}
+
+    def __init__(self, lines, name="unnamed"):
+        """generate a TargetTemplate instance from the passed lines
+        :param lines: lines of which the figure consists
+        :type lines: list of Line instances
+        :param name: name of the figure
+        :type name: str"""
+        self.name = name
+        self.coords = tuple((line.start_point.x, line.start_point.y, line.end_point.x, line.end_point.y)
+                            for line in lines)
+        # endpoint k is the start (even k) or end (odd k) point of line k // 2
+        self.point_coords = tuple(coord for line_coords in self.coords
+                                  for coord in (line_coords[:2], line_coords[2:]))
+        xs = [x for x, _ in self.point_coords]
+        ys = [y for _, y in self.point_coords]
+        self.min_x, self.max_x = min(xs), max(xs)
+        self.min_y, self.max_y = min(ys), max(ys)
+        self.width = self.max_x - self.min_x
+        self.height = self.max_y - self.min_y
+        self.closed = self.point_coords[0] == self.point_coords[-1]
+        self.neighbours = tuple(
+            tuple(j for j, (other_x, other_y) in enumerate(self.point_coords)
+                  if j != k and ((x - other_x) ** 2 + (y - other_y) ** 2) ** (1 / 2) < 3)
+            for k, (x, y) in enumerate(self.point_coords))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __len__(self):
+        return len(self.coords)
+
+    @staticmethod
+    def get_by_name(name):
+        """returns the (cached) template of the original L-EFT target with the passed name
+        :param name: target name, in the format <[A-D][1-4]>
+        :type name: str
+        :return: TargetTemplate"""
+        from leftstim.original_targets.FigureLineCollections import FigureLineCollections
+
+        if name not in TargetTemplate.__cache:
+            TargetTemplate.__cache[name] = TargetTemplate(FigureLineCollections.all_line_collections[name], name)
+        return TargetTemplate.__cache[name]
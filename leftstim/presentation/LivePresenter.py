@@ -0,0 +1,143 @@
+import time
+
+from psychopy import visual
+
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class LivePresenter:
+    """
+    Presents stimuli in an experiment's own PsychoPy window, e. g. lines taken from a StimulusPool or
+    returned by LeftImage.get_drawn_lines(). The PsychoPy objects for a stimulus are created before
+    its onset (see prepare()), so that presenting it only takes drawing them and flipping the window.
+    For every presented stimulus, the time taken to draw it and the number of missed flips are
+    recorded (see trial_records), so that timing problems can be detected and reported.
+    """
+
+    def __init__(self, window, line_width=1.8, line_color=(-1, -1, -1), units="pix", frame_period=None,
+                 buffered=False):
+        """generate a LivePresenter instance
+        :param window: the experiment's window
+        :type window: psychopy.visual.Window
+        :param line_width: width of the lines
+        :type line_width: float
+        :param line_color: color of the lines, in PsychoPy's 'rgb' color space
+        :type line_color: tuple of floats
+        :param units: units of the lines' coordinates
+        :type units: str
+        :param frame_period: duration of one refresh of the screen, in seconds. if None, the window's
+        monitorFramePeriod is used
+        :type frame_period: float
+        :param buffered: if True, each prepared stimulus is rendered to a single texture beforehand (using a
+        PsychoPy BufferImageStim), so that it can be drawn at once. this should be done between trials,
+        as it uses the window's back buffer
+        :type buffered: bool"""
+        self.window = window
+        self.line_width = line_width
+        self.line_color = line_color
+        self.units = units
+        self.frame_period = frame_period if frame_period is not None else window.monitorFramePeriod
+        self.buffered = buffered
+        self.trial_records = []
+        # timestamp of the last flip of the previous presentation, and the time it was taken at
+        self.__last_flip = None
+
+    def prepare(self, lines):
+        """create the PsychoPy objects for drawing the passed lines, to be passed to present()
+        :type lines: list of Line instances
+        :return: list of PsychoPy stimuli"""
+        with Profiler.stage("prepare"):
+            line_stims = [visual.Line(self.window, units=self.units,
+                                      lineWidth=self.line_width, lineColor=self.line_color,
+                                      lineColorSpace="rgb",
+                                      start=(line.start_point.x, line.start_point.y),
+                                      end=(line.end_point.x, line.end_point.y),
+                                      opacity=1,
+                                      interpolate=True)
+                          for line in lines]
+            if self.buffered:
+                return [visual.BufferImageStim(self.window, stim=line_stims)]
+            return line_stims
+
+    def prepare_stimulus(self, stimulus, variants=("embeddedfigure", "nofigure")):
+        """prepare the passed variants of a stimulus taken from a StimulusPool
+        :type stimulus: dict
+        :type variants: tuple of str
+        :return: dict of prepared stimuli by variant name"""
+        return {variant: self.prepare(stimulus["lines"][variant]) for variant in variants}
+
+    def present(self, prepared, num_frames=1, stimulus_id=None, extra_stims=(), previous_flip_time=None):
+        """draw the prepared stimulus and flip the window, for the passed number of refreshes, and record
+        the timing of the presentation. returns the record, a dict holding the time taken to draw the
+        stimulus for its first refresh ('draw_time'), whether that exceeded one refresh
+        ('draw_deadline_missed'), the time of the first flip as returned by the window ('onset_time'), the
+        time between the previous flip and the onset ('onset_interval', None if there is no previous
+        flip), the longest time between flips ('max_flip_interval') and the number of refreshes that were
+        missed ('num_missed_flips'), including those missed at the onset
+        :param prepared: stimulus as returned by prepare()
+        :type prepared: list of PsychoPy stimuli
+        :param num_frames: number of refreshes to show the stimulus for
+        :type num_frames: int
+        :param stimulus_id: identifier of the stimulus, included in the record
+        :type stimulus_id: str
+        :param extra_stims: other PsychoPy stimuli to draw on top of the stimulus (e. g. a fixation cross)
+        :type extra_stims: list of PsychoPy stimuli
+        :param previous_flip_time: timestamp returned by the window's flip before the onset (e. g. that of
+        a fixation cross). if None and present() is called within one refresh of the last flip of the
+        previous presentation (i. e. the presentations follow each other directly), that flip is used.
+        otherwise, the onset isn't checked for missed refreshes
+        :type previous_flip_time: float
+        :return: dict"""
+        assert num_frames > 0, "num_frames must be at least 1"
+        if previous_flip_time is None and self.__last_flip is not None and \
+                time.perf_counter() - self.__last_flip[1] <= self.frame_period:
+            previous_flip_time = self.__last_flip[0]
+        flip_times = []
+        draw_time = None
+        for frame_no in range(num_frames):
+            draw_start = time.perf_counter()
+            with Profiler.stage("draw"):
+                for stim in prepared:
+                    stim.draw()
+                for stim in extra_stims:
+                    stim.draw()
+            if draw_time is None:
+                draw_time = time.perf_counter() - draw_start
+            with Profiler.stage("flip"):
+                flip_times.append(self.window.flip())
+        self.__last_flip = (flip_times[-1], time.perf_counter())
+        # the end of the presentation is marked by the flip of whatever is drawn next, so the interval
+        # before that flip is not measured here
+        measured_flip_times = ([previous_flip_time] if previous_flip_time is not None else []) + flip_times
+        flip_intervals = [end - start for start, end in zip(measured_flip_times, measured_flip_times[1:])]
+        num_missed_flips = sum([max(0, round(interval / self.frame_period) - 1) for interval in flip_intervals])
+        record = {"trial": len(self.trial_records), "stimulus_id": stimulus_id, "num_frames": num_frames,
+                  "onset_time": flip_times[0],
+                  "onset_interval": flip_times[0] - previous_flip_time if previous_flip_time is not None else None,
+                  "draw_time": draw_time,
+                  "draw_deadline_missed": draw_time > self.frame_period,
+                  "max_flip_interval": max(flip_intervals) if flip_intervals else None,
+                  "num_missed_flips": num_missed_flips}
+        if num_missed_flips:
+            Profiler.count("missed_flips", num_missed_flips)
+        self.trial_records.append(record)
+        return record
+
+    @staticmethod
+    def has_timing_problem(record):
+        """returns True if the passed trial record (see present()) shows missed flips or a draw time
+        longer than one refresh
+        :type record: dict
+        :return: bool"""
+        return record["draw_deadline_missed"] or record["num_missed_flips"] > 0
+
+    def get_summary(self):
+        """returns a summary of the timing of all trials presented so far
+        :return: dict"""
+        draw_times = [record["draw_time"] for record in self.trial_records]
+        return {"num_trials": len(self.trial_records),
+                "num_trials_with_timing_problems": sum([LivePresenter.has_timing_problem(record)
+                                                        for record in self.trial_records]),
+                "num_missed_flips": sum([record["num_missed_flips"] for record in self.trial_records]),
+                "mean_draw_time": sum(draw_times) / len(draw_times) if draw_times else None,
+                "max_draw_time": max(draw_times) if draw_times else None}
@@ -0,0 +1,232 @@
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from psychopy import visual
+
+from leftstim.build.GenerationRun import GenerationRun
+from leftstim.instrumentation.Profiler import Profiler
+from leftstim.storage.ImageEncoder import ImageEncoder
+
+
+class StimulusService:
+    """
+    A long-running local HTTP service that builds and renders stimuli on request, by recipe name and
+    seed, e. g. for web-based experiments. As the service keeps running, the figure definitions and the
+    render backend only have to be loaded once, and recently requested stimuli are kept in an LRU
+    cache. Requests are handled one at a time, in the thread running the service. Endpoints:
+
+    - GET /stimulus?recipe=<name>&seed=<int>&variant=<variant>: the image, as a PNG (or in the
+      service's encoder's format). variant is 'embeddedfigure' (default), 'onlyfigure' or 'nofigure'
+    - GET /metadata?recipe=<name>&seed=<int>: the stimulus' metadata, as JSON
+    - GET /recipes: the recipes' names and parameters, as JSON
+    - GET /stats: number of requests, cache hits and request latency percentiles, as JSON
+
+    A stimulus that fails validation is answered with status 422 and the problems found, as JSON. If
+    building or rendering a stimulus raises an exception, the request is answered with status 500 and
+    the exception, as JSON.
+    """
+    backends = ("psychopy", "pil")
+
+    def __init__(self, recipes, host="127.0.0.1", port=8000, cache_size=256, backend="psychopy", validator=None,
+                 encoder=None, max_latencies=10000):
+        """generate a StimulusService instance
+        :param recipes: recipes the service can build stimuli with, by name
+        :type recipes: dict of Recipe
+        :param host: address to listen on (only the local machine by default)
+        :type host: str
+        :param port: port to listen on (a free port is chosen if 0)
+        :type port: int
+        :param cache_size: maximum number of stimuli (each with all of its variants) kept in the cache
+        :type cache_size: int
+        :param backend: 'psychopy' to render using a PsychoPy window (one per window size and background
+        colour, kept open), or 'pil' to draw the lines using PIL, without a window or anti-aliasing (see
+        LeftImage.render_lines_without_window())
+        :type backend: str
+        :param validator: if passed, stimuli that fail validation are not served
+        :type validator: StimulusValidator
+        :param encoder: encoder for the served images (an ImageEncoder with default settings if None)
+        :type encoder: ImageEncoder
+        :param max_latencies: number of most recent request latencies the statistics are computed from
+        :type max_latencies: int"""
+        assert backend in StimulusService.backends, \
+            "backend must be one of {}".format(", ".join(StimulusService.backends))
+        self.recipes = dict(recipes)
+        self.cache_size = cache_size
+        self.backend = backend
+        self.validator = validator
+        self.encoder = encoder if encoder is not None else ImageEncoder()
+        self.cache = OrderedDict()
+        self.windows = {}
+        self.latencies = deque(maxlen=max_latencies)
+        self.num_requests = 0
+        self.num_cache_hits = 0
+        self.server = HTTPServer((host, port), StimulusRequestHandler)
+        self.server.service = self
+        self.__thread = None
+
+    @property
+    def url(self):
+        """base URL of the service, e. g. 'http://127.0.0.1:8000'"""
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def serve_forever(self):
+        """handle requests until stop() is called (e. g. from another thread) or the process is interrupted
+        :return: None"""
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def start(self):
+        """handle requests in a background thread. with the 'psychopy' backend, all rendering then
+        happens in that thread
+        :return: None"""
+        assert self.__thread is None, "the service has already been started"
+        self.__thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """stop handling requests and close the service's windows
+        :return: None"""
+        self.server.shutdown()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def close(self):
+        self.server.server_close()
+        for window in self.windows.values():
+            window.close()
+        self.windows = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_window(self, recipe):
+        """returns the service's window for the passed recipe's window size and background colour, opening
+        it if necessary
+        :return: psychopy.visual.Window"""
+        key = (recipe.window_width, recipe.window_height, recipe.background_color, recipe.units)
+        if key not in self.windows:
+            self.windows[key] = visual.Window(size=(recipe.window_width, recipe.window_height),
+                                              color=recipe.background_color, units=recipe.units)
+        return self.windows[key]
+
+    def get_stimulus(self, recipe_name, seed):
+        """returns the encoded images and the metadata of the stimulus built following the named recipe
+        with the passed seed, from the cache if possible. if the stimulus fails validation, the
+        images are None and the metadata holds the problems found, as 'rejection_reasons'
+        :type recipe_name: str
+        :type seed: int
+        :return: (dict of bytes by variant name or None, metadata dict, whether it was in the cache)"""
+        key = (recipe_name, seed)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key] + (True,)
+        recipe = self.recipes[recipe_name]
+        window = self.get_window(recipe) if self.backend == "psychopy" else None
+        img = recipe.build(seed, encoder=self.encoder, window=window)
+        metadata = img.get_metadata()
+        metadata["stimulus_id"] = GenerationRun.get_stimulus_id(metadata["figure_name"], seed)
+        metadata["recipe"] = recipe_name
+        variant_lines = img.get_image_and_context_lines(self.validator)
+        if variant_lines is None:
+            metadata["rejection_reasons"] = img.rejection_reasons
+            images = None
+        else:
+            with Profiler.stage("render"):
+                images = {variant: img.render_frame(lines) if window is not None
+                          else img.render_lines_without_window(lines) for variant, lines in variant_lines.items()}
+            with Profiler.stage("encode"):
+                images = {variant: self.encoder.to_bytes(image, recipe.background_color, recipe.line_color)
+                          for variant, image in images.items()}
+        self.cache[key] = (images, metadata)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return images, metadata, False
+
+    def record_latency(self, seconds, cache_hit):
+        self.num_requests += 1
+        self.num_cache_hits += cache_hit
+        self.latencies.append(seconds)
+
+    def get_stats(self):
+        """returns the number of requests, the number of cache hits and the 50th, 90th, 99th percentile
+        and maximum latency (in milliseconds) of the most recent requests
+        :return: dict"""
+        stats = {"num_requests": self.num_requests, "num_cache_hits": self.num_cache_hits,
+                 "num_cached": len(self.cache)}
+        latencies = np.array(self.latencies) * 1000
+        for name, percentile in (("p50_ms", 50), ("p90_ms", 90), ("p99_ms", 99), ("max_ms", 100)):
+            stats[name] = float(np.percentile(latencies, percentile)) if len(latencies) else None
+        return stats
+
+
+class StimulusRequestHandler(BaseHTTPRequestHandler):
+    """handles the requests of a StimulusService (see there)"""
+
+    def log_message(self, format, *args):
+        # requests aren't logged, as logging every request would slow down the service
+        pass
+
+    def send_body(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, content, headers=()):
+        self.send_body(status, json.dumps(content).encode("utf-8"), "application/json", headers)
+
+    def do_GET(self):
+        service = self.server.service
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        cache_hit = False
+        if url.path == "/recipes":
+            self.send_json(200, {name: recipe.to_dict() for name, recipe in service.recipes.items()})
+        elif url.path == "/stats":
+            self.send_json(200, service.get_stats())
+            return
+        elif url.path in ("/stimulus", "/metadata"):
+            recipe_name, variant = query.get("recipe"), query.get("variant", "embeddedfigure")
+            try:
+                seed = int(query["seed"])
+            except (KeyError, ValueError):
+                seed = None
+            if recipe_name not in service.recipes or seed is None or \
+                    variant not in ("onlyfigure", "embeddedfigure", "nofigure"):
+                self.send_json(400, {"error": "a known recipe, an integer seed and a valid variant are required"})
+                return
+            try:
+                images, metadata, cache_hit = service.get_stimulus(recipe_name, seed)
+            except Exception as e:
+                self.send_json(500, {"error": "building the stimulus failed: {}: {}".format(type(e).__name__, e)})
+                service.record_latency(time.perf_counter() - start, cache_hit)
+                return
+            headers = [("X-Stimulus-Id", metadata["stimulus_id"]), ("X-Cache", "hit" if cache_hit else "miss")]
+            if images is None:
+                self.send_json(422, {"error": "the stimulus failed validation",
+                                     "rejection_reasons": metadata["rejection_reasons"]}, headers)
+            elif url.path == "/metadata":
+                self.send_json(200, metadata, headers)
+            else:
+                self.send_body(200, images[variant], "image/" + service.encoder.extension[1:], headers)
+        else:
+            self.send_json(404, {"error": "unknown path"})
+            return
+        service.record_latency(time.perf_counter() - start, cache_hit)
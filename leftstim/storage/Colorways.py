@@ -0,0 +1,92 @@
+import numpy as np
+from PIL import Image
+
+from leftstim.instrumentation.Profiler import Profiler
+from leftstim.storage.ImageEncoder import ImageEncoder
+
+
+class Colorways:
+    """
+    Produces any number of colour schemes ('colourways') of a stimulus from a single rendering. A
+    rendered stimulus is stored as a coverage raster, a uint8 array holding for every pixel how far its
+    colour lies along the way from the background colour (0) to the line colour (255), like the images
+    of a RasterDataset (see ImageEncoder.get_coverage()). As every pixel of a stimulus is an alpha
+    blend of the two colours, a colourway is produced by looking up each pixel's coverage in a table of
+    256 colours, ranging from the scheme's background colour to its line colour, which keeps the
+    anti-aliasing of the original rendering.
+    """
+
+    def __init__(self, color_schemes):
+        """generate a Colorways instance
+        :param color_schemes: colour schemes by name, each a (background_color, line_color) pair in
+        PsychoPy's 'rgb' color space, e. g. {'dark': ((-1, -1, -1), (1, 1, 1))}
+        :type color_schemes: dict"""
+        assert color_schemes, "at least one color scheme is required"
+        self.color_schemes = {name: (tuple(background_color), tuple(line_color))
+                              for name, (background_color, line_color) in color_schemes.items()}
+        self.names = tuple(self.color_schemes)
+        # one table per scheme, of shape (number of schemes, 256, 3)
+        self.luts = np.stack([Colorways.get_lut(*self.color_schemes[name]) for name in self.names])
+
+    @staticmethod
+    def get_lut(background_color, line_color):
+        """returns the colours of the 256 coverage values for the passed colours
+        :param background_color: background color, in PsychoPy's 'rgb' color space
+        :param line_color: line color, in PsychoPy's 'rgb' color space
+        :return: numpy array of uint8, of shape (256, 3)"""
+        background = ImageEncoder.to_rgb255(background_color)
+        alpha = np.arange(256, dtype=np.float32)[:, None] / 255
+        return np.rint(background + alpha * (ImageEncoder.to_rgb255(line_color) - background)).astype(np.uint8)
+
+    @staticmethod
+    def to_coverage_raster(image, background_color, line_color):
+        """returns the coverage raster of a rendered image with the passed colours
+        :type image: PIL.Image.Image
+        :return: numpy array of uint8, of shape (height, width)"""
+        return np.rint(ImageEncoder.get_coverage(image, background_color, line_color) * 255).astype(np.uint8)
+
+    def recolor_array(self, coverage, name=None):
+        """returns the passed coverage raster(s) in the named colour scheme, or in all of them if name is
+        None. coverage may have any shape, e. g. (height, width), or (number of sets, number of variants,
+        height, width) for the images of a RasterDataset
+        :type coverage: numpy array of uint8
+        :type name: str
+        :return: numpy array of uint8, of shape coverage.shape + (3,), or (number of schemes,) +
+        coverage.shape + (3,) if name is None"""
+        coverage = np.asarray(coverage, dtype=np.uint8)
+        with Profiler.stage("recolor"):
+            if name is None:
+                return np.stack([np.take(lut, coverage, axis=0) for lut in self.luts])
+            return np.take(self.luts[self.names.index(name)], coverage, axis=0)
+
+    def recolor(self, coverage):
+        """returns the passed coverage raster in every colour scheme, as images
+        :type coverage: numpy array of uint8, of shape (height, width)
+        :return: dict of PIL.Image.Image by scheme name"""
+        coverage_image = Image.fromarray(np.asarray(coverage, dtype=np.uint8))
+        with Profiler.stage("recolor"):
+            return {name: Colorways.apply_lut(coverage_image, lut) for name, lut in zip(self.names, self.luts)}
+
+    def recolor_set(self, coverages):
+        """returns the passed set of coverage rasters (e. g. as returned by
+        LeftImage.render_coverage_and_context()) in every colour scheme, as images
+        :type coverages: dict of numpy arrays by variant name
+        :return: dict (by scheme name) of dicts of PIL.Image.Image by variant name"""
+        coverage_images = {variant: Image.fromarray(np.asarray(coverage, dtype=np.uint8))
+                           for variant, coverage in coverages.items()}
+        with Profiler.stage("recolor"):
+            return {name: {variant: Colorways.apply_lut(coverage_image, lut)
+                           for variant, coverage_image in coverage_images.items()}
+                    for name, lut in zip(self.names, self.luts)}
+
+    @staticmethod
+    def apply_lut(coverage_image, lut):
+        """returns the passed 8-bit coverage image with each pixel replaced by its colour in the passed
+        table. the table is applied as the image's palette, which is faster than indexing the table
+        with numpy for whole images
+        :type coverage_image: PIL.Image.Image
+        :type lut: numpy array of uint8, of shape (256, 3)
+        :return: PIL.Image.Image"""
+        palette_image = coverage_image.copy()
+        palette_image.putpalette(lut.ravel().tolist())
+        return palette_image.convert("RGB")
@@ -0,0 +1,67 @@
+import json
+import os
+
+from leftstim.instrumentation.Profiler import Profiler
+from leftstim.storage.ImageEncoder import ImageEncoder
+
+
+class DirectorySink:
+    def __init__(self, directory, encoder=None, write_metadata=True):
+        """generate a DirectorySink instance, which writes each set of images to separate files in a
+        directory, named '<stimulus id>_<variant>.png' (like LeftImage.save_image_and_context() does),
+        optionally with a '<stimulus id>.json' metadata file
+        :param directory: directory to write to (created if it doesn't exist)
+        :type directory: str
+        :param encoder: encoder to use. if None, images are saved as RGB PNGs
+        :type encoder: ImageEncoder
+        :param write_metadata: whether to write a metadata file for each set of images
+        :type write_metadata: bool"""
+        self.directory = directory
+        self.encoder = encoder if encoder is not None else ImageEncoder("rgb")
+        self.write_metadata = write_metadata
+        self.__unsynced_paths = []
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_set(self, stimulus_id, images, metadata):
+        """write a set of images and its metadata
+        :param stimulus_id: identifier of the set
+        :type stimulus_id: str
+        :param images: images of the set, by variant name (e. g. 'embeddedfigure')
+        :type images: dict of PIL.Image.Image
+        :param metadata: metadata of the set, must hold 'background_color' and 'line_color' (see
+        LeftImage.get_metadata())
+        :type metadata: dict
+        :return: the paths of the written image files, separated by ';'"""
+        file_paths = []
+        for variant, image in images.items():
+            file_path = os.path.join(self.directory, stimulus_id + "_" + variant + self.encoder.extension)
+            with Profiler.stage("encode"):
+                file_paths.append(self.encoder.save(image, file_path, metadata["background_color"],
+                                                    metadata["line_color"]))
+        self.__unsynced_paths.extend(file_paths)
+        if self.write_metadata:
+            metadata_path = os.path.join(self.directory, stimulus_id + ".json")
+            with open(metadata_path, "w") as f:
+                json.dump(metadata, f)
+            self.__unsynced_paths.append(metadata_path)
+        return ";".join(file_paths)
+
+    def flush(self):
+        """write the files written since the last flush to disk (they are written immediately, but may
+        only be held in the operating system's cache until then)
+        :return: None"""
+        for file_path in self.__unsynced_paths:
+            with open(file_path, "rb+") as f:
+                os.fsync(f.fileno())
+        self.__unsynced_paths = []
+
+    def close(self):
+        """write all files to disk, nothing else needs to be finalized for a directory
+        :return: None"""
+        self.flush()
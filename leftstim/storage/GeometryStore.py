@@ -0,0 +1,243 @@
+import json
+import os
+
+import numpy as np
+
+from leftstim.basic_components.Line import Line
+from leftstim.basic_components.Point import Point
+from leftstim.build.LeftImage import LeftImage
+from leftstim.instrumentation.Profiler import Profiler
+
+
+class GeometryStore:
+    """
+    A columnar store of the lines making up sets of stimuli, for keeping (and later rendering) far more
+    stimuli than could be stored as images. All lines of all sets are stored in a single float32 array
+    of segments, (start x, start y, end x, end y), with a parallel uint8 array of line kind tags (see
+    LeftImage.line_kinds). An int64 offset table holds, for every set, where the segments of each of
+    its variants start, plus where the set's segments end, so that the segments of variant v of set i
+    are segments[offsets[i, v]:offsets[i, v + 1]]. The arrays are opened memory-mapped, and sets can be
+    looked up by stimulus id in constant time. Written using GeometryStoreWriter.
+    """
+    segments_file_name = "segments.f32"
+    kinds_file_name = "kinds.u8"
+    offsets_file_name = "offsets.i64"
+    figures_file_name = "figures.u16"
+    ids_file_name = "ids.txt"
+    info_file_name = "info.json"
+    metadata_file_name = "metadata.jsonl"
+
+    def __init__(self, directory):
+        """generate a GeometryStore instance, opening the store in the passed directory
+        :type directory: str"""
+        self.directory = directory
+        with open(os.path.join(directory, GeometryStore.info_file_name)) as f:
+            info = json.load(f)
+        self.variants = tuple(info["variants"])
+        self.line_kinds = tuple(info["line_kinds"])
+        self.figure_names = tuple(info["figure_names"])
+        ids = []
+        ids_path = os.path.join(directory, GeometryStore.ids_file_name)
+        if os.path.exists(ids_path):
+            with open(ids_path, encoding="utf-8") as f:
+                ids = [line[:-1] for line in f if line.endswith("\n")]
+        offsets = GeometryStore.open_array(os.path.join(directory, GeometryStore.offsets_file_name), np.int64,
+                                           len(self.variants) + 1)
+        figure_ids = GeometryStore.open_array(os.path.join(directory, GeometryStore.figures_file_name), np.uint16)
+        num_sets = min(len(ids), len(offsets), len(figure_ids))
+        self.segments = GeometryStore.open_array(os.path.join(directory, GeometryStore.segments_file_name),
+                                                 np.float32, 4)
+        self.kinds = GeometryStore.open_array(os.path.join(directory, GeometryStore.kinds_file_name), np.uint8)
+        # leave out sets whose segments weren't completely written
+        while num_sets > 0 and offsets[num_sets - 1, -1] > min(len(self.segments), len(self.kinds)):
+            num_sets -= 1
+        self.ids = ids[:num_sets]
+        self.offsets = offsets[:num_sets]
+        self.figure_ids = figure_ids[:num_sets]
+        self.index_of_id = {stimulus_id: index for index, stimulus_id in enumerate(self.ids)}
+        self.__metadata = None
+
+    @staticmethod
+    def open_array(file_path, dtype, row_length=None):
+        """open the passed raw array file memory-mapped, ignoring an incompletely written last row
+        :param row_length: number of values per row, if the array is two-dimensional
+        :type row_length: int
+        :return: numpy array"""
+        row_size = np.dtype(dtype).itemsize * (row_length or 1)
+        num_rows = os.path.getsize(file_path) // row_size if os.path.exists(file_path) else 0
+        shape = (num_rows,) if row_length is None else (num_rows, row_length)
+        if num_rows == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode="r", shape=shape)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, stimulus_id):
+        return stimulus_id in self.index_of_id
+
+    def get_index(self, item):
+        """returns the index of the set with the passed stimulus id (an int is returned as is)
+        :type item: str or int
+        :return: int"""
+        return item if isinstance(item, (int, np.integer)) else self.index_of_id[item]
+
+    @property
+    def metadata(self):
+        """list of the metadata dicts of all sets, in order (read on first use)"""
+        if self.__metadata is None:
+            with open(os.path.join(self.directory, GeometryStore.metadata_file_name), encoding="utf-8") as f:
+                self.__metadata = [json.loads(line) for line in f][:len(self)]
+        return self.__metadata
+
+    def get_figure_name(self, item):
+        """returns the name of the figure of the passed set
+        :param item: stimulus id or index of the set
+        :return: str"""
+        return self.figure_names[self.figure_ids[self.get_index(item)]]
+
+    def get_segments(self, item, variant="embeddedfigure"):
+        """returns the segments of the passed variant of the passed set, together with their line
+        kind tags, as views of the memory-mapped arrays
+        :param item: stimulus id or index of the set
+        :type variant: str
+        :return: (float32 array of shape (number of lines, 4), uint8 array of line kinds)"""
+        set_offsets = self.offsets[self.get_index(item)]
+        variant_index = self.variants.index(variant)
+        start, end = set_offsets[variant_index], set_offsets[variant_index + 1]
+        return self.segments[start:end], self.kinds[start:end]
+
+    def get_lines(self, item, variant="embeddedfigure", kinds=None):
+        """returns the lines of the passed variant of the passed set as Line instances, e. g. for
+        drawing them using LeftImage.render_frame()
+        :param item: stimulus id or index of the set
+        :type variant: str
+        :param kinds: if passed, only lines of these kinds (see LeftImage.line_kinds) are returned
+        :type kinds: list of str
+        :return: list of Line instances"""
+        segments, line_kinds = self.get_segments(item, variant)
+        if kinds is not None:
+            segments = segments[np.isin(line_kinds, [self.line_kinds.index(kind) for kind in kinds])]
+        return [Line(Point(start_x, start_y), Point(end_x, end_y))
+                for start_x, start_y, end_x, end_y in segments.tolist()]
+
+
+class GeometryStoreWriter:
+    def __init__(self, directory, variants=("onlyfigure", "embeddedfigure", "nofigure"), write_metadata=True):
+        """generate a GeometryStoreWriter instance, for writing the lines of sets of stimuli to a
+        GeometryStore (see LeftImage.save_geometry()). if the directory already holds a store, sets are
+        appended to it
+        :param directory: directory to write to (created if it doesn't exist)
+        :type directory: str
+        :param variants: variant names of the stimuli in each set, in the order they are stored in
+        :type variants: tuple of str
+        :param write_metadata: whether to also store each set's metadata
+        :type write_metadata: bool"""
+        self.directory = directory
+        self.variants = tuple(variants)
+        self.write_metadata = write_metadata
+        self.figure_names = []
+        self.num_sets = 0
+        self.num_segments = 0
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, GeometryStore.info_file_name)):
+            self.open_existing()
+        else:
+            self.write_info()
+        self.__files = {file_name: open(os.path.join(directory, file_name), "ab")
+                        for file_name in (GeometryStore.segments_file_name, GeometryStore.kinds_file_name,
+                                          GeometryStore.offsets_file_name, GeometryStore.figures_file_name,
+                                          GeometryStore.ids_file_name, GeometryStore.metadata_file_name)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open_existing(self):
+        """prepare appending to the existing store in the writer's directory. a set that was only
+        partly written (e. g. because of a crash) is removed
+        :return: None"""
+        store = GeometryStore(self.directory)
+        assert store.variants == self.variants, "the existing store has different variants"
+        assert store.line_kinds == LeftImage.line_kinds, "the existing store has different line kinds"
+        self.figure_names = list(store.figure_names)
+        self.num_sets = len(store)
+        self.num_segments = int(store.offsets[-1, -1]) if self.num_sets else 0
+        # release the memory-mapped files before truncating them
+        del store
+        for file_name, num_bytes in ((GeometryStore.segments_file_name, self.num_segments * 16),
+                                     (GeometryStore.kinds_file_name, self.num_segments),
+                                     (GeometryStore.offsets_file_name, self.num_sets * 8 * (len(self.variants) + 1)),
+                                     (GeometryStore.figures_file_name, self.num_sets * 2)):
+            file_path = os.path.join(self.directory, file_name)
+            if os.path.exists(file_path):
+                os.truncate(file_path, num_bytes)
+        for file_name in (GeometryStore.ids_file_name, GeometryStore.metadata_file_name):
+            file_path = os.path.join(self.directory, file_name)
+            if os.path.exists(file_path):
+                with open(file_path, encoding="utf-8") as f:
+                    lines = [line for line in f if line.endswith("\n")]
+                with open(file_path, "w", encoding="utf-8") as f:
+                    f.writelines(lines[:self.num_sets])
+
+    def write_info(self):
+        with open(os.path.join(self.directory, GeometryStore.info_file_name), "w") as f:
+            json.dump({"variants": list(self.variants), "line_kinds": list(LeftImage.line_kinds),
+                       "figure_names": self.figure_names, "num_sets": self.num_sets,
+                       "num_segments": self.num_segments}, f)
+
+    def write_geometry(self, stimulus_id, variant_lines, metadata):
+        """append the lines of a set and its metadata
+        :param stimulus_id: identifier of the set (may not contain line breaks)
+        :type stimulus_id: str
+        :param variant_lines: lines of the set, by variant name, as (kind, Line) tuples (see
+        LeftImage.get_image_and_context_lines() with tagged=True). must hold all of the writer's variants
+        :type variant_lines: dict
+        :param metadata: metadata of the set, must hold 'figure_name' (see LeftImage.get_metadata())
+        :type metadata: dict
+        :return: the store's directory and the set's index in the store, as '<directory>#<index>'"""
+        assert "\n" not in stimulus_id, "stimulus ids may not contain line breaks"
+        with Profiler.stage("encode"):
+            offsets = [self.num_segments]
+            segments, kinds = [], []
+            for variant in self.variants:
+                for kind, line in variant_lines[variant]:
+                    segments.append((line.start_point.x, line.start_point.y, line.end_point.x, line.end_point.y))
+                    kinds.append(LeftImage.line_kinds.index(kind))
+                offsets.append(self.num_segments + len(segments))
+            figure_name = metadata["figure_name"]
+            if figure_name not in self.figure_names:
+                self.figure_names.append(figure_name)
+                self.write_info()
+        with Profiler.stage("write"):
+            self.__files[GeometryStore.segments_file_name].write(np.array(segments, dtype=np.float32).tobytes())
+            self.__files[GeometryStore.kinds_file_name].write(np.array(kinds, dtype=np.uint8).tobytes())
+            self.__files[GeometryStore.figures_file_name].write(
+                np.array([self.figure_names.index(figure_name)], dtype=np.uint16).tobytes())
+            self.__files[GeometryStore.ids_file_name].write((stimulus_id + "\n").encode("utf-8"))
+            if self.write_metadata:
+                self.__files[GeometryStore.metadata_file_name].write(
+                    (json.dumps(dict(metadata, stimulus_id=stimulus_id)) + "\n").encode("utf-8"))
+            self.__files[GeometryStore.offsets_file_name].write(np.array(offsets, dtype=np.int64).tobytes())
+        self.num_segments += len(segments)
+        self.num_sets += 1
+        return "{}#{}".format(self.directory, self.num_sets - 1)
+
+    def flush(self):
+        """write everything written so far to disk
+        :return: None"""
+        for f in self.__files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self.write_info()
+
+    def close(self):
+        """finish writing. must be called when done writing
+        :return: None"""
+        if self.__files[GeometryStore.ids_file_name].closed:
+            return
+        for f in self.__files.values():
+            f.close()
+        self.write_info()
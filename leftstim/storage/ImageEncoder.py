@@ -0,0 +1,154 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+
+class ImageEncoder:
+    """
+    Writes rendered frames to disk in a format suited for two-colour stimuli. Apart from anti-aliased
+    edges, every pixel of a stimulus is either the background colour or the line colour, so each pixel
+    can be stored as its 'coverage' (0 = background colour, 1 = line colour) instead of as a full RGB
+    triplet.
+    """
+    modes = ("rgb", "palette", "grayscale", "bilevel", "webp")
+
+    def __init__(self, mode="palette", compress_level=6, optimize=False, num_levels=16):
+        """generate an ImageEncoder instance
+        :param mode: 'rgb' (full colour PNG, like PsychoPy's saveMovieFrames()), 'palette' (PNG with a
+        palette of num_levels colours, ranging from the background colour to the line colour),
+        'grayscale' (grayscale PNG of the coverage, with the background and line colours stored as
+        text chunks so that it can be tinted again), 'bilevel' (1-bit PNG, white for the background and
+        black for lines, without anti-aliasing, colours stored as for 'grayscale') or 'webp' (lossless WebP)
+        :type mode: str
+        :param compress_level: zlib compression level for PNGs (0-9), or effort for WebP (0-9, mapped
+        to WebP's 0-6). lower is faster, higher gives smaller files
+        :type compress_level: int
+        :param optimize: if True, PNGs are compressed as much as possible (slow). not used for WebP
+        :type optimize: bool
+        :param num_levels: number of colours in the palette, for 'palette' mode (2-256)
+        :type num_levels: int"""
+        assert mode in ImageEncoder.modes, "mode must be one of {}".format(", ".join(ImageEncoder.modes))
+        assert 0 <= compress_level <= 9, "compress_level must be between 0 and 9"
+        assert 2 <= num_levels <= 256, "num_levels must be between 2 and 256"
+        self.mode = mode
+        self.compress_level = compress_level
+        self.optimize = optimize
+        self.num_levels = num_levels
+
+    @staticmethod
+    def fast(mode="palette"):
+        """returns an encoder that encodes as quickly as possible, e. g. for scratch runs
+        :return: ImageEncoder"""
+        return ImageEncoder(mode=mode, compress_level=1)
+
+    @staticmethod
+    def archival(mode="palette"):
+        """returns an encoder that produces files as small as possible, e. g. for archiving
+        :return: ImageEncoder"""
+        return ImageEncoder(mode=mode, compress_level=9, optimize=True)
+
+    @staticmethod
+    def to_rgb255(color):
+        """converts a color in PsychoPy's 'rgb' color space (values between -1 and 1) to 8-bit values
+        :type color: tuple of floats
+        :return: numpy array of 3 floats"""
+        return (np.asarray(color, dtype=np.float32)[:3] + 1) / 2 * 255
+
+    @staticmethod
+    def get_coverage(image, background_color, line_color):
+        """returns, for every pixel of the passed image, how far its color lies along the way from the
+        background color to the line color
+        :param image: rendered frame
+        :type image: PIL.Image.Image
+        :param background_color: background color, in PsychoPy's 'rgb' color space
+        :param line_color: line color, in PsychoPy's 'rgb' color space
+        :return: numpy array of floats between 0 (background color) and 1 (line color), of shape
+        (height, width)"""
+        background = ImageEncoder.to_rgb255(background_color)
+        color_diff = ImageEncoder.to_rgb255(line_color) - background
+        assert color_diff.any(), "background and line colors must differ"
+        pixels = np.asarray(image.convert("RGB"), dtype=np.float32)
+        coverage = (pixels - background) @ (color_diff / (color_diff @ color_diff))
+        return np.clip(coverage, 0, 1)
+
+    @staticmethod
+    def is_label(image):
+        """returns True if the passed image is a label image, such as a figure mask (see
+        LeftImage.render_figure_mask()), rather than a rendered frame. label images are single-channel
+        and are stored as they are, without being converted to this encoder's mode
+        :type image: PIL.Image.Image
+        :return: bool"""
+        return image.mode in ("1", "L")
+
+    @property
+    def extension(self):
+        """file extension of this encoder's format, e. g. '.png'"""
+        return ".webp" if self.mode == "webp" else ".png"
+
+    def get_file_path(self, file_path):
+        """returns the passed file path, with the file extension matching this encoder's format
+        :type file_path: str
+        :return: str"""
+        return os.path.splitext(file_path)[0] + self.extension
+
+    def encode(self, image, background_color, line_color):
+        """returns the passed frame converted according to this encoder's mode
+        :type image: PIL.Image.Image
+        :return: PIL.Image.Image"""
+        if ImageEncoder.is_label(image):
+            return image
+        if self.mode in ("rgb", "webp"):
+            return image.convert("RGB")
+        coverage = ImageEncoder.get_coverage(image, background_color, line_color)
+        if self.mode == "grayscale":
+            return Image.fromarray(np.rint((1 - coverage) * 255).astype(np.uint8))
+        if self.mode == "bilevel":
+            return Image.fromarray(coverage < 0.5)
+        levels = np.rint(coverage * (self.num_levels - 1)).astype(np.uint8)
+        # putpalette() turns the 8-bit grayscale image into a palette image
+        encoded = Image.fromarray(levels)
+        ramp = np.linspace(0, 1, self.num_levels, dtype=np.float32)[:, None]
+        background = ImageEncoder.to_rgb255(background_color)
+        palette = background + ramp * (ImageEncoder.to_rgb255(line_color) - background)
+        encoded.putpalette(np.rint(palette).astype(np.uint8).ravel().tolist())
+        return encoded
+
+    def save(self, image, file_path, background_color, line_color):
+        """convert and save the passed frame to the passed file path (with its extension changed to
+        match this encoder's format, see get_file_path())
+        :type image: PIL.Image.Image
+        :type file_path: str
+        :return: the path the image was saved to"""
+        file_path = self.get_file_path(file_path)
+        with open(file_path, "wb") as f:
+            self.write(image, f, background_color, line_color)
+        return file_path
+
+    def to_bytes(self, image, background_color, line_color):
+        """returns the passed frame converted and encoded in this encoder's format
+        :type image: PIL.Image.Image
+        :return: bytes"""
+        buffer = io.BytesIO()
+        self.write(image, buffer, background_color, line_color)
+        return buffer.getvalue()
+
+    def write(self, image, file_obj, background_color, line_color):
+        """convert the passed frame and write it, in this encoder's format, to the passed binary file object
+        :type image: PIL.Image.Image
+        :return: None"""
+        encoded = self.encode(image, background_color, line_color)
+        if self.mode == "webp":
+            # for lossless WebP, quality sets the compression effort rather than the image quality
+            encoded.save(file_obj, format="WEBP", lossless=True, method=round(self.compress_level * 6 / 9),
+                         quality=self.compress_level * 10)
+            return
+        png_info = None
+        if self.mode in ("grayscale", "bilevel") and not ImageEncoder.is_label(image):
+            png_info = PngInfo()
+            png_info.add_text("background_color", " ".join(str(value) for value in background_color))
+            png_info.add_text("line_color", " ".join(str(value) for value in line_color))
+        encoded.save(file_obj, format="PNG", compress_level=self.compress_level, optimize=self.optimize,
+                     pnginfo=png_info)
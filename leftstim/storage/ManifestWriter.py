@@ -0,0 +1,115 @@
+import os
+
+import pandas as pd
+
+from leftstim.analysis.ComplexityMetrics import ComplexityMetrics
+
+
+class ManifestWriter:
+    """
+    Records one row per generated stimulus (including rejected ones) while generating, with the
+    stimulus' id, seed, figure placement and bounding box, alignment/shift/lock state, line counts, complexity metrics
+    (empty if they weren't computed), validation result and output location. Rows are buffered and written in chunks, either appended to a single CSV file
+    or as numbered Parquet part files in a directory, so that memory use does not depend on the
+    number of stimuli. A manifest can be read back using ManifestWriter.read().
+    """
+    columns = ("stimulus_id", "seed", "figure_name",
+               "figure_x", "figure_y", "figure_width", "figure_height", "figure_offset_x", "figure_offset_y",
+               "figure_locked_x", "figure_locked_y", "figure_aligned", "figure_shifted",
+               "figure_bbox_left", "figure_bbox_top", "figure_bbox_right", "figure_bbox_bottom",
+               "num_figure_lines", "num_extended_figure_lines", "num_non_fig_lines", "num_figure_linked_lines",
+               "num_frame_to_frame_lines", "num_frame_to_line_lines", "num_line_to_line_lines") + \
+        ComplexityMetrics.metric_names + ("valid", "rejection_reasons", "output")
+    formats = ("csv", "parquet")
+
+    def __init__(self, path, manifest_format="csv", chunk_size=1000):
+        """generate a ManifestWriter instance
+        :param path: path of the CSV file, or of the directory to write Parquet part files to. rows are
+        appended to an existing CSV file, and part files are added to an existing directory
+        :type path: str
+        :param manifest_format: 'csv' or 'parquet' (requires pyarrow or fastparquet to be installed)
+        :type manifest_format: str
+        :param chunk_size: number of rows to buffer before writing them
+        :type chunk_size: int"""
+        assert manifest_format in ManifestWriter.formats, "manifest_format must be 'csv' or 'parquet'"
+        self.path = path
+        self.manifest_format = manifest_format
+        self.chunk_size = chunk_size
+        self.num_rows = 0
+        self.__rows = []
+        if manifest_format == "parquet":
+            os.makedirs(path, exist_ok=True)
+            self.__num_parts = len([file_name for file_name in os.listdir(path) if file_name.endswith(".parquet")])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, stimulus_id, metadata, rejection_reasons=(), output=""):
+        """add a row for a stimulus
+        :param stimulus_id: identifier of the stimulus
+        :type stimulus_id: str
+        :param metadata: metadata of the stimulus (see LeftImage.get_metadata())
+        :type metadata: dict
+        :param rejection_reasons: reasons the stimulus was rejected, if it was (see StimulusValidator)
+        :type rejection_reasons: list of str
+        :param output: where the stimulus' images were written to (empty if it was rejected)
+        :type output: str
+        :return: None"""
+        row = dict(metadata, stimulus_id=stimulus_id, valid=not rejection_reasons,
+                   rejection_reasons="; ".join(rejection_reasons), output=output or "")
+        if row.get("figure_bbox") is not None:
+            row.update(zip(("figure_bbox_left", "figure_bbox_top", "figure_bbox_right", "figure_bbox_bottom"),
+                           row["figure_bbox"]))
+        self.__rows.append([row.get(column) for column in ManifestWriter.columns])
+        self.num_rows += 1
+        if len(self.__rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """write all buffered rows to disk
+        :return: None"""
+        if not self.__rows:
+            return
+        chunk = pd.DataFrame(self.__rows, columns=ManifestWriter.columns)
+        if self.manifest_format == "csv":
+            write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            if not write_header:
+                with open(self.path, newline="") as f:
+                    assert f.readline().rstrip("\r\n") == ",".join(ManifestWriter.columns), \
+                        "the existing manifest has different columns"
+            with open(self.path, "a", newline="") as f:
+                chunk.to_csv(f, header=write_header, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            part_path = os.path.join(self.path, "part-{:06d}.parquet".format(self.__num_parts))
+            chunk.to_parquet(part_path, index=False)
+            with open(part_path, "rb+") as f:
+                os.fsync(f.fileno())
+            self.__num_parts += 1
+        self.__rows = []
+
+    def close(self):
+        """write all remaining rows. must be called when done writing
+        :return: None"""
+        self.flush()
+
+    @staticmethod
+    def read(path, columns=None):
+        """read a manifest written by a ManifestWriter
+        :param path: path of the CSV file or of the directory of Parquet part files
+        :type path: str
+        :param columns: columns to read (all if None)
+        :type columns: list of str
+        :return: pandas.DataFrame"""
+        if os.path.isdir(path):
+            part_paths = sorted(os.path.join(path, file_name) for file_name in os.listdir(path)
+                                if file_name.endswith(".parquet"))
+            if not part_paths:
+                return pd.DataFrame(columns=columns or list(ManifestWriter.columns))
+            return pd.concat([pd.read_parquet(part_path, columns=columns) for part_path in part_paths],
+                             ignore_index=True)
+        return pd.read_csv(path, usecols=columns)
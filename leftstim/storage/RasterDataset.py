@@ -0,0 +1,165 @@
+import json
+import os
+
+import numpy as np
+
+from leftstim.instrumentation.Profiler import Profiler
+from leftstim.storage.ImageEncoder import ImageEncoder
+
+
+class RasterDataset:
+    """
+    A fixed-shape dataset of rendered stimuli, stored as a single raw uint8 array of shape
+    (number of sets, number of variants, height, width) that is opened memory-mapped, so that sets
+    can be indexed without copying or decoding anything. Pixel values are coverage values, from 0 for
+    the background colour to 255 for the line colour (see ImageEncoder.get_coverage()). Written
+    using RasterDatasetWriter.
+    """
+    images_file_name = "images.u8"
+    info_file_name = "info.json"
+    metadata_file_name = "metadata.jsonl"
+
+    def __init__(self, directory):
+        """generate a RasterDataset instance, opening the dataset in the passed directory
+        :type directory: str"""
+        self.directory = directory
+        with open(os.path.join(directory, RasterDataset.info_file_name)) as f:
+            info = json.load(f)
+        self.variants = tuple(info["variants"])
+        self.height = info["height"]
+        self.width = info["width"]
+        images_path = os.path.join(directory, RasterDataset.images_file_name)
+        num_sets = os.path.getsize(images_path) // RasterDataset.get_set_size(len(self.variants), self.height,
+                                                                               self.width)
+        if num_sets > 0:
+            self.images = np.memmap(images_path, dtype=np.uint8, mode="r",
+                                    shape=(num_sets, len(self.variants), self.height, self.width))
+        else:
+            self.images = np.zeros((0, len(self.variants), self.height, self.width), dtype=np.uint8)
+        self.__metadata = None
+
+    def __len__(self):
+        return self.images.shape[0]
+
+    def __getitem__(self, item):
+        """returns the images of the set(s) with the passed index (or slice), as a view of the
+        memory-mapped array
+        :return: numpy array of shape (number of variants, height, width)"""
+        return self.images[item]
+
+    @staticmethod
+    def get_set_size(num_variants, height, width):
+        """returns the number of bytes taken up by one set
+        :return: int"""
+        return num_variants * height * width
+
+    @property
+    def metadata(self):
+        """list of the metadata dicts of all sets, in order (read on first use)"""
+        if self.__metadata is None:
+            with open(os.path.join(self.directory, RasterDataset.metadata_file_name)) as f:
+                self.__metadata = [json.loads(line) for line in f][:len(self)]
+        return self.__metadata
+
+    def get_variant(self, variant):
+        """returns the images of the passed variant (e. g. 'nofigure') for all sets
+        :type variant: str
+        :return: numpy array of shape (number of sets, height, width)"""
+        return self.images[:, self.variants.index(variant)]
+
+
+class RasterDatasetWriter:
+    def __init__(self, directory, variants=("onlyfigure", "embeddedfigure", "nofigure")):
+        """generate a RasterDatasetWriter instance, for writing sets of images to a RasterDataset. if the
+        directory already holds a dataset, sets are appended to it
+        :param directory: directory to write to (created if it doesn't exist)
+        :type directory: str
+        :param variants: variant names of the images in each set, in the order they are stored in
+        :type variants: tuple of str"""
+        self.directory = directory
+        self.variants = tuple(variants)
+        self.height = None
+        self.width = None
+        self.num_sets = 0
+        os.makedirs(directory, exist_ok=True)
+        info_path = os.path.join(directory, RasterDataset.info_file_name)
+        if os.path.exists(info_path):
+            self.open_existing()
+        self.__images_file = open(os.path.join(directory, RasterDataset.images_file_name), "ab")
+        self.__metadata_file = open(os.path.join(directory, RasterDataset.metadata_file_name), "a")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open_existing(self):
+        """prepare appending to the existing dataset in the writer's directory. a set that was only
+        partly written (e. g. because of a crash) is removed
+        :return: None"""
+        with open(os.path.join(self.directory, RasterDataset.info_file_name)) as f:
+            info = json.load(f)
+        assert tuple(info["variants"]) == self.variants, "the existing dataset has different variants"
+        self.height, self.width = info["height"], info["width"]
+        images_path = os.path.join(self.directory, RasterDataset.images_file_name)
+        metadata_path = os.path.join(self.directory, RasterDataset.metadata_file_name)
+        with open(metadata_path) as f:
+            metadata_lines = [line for line in f if line.endswith("\n")]
+        set_size = RasterDataset.get_set_size(len(self.variants), self.height, self.width)
+        self.num_sets = min(os.path.getsize(images_path) // set_size, len(metadata_lines))
+        os.truncate(images_path, self.num_sets * set_size)
+        with open(metadata_path, "w") as f:
+            f.writelines(metadata_lines[:self.num_sets])
+
+    def write_info(self):
+        with open(os.path.join(self.directory, RasterDataset.info_file_name), "w") as f:
+            json.dump({"variants": list(self.variants), "height": self.height, "width": self.width,
+                       "dtype": "uint8", "num_sets": self.num_sets}, f)
+
+    def write_set(self, stimulus_id, images, metadata):
+        """append a set of images and its metadata. all images must have the same size
+        :param stimulus_id: identifier of the set
+        :type stimulus_id: str
+        :param images: images of the set, by variant name (must hold all of the writer's variants)
+        :type images: dict of PIL.Image.Image
+        :param metadata: metadata of the set, must hold 'background_color' and 'line_color' (see
+        LeftImage.get_metadata())
+        :type metadata: dict
+        :return: the dataset's directory and the set's index in the dataset, as '<directory>#<index>'"""
+        with Profiler.stage("encode"):
+            # label images (e. g. a 'figuremask' variant) are stored as they are
+            coverages = [np.asarray(images[variant].convert("L"), dtype=np.float32) / 255
+                         if ImageEncoder.is_label(images[variant]) else
+                         ImageEncoder.get_coverage(images[variant], metadata["background_color"], metadata["line_color"])
+                         for variant in self.variants]
+            raster = np.rint(np.stack(coverages) * 255).astype(np.uint8)
+        if self.height is None:
+            self.height, self.width = raster.shape[1:]
+            self.write_info()
+        assert raster.shape[1:] == (self.height, self.width), \
+            "images must be {}x{} pixels".format(self.width, self.height)
+        with Profiler.stage("write"):
+            self.__images_file.write(raster.tobytes())
+            self.__metadata_file.write(json.dumps(dict(metadata, stimulus_id=stimulus_id)) + "\n")
+        self.num_sets += 1
+        return "{}#{}".format(self.directory, self.num_sets - 1)
+
+    def flush(self):
+        """write everything written so far to disk
+        :return: None"""
+        for f in (self.__images_file, self.__metadata_file):
+            f.flush()
+            os.fsync(f.fileno())
+        if self.height is not None:
+            self.write_info()
+
+    def close(self):
+        """finish writing. must be called when done writing
+        :return: None"""
+        if self.__images_file.closed:
+            return
+        self.__images_file.close()
+        self.__metadata_file.close()
+        if self.height is not None:
+            self.write_info()
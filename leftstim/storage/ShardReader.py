@@ -0,0 +1,113 @@
+import csv
+import glob
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+from PIL import Image
+
+from leftstim.storage.ShardWriter import ShardWriter
+
+
+class ShardReader:
+    def __init__(self, directory, decode=True):
+        """generate a ShardReader instance, for reading sets of images written by a ShardWriter
+        :param directory: directory holding the shards and the index
+        :type directory: str
+        :param decode: if True, images are returned as PIL images, otherwise as encoded bytes
+        :type decode: bool"""
+        self.directory = directory
+        self.decode = decode
+        self.__index = None
+        self.has_index = os.path.exists(os.path.join(directory, ShardWriter.index_file_name))
+        if self.has_index:
+            # the index may also refer to shards in other directories (see RunMerger)
+            shards = dict.fromkeys(self.index.values())
+            self.shard_paths = [os.path.normpath(os.path.join(directory, shard)) for shard in shards]
+        else:
+            self.shard_paths = sorted(path for shard_format in ShardWriter.formats
+                                      for path in glob.glob(os.path.join(directory, "*." + shard_format)))
+
+    @property
+    def index(self):
+        """dict mapping each stimulus id to the file name of the shard it is stored in (read on first use)"""
+        if self.__index is None:
+            with open(os.path.join(self.directory, ShardWriter.index_file_name), newline="") as f:
+                rows = csv.reader(f)
+                next(rows)
+                self.__index = {stimulus_id: shard for stimulus_id, shard in rows}
+        return self.__index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        """iterate over all sets, shard by shard, reading each shard sequentially. if a set was written
+        more than once (e. g. when a run was resumed), only the copy recorded in the index is returned.
+        sets that aren't recorded in the index (e. g. because the writer crashed before writing the index)
+        are skipped
+        :return: iterator of (stimulus id, dict of images by variant name, metadata dict)"""
+        for shard_path in self.shard_paths:
+            for stimulus_id, images, metadata in self.iter_shard(shard_path):
+                if not self.has_index:
+                    yield stimulus_id, images, metadata
+                    continue
+                shard = self.index.get(stimulus_id)
+                if shard is not None and os.path.normpath(os.path.join(self.directory, shard)) == shard_path:
+                    yield stimulus_id, images, metadata
+
+    def iter_members(self, shard_path):
+        """iterate over the members of the passed shard, in the order they were written. a tar shard
+        that was cut off (e. g. because the writer crashed) is read up to its last complete member, while
+        a zip shard that wasn't finished can't be read at all and is skipped
+        :return: iterator of (member name, bytes)"""
+        if shard_path.endswith(".zip"):
+            try:
+                shard = zipfile.ZipFile(shard_path)
+            except zipfile.BadZipFile:
+                return
+            with shard:
+                for member_info in shard.infolist():
+                    yield member_info.filename, shard.read(member_info)
+        else:
+            # streaming mode, so that the shard is read strictly sequentially
+            try:
+                with tarfile.open(shard_path, "r|") as shard:
+                    for member_info in shard:
+                        if member_info.isfile():
+                            data = shard.extractfile(member_info).read()
+                            if len(data) < member_info.size:
+                                return
+                            yield member_info.name, data
+            except (tarfile.ReadError, EOFError):
+                return
+
+    def iter_shard(self, shard_path):
+        """iterate over the sets in the passed shard
+        :return: iterator of (stimulus id, dict of images by variant name, metadata dict)"""
+        stimulus_id, images, metadata = None, {}, None
+        for name, data in self.iter_members(shard_path):
+            member_id, member_type = name.split(".", 1)
+            if member_id != stimulus_id:
+                if stimulus_id is not None:
+                    yield stimulus_id, images, metadata
+                stimulus_id, images, metadata = member_id, {}, None
+            if member_type == "json":
+                metadata = json.loads(data.decode("utf-8"))
+            else:
+                variant = member_type.split(".")[0]
+                images[variant] = Image.open(io.BytesIO(data)) if self.decode else data
+        if stimulus_id is not None:
+            yield stimulus_id, images, metadata
+
+    def read_set(self, stimulus_id):
+        """read the set with the passed id, only reading the shard that holds it (see index)
+        :type stimulus_id: str
+        :return: (dict of images by variant name, metadata dict)"""
+        shard_path = os.path.join(self.directory, self.index[stimulus_id])
+        for member_id, images, metadata in self.iter_shard(shard_path):
+            if member_id == stimulus_id:
+                return images, metadata
+        raise KeyError(stimulus_id)
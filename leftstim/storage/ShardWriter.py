@@ -0,0 +1,155 @@
+import csv
+import glob
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+
+from leftstim.instrumentation.Profiler import Profiler
+from leftstim.storage.ImageEncoder import ImageEncoder
+
+
+class ShardWriter:
+    """
+    Writes sets of images, and their metadata, sequentially into tar or zip files ('shards') of
+    limited size, instead of into separate files. Within a shard, a set with identifier <id> is
+    stored as '<id>.json' (metadata) followed by '<id>.<variant>.png' for each image. An index file
+    ('index.csv') records which shard each set was written to. Shards can be read using ShardReader.
+    If the directory already holds shards, new sets are written to new shards and added to the index.
+    """
+    index_file_name = "index.csv"
+    formats = ("tar", "zip")
+
+    def __init__(self, directory, shard_format="tar", max_shard_bytes=256 * 1024 ** 2, max_sets_per_shard=10000,
+                 encoder=None, prefix="shard"):
+        """generate a ShardWriter instance
+        :param directory: directory to write the shards and the index to (created if it doesn't exist)
+        :type directory: str
+        :param shard_format: 'tar' or 'zip' (both uncompressed, as the images are compressed already)
+        :type shard_format: str
+        :param max_shard_bytes: a new shard is started before writing a set if the current shard
+        has reached this size. sets are never split between shards
+        :type max_shard_bytes: int
+        :param max_sets_per_shard: maximum number of sets per shard
+        :type max_sets_per_shard: int
+        :param encoder: encoder to use. if None, images are saved as RGB PNGs
+        :type encoder: ImageEncoder
+        :param prefix: shard file names are '<prefix>-<shard number>.<shard_format>'
+        :type prefix: str"""
+        assert shard_format in ShardWriter.formats, "shard_format must be 'tar' or 'zip'"
+        self.directory = directory
+        self.shard_format = shard_format
+        self.max_shard_bytes = max_shard_bytes
+        self.max_sets_per_shard = max_sets_per_shard
+        self.encoder = encoder if encoder is not None else ImageEncoder("rgb")
+        self.prefix = prefix
+        self.shard_paths = sorted(glob.glob(os.path.join(directory, "{}-*.{}".format(prefix, shard_format))))
+        self.num_sets = 0
+        self.__shard = None
+        self.__shard_bytes = 0
+        self.__shard_sets = 0
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, ShardWriter.index_file_name)
+        index_exists = os.path.exists(index_path)
+        self.__index_file = open(index_path, "a", newline="")
+        self.__index = csv.writer(self.__index_file)
+        if not index_exists:
+            self.__index.writerow(["stimulus_id", "shard"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start_shard(self):
+        """finish the current shard, if any, and start writing to a new one
+        :return: None"""
+        self.close_shard()
+        shard_path = os.path.join(self.directory, "{}-{:06d}.{}".format(self.prefix, len(self.shard_paths),
+                                                                       self.shard_format))
+        if self.shard_format == "tar":
+            self.__shard = tarfile.open(shard_path, "w", format=tarfile.PAX_FORMAT)
+        else:
+            self.__shard = zipfile.ZipFile(shard_path, "w", compression=zipfile.ZIP_STORED)
+        self.shard_paths.append(shard_path)
+        self.__shard_bytes = 0
+        self.__shard_sets = 0
+
+    def close_shard(self):
+        """finish the current shard, if any
+        :return: None"""
+        if self.__shard is not None:
+            self.__shard.close()
+            self.__shard = None
+        self.__index_file.flush()
+
+    def flush(self):
+        """write everything written so far to disk. a tar shard is synced without finishing it (a tar
+        shard that isn't finished can still be read sequentially), while a zip shard is finished, as it
+        can't be read at all before its central directory has been written. the next set is then written
+        to a new shard
+        :return: None"""
+        if self.__shard is not None:
+            if self.shard_format == "tar":
+                self.__shard.fileobj.flush()
+                os.fsync(self.__shard.fileobj.fileno())
+            else:
+                self.close_shard()
+                with open(self.shard_paths[-1], "rb+") as f:
+                    os.fsync(f.fileno())
+        self.__index_file.flush()
+        os.fsync(self.__index_file.fileno())
+
+    def add_member(self, name, data):
+        """add a file with the passed name and contents to the current shard
+        :type name: str
+        :type data: bytes
+        :return: None"""
+        if self.shard_format == "tar":
+            member_info = tarfile.TarInfo(name)
+            member_info.size = len(data)
+            member_info.mtime = int(time.time())
+            self.__shard.addfile(member_info, io.BytesIO(data))
+        else:
+            self.__shard.writestr(name, data)
+        self.__shard_bytes += len(data)
+
+    def write_set(self, stimulus_id, images, metadata):
+        """write a set of images and its metadata to the current shard (starting a new shard first,
+        if the current one is full)
+        :param stimulus_id: identifier of the set, may not contain '.' or '/'
+        :type stimulus_id: str
+        :param images: images of the set, by variant name (e. g. 'embeddedfigure')
+        :type images: dict of PIL.Image.Image
+        :param metadata: metadata of the set, must hold 'background_color' and 'line_color' (see
+        LeftImage.get_metadata())
+        :type metadata: dict
+        :return: the path of the shard the set was written to"""
+        assert "." not in stimulus_id and "/" not in stimulus_id, "stimulus_id may not contain '.' or '/'"
+        if self.__shard is None or self.__shard_bytes >= self.max_shard_bytes or \
+                self.__shard_sets >= self.max_sets_per_shard:
+            self.start_shard()
+        encoded_images = {}
+        with Profiler.stage("encode"):
+            for variant, image in images.items():
+                encoded_images[variant] = self.encoder.to_bytes(image, metadata["background_color"],
+                                                                metadata["line_color"])
+        with Profiler.stage("write"):
+            self.add_member(stimulus_id + ".json", json.dumps(metadata).encode("utf-8"))
+            for variant, data in encoded_images.items():
+                self.add_member(stimulus_id + "." + variant + self.encoder.extension, data)
+        self.__index.writerow([stimulus_id, os.path.basename(self.shard_paths[-1])])
+        self.__shard_sets += 1
+        self.num_sets += 1
+        return self.shard_paths[-1]
+
+    def close(self):
+        """finish the current shard and the index. must be called when done writing
+        :return: None"""
+        if self.__index_file.closed:
+            return
+        self.close_shard()
+        self.__index_file.close()
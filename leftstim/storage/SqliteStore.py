@@ -0,0 +1,189 @@
+import io
+import json
+import sqlite3
+
+from PIL import Image
+
+from leftstim.instrumentation.Profiler import Profiler
+from leftstim.storage.ImageEncoder import ImageEncoder
+
+
+class SqliteStore:
+    """
+    Stores sets of images and their metadata in a single SQLite database file. Metadata fields that are
+    useful for selecting stimuli are stored in indexed columns, so that e. g. all aligned C3 stimuli
+    with at least 8 distractor lines can be found without decoding any images (see query()). Can be
+    used as a sink for LeftImage.save_to_sink().
+    """
+    columns = (("figure_name", "TEXT"), ("seed", "INTEGER"),
+               ("figure_x", "REAL"), ("figure_y", "REAL"), ("figure_width", "REAL"), ("figure_height", "REAL"),
+               ("figure_aligned", "INTEGER"), ("figure_shifted", "INTEGER"),
+               ("num_figure_lines", "INTEGER"), ("num_extended_figure_lines", "INTEGER"),
+               ("num_non_fig_lines", "INTEGER"), ("num_figure_linked_lines", "INTEGER"),
+               ("num_distractor_lines", "INTEGER"))
+    indexed_columns = ("figure_name", "seed", "figure_aligned", "figure_shifted", "num_distractor_lines")
+
+    def __init__(self, file_path, encoder=None, batch_size=500):
+        """generate a SqliteStore instance, opening (or creating) the database at the passed path
+        :param file_path: path of the database file
+        :type file_path: str
+        :param encoder: encoder to use for the images. if None, images are stored as RGB PNGs
+        :type encoder: ImageEncoder
+        :param batch_size: number of sets written per transaction. sets written since the last
+        transaction was committed are lost if the process crashes
+        :type batch_size: int"""
+        self.file_path = file_path
+        self.encoder = encoder if encoder is not None else ImageEncoder("rgb")
+        self.batch_size = batch_size
+        self.__num_uncommitted = 0
+        self.connection = sqlite3.connect(file_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM stimuli").fetchone()[0]
+
+    def __contains__(self, stimulus_id):
+        return self.connection.execute("SELECT 1 FROM stimuli WHERE stimulus_id = ?",
+                                       (stimulus_id,)).fetchone() is not None
+
+    def create_tables(self):
+        """create the database's tables and indexes, if they don't exist yet
+        :return: None"""
+        column_definitions = ", ".join("{} {}".format(name, sql_type) for name, sql_type in SqliteStore.columns)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS stimuli (stimulus_id TEXT PRIMARY KEY, {}, "
+                                    "metadata TEXT NOT NULL)".format(column_definitions))
+            self.connection.execute("CREATE TABLE IF NOT EXISTS images (stimulus_id TEXT NOT NULL, "
+                                    "variant TEXT NOT NULL, format TEXT NOT NULL, data BLOB NOT NULL, "
+                                    "PRIMARY KEY (stimulus_id, variant)) WITHOUT ROWID")
+            for column in SqliteStore.indexed_columns:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS stimuli_{0} ON stimuli ({0})".format(column))
+
+    @staticmethod
+    def get_column_values(metadata):
+        """returns the values of the indexed columns for the passed metadata (see LeftImage.get_metadata())
+        :type metadata: dict
+        :return: list"""
+        values = dict(metadata)
+        values["num_distractor_lines"] = metadata.get("num_non_fig_lines", 0) + \
+            metadata.get("num_figure_linked_lines", 0)
+        return [values.get(name) for name, _ in SqliteStore.columns]
+
+    def write_set(self, stimulus_id, images, metadata):
+        """write a set of images and its metadata. replaces an existing set with the same id. the
+        write is committed together with the following ones, once batch_size sets have been written
+        (or when commit() or close() is called)
+        :param stimulus_id: identifier of the set
+        :type stimulus_id: str
+        :param images: images of the set, by variant name (e. g. 'embeddedfigure')
+        :type images: dict of PIL.Image.Image
+        :param metadata: metadata of the set, must hold 'background_color' and 'line_color' (see
+        LeftImage.get_metadata())
+        :type metadata: dict
+        :return: the path of the database file"""
+        with Profiler.stage("encode"):
+            image_rows = [(stimulus_id, variant, self.encoder.extension[1:],
+                           self.encoder.to_bytes(image, metadata["background_color"], metadata["line_color"]))
+                          for variant, image in images.items()]
+        with Profiler.stage("write"):
+            self.connection.execute("DELETE FROM images WHERE stimulus_id = ?", (stimulus_id,))
+            self.connection.execute("INSERT OR REPLACE INTO stimuli VALUES ({})".format(
+                ", ".join(["?"] * (len(SqliteStore.columns) + 2))),
+                [stimulus_id] + SqliteStore.get_column_values(metadata) + [json.dumps(metadata)])
+            self.connection.executemany("INSERT INTO images VALUES (?, ?, ?, ?)", image_rows)
+        self.__num_uncommitted += 1
+        if self.__num_uncommitted >= self.batch_size:
+            self.commit()
+        return self.file_path
+
+    def commit(self):
+        """commit all sets written since the last commit
+        :return: None"""
+        with Profiler.stage("write"):
+            self.connection.commit()
+        self.__num_uncommitted = 0
+
+    def flush(self):
+        """same as commit()
+        :return: None"""
+        self.commit()
+
+    def close(self):
+        """commit all remaining sets and close the database
+        :return: None"""
+        self.commit()
+        self.connection.close()
+
+    def query(self, figure_name=None, figure_aligned=None, figure_shifted=None, min_distractor_lines=None,
+              max_distractor_lines=None, seed=None, limit=None):
+        """returns the ids of all stored sets matching all of the passed criteria (criteria that are None
+        are ignored), in the order they were written
+        :param figure_name: name of the figure, e. g. 'C3', or a list of names
+        :type figure_name: str or list of str
+        :type figure_aligned: bool
+        :type figure_shifted: bool
+        :param min_distractor_lines: minimum number of non-figure lines (including lines attached to the figure)
+        :type min_distractor_lines: int
+        :param max_distractor_lines: maximum number of non-figure lines
+        :type max_distractor_lines: int
+        :type seed: int
+        :param limit: maximum number of ids to return
+        :type limit: int
+        :return: list of str"""
+        conditions, parameters = [], []
+        if figure_name is not None:
+            figure_names = [figure_name] if isinstance(figure_name, str) else list(figure_name)
+            conditions.append("figure_name IN ({})".format(", ".join(["?"] * len(figure_names))))
+            parameters.extend(figure_names)
+        for column, value in (("figure_aligned", figure_aligned), ("figure_shifted", figure_shifted),
+                              ("seed", seed)):
+            if value is not None:
+                conditions.append(column + " = ?")
+                parameters.append(int(value))
+        if min_distractor_lines is not None:
+            conditions.append("num_distractor_lines >= ?")
+            parameters.append(min_distractor_lines)
+        if max_distractor_lines is not None:
+            conditions.append("num_distractor_lines <= ?")
+            parameters.append(max_distractor_lines)
+        statement = "SELECT stimulus_id FROM stimuli"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += " ORDER BY rowid"
+        if limit is not None:
+            statement += " LIMIT ?"
+            parameters.append(limit)
+        return [row[0] for row in self.connection.execute(statement, parameters)]
+
+    def get_metadata(self, stimulus_id):
+        """returns the metadata of the set with the passed id
+        :type stimulus_id: str
+        :return: dict"""
+        row = self.connection.execute("SELECT metadata FROM stimuli WHERE stimulus_id = ?",
+                                      (stimulus_id,)).fetchone()
+        if row is None:
+            raise KeyError(stimulus_id)
+        return json.loads(row[0])
+
+    def get_images(self, stimulus_id, variants=None, decode=True):
+        """returns the images of the set with the passed id
+        :type stimulus_id: str
+        :param variants: names of the variants to return (all if None)
+        :type variants: list of str
+        :param decode: if True, images are returned as PIL images, otherwise as encoded bytes
+        :type decode: bool
+        :return: dict of images by variant name"""
+        rows = self.connection.execute("SELECT variant, data FROM images WHERE stimulus_id = ?", (stimulus_id,))
+        images = {variant: Image.open(io.BytesIO(data)) if decode else data for variant, data in rows
+                  if variants is None or variant in variants}
+        if not images and stimulus_id not in self:
+            raise KeyError(stimulus_id)
+        return images
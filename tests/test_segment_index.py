@@ -0,0 +1,36 @@
+import unittest
+
+from leftstim.build.Recipe import Recipe
+
+
+class SegmentIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.img = Recipe().build(3)
+        self.index = self.img.get_segment_index()
+        # a figure line that has been extended at its start
+        self.line = next(line for line in self.img.figure.lines
+                         if (line.start_ext_point.x, line.start_ext_point.y) != (line.start_point.x, line.start_point.y))
+
+    def test_click_on_figure_line(self):
+        x = (self.line.start_point.x + self.line.end_point.x) / 2
+        y = (self.line.start_point.y + self.line.end_point.y) / 2
+        hit = self.index.hit_test(x, y, max_distance=5)
+        self.assertEqual(hit["kind"], "figure")
+        self.assertTrue(hit["is_figure"])
+
+    def test_click_on_extension(self):
+        x = (self.line.start_ext_point.x + self.line.start_point.x) / 2
+        y = (self.line.start_ext_point.y + self.line.start_point.y) / 2
+        hit = self.index.hit_test(x, y, max_distance=5)
+        self.assertEqual(hit["kind"], "figure_extension")
+        self.assertFalse(hit["is_figure"])
+
+    def test_trace_along_extension(self):
+        points = [(self.line.start_ext_point.x, self.line.start_ext_point.y),
+                  (self.line.start_point.x, self.line.start_point.y)]
+        trace = self.index.hit_test_polyline(points, max_distance=1, step=1)
+        self.assertLess(trace["figure_fraction"], 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
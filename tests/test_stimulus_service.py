@@ -0,0 +1,70 @@
+import json
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from leftstim.build.Recipe import Recipe
+from leftstim.service.StimulusService import StimulusService
+
+
+class BrokenRecipe(Recipe):
+    def build(self, seed, **kwargs):
+        raise AttributeError("no side-to-side line could be added")
+
+
+class StimulusServiceTest(unittest.TestCase):
+    def setUp(self):
+        recipes = {"default": Recipe(min_extra_lines=6, max_extra_lines=8), "broken": BrokenRecipe()}
+        self.service = StimulusService(recipes, port=0, backend="pil")
+        self.service.start()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def get(self, path):
+        with urlopen(self.service.url + path, timeout=30) as response:
+            return response.status, dict(response.headers), response.read()
+
+    def test_stimulus(self):
+        status, headers, body = self.get("/stimulus?recipe=default&seed=3&variant=nofigure")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["Content-Type"], "image/png")
+        self.assertEqual(headers["X-Cache"], "miss")
+        self.assertTrue(body.startswith(b"\x89PNG"))
+        status, headers, _ = self.get("/stimulus?recipe=default&seed=3")
+        self.assertEqual(headers["X-Cache"], "hit")
+
+    def test_metadata(self):
+        status, headers, body = self.get("/metadata?recipe=default&seed=3")
+        metadata = json.loads(body)
+        self.assertEqual(status, 200)
+        self.assertEqual(metadata["stimulus_id"], headers["X-Stimulus-Id"])
+        self.assertEqual(metadata["recipe"], "default")
+        self.assertEqual(metadata["seed"], 3)
+
+    def test_stats(self):
+        self.get("/metadata?recipe=default&seed=1")
+        self.get("/metadata?recipe=default&seed=1")
+        status, _, body = self.get("/stats")
+        stats = json.loads(body)
+        self.assertEqual(status, 200)
+        self.assertEqual((stats["num_requests"], stats["num_cache_hits"]), (2, 1))
+        self.assertIsNotNone(stats["p50_ms"])
+
+    def test_bad_request(self):
+        for query in ("recipe=unknown&seed=1", "recipe=default&seed=one", "recipe=default",
+                      "recipe=default&seed=1&variant=unknown"):
+            with self.assertRaises(HTTPError) as context:
+                self.get("/stimulus?" + query)
+            self.assertEqual(context.exception.code, 400)
+
+    def test_build_error(self):
+        with self.assertRaises(HTTPError) as context:
+            self.get("/stimulus?recipe=broken&seed=1")
+        self.assertEqual(context.exception.code, 500)
+        self.assertIn("AttributeError", json.loads(context.exception.read())["error"])
+        self.assertEqual(self.service.get_stats()["num_requests"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()